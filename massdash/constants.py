@@ -31,6 +31,23 @@ URL_PRETRAINED_CONFORMER = "https://github.com/Roestlab/massdash/releases/downlo
 URL_TEST_RAW_MZML_IM = "https://github.com/Roestlab/massdash/raw/dev/test/test_data/mzml/ionMobilityTest.mzML"
 URL_TEST_OSW_IM = "https://github.com/Roestlab/massdash/raw/dev/test/test_data/osw/ionMobilityTest.osw"
 
+######################
+## Caches
+
+# Directory of the persistent on disk caches (e.g. extracted feature maps), can be changed with the MASSDASH_CACHE_DIR environment variable
+MASSDASH_CACHE_DIR = os.environ.get('MASSDASH_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'massdash'))
+
+# Maximum size (bytes) of the in memory cache of decoded chromatograms shared by all sqMass files, can be changed with the MASSDASH_CHROMATOGRAM_CACHE_SIZE environment variable
+CHROMATOGRAM_CACHE_SIZE = int(os.environ.get('MASSDASH_CHROMATOGRAM_CACHE_SIZE', 512 * 1024**2))
+
+######################
+## SQLite
+
+# Maximum number of bytes of a read only SQLite file (OSW, PQP, sqMass) accessed through memory mapping, can be changed with the MASSDASH_SQLITE_MMAP_SIZE environment variable
+SQLITE_MMAP_SIZE = int(os.environ.get('MASSDASH_SQLITE_MMAP_SIZE', 1024**3))
+# Size (KiB) of the page cache of a SQLite connection, can be changed with the MASSDASH_SQLITE_CACHE_SIZE environment variable
+SQLITE_CACHE_SIZE = int(os.environ.get('MASSDASH_SQLITE_CACHE_SIZE', 64 * 1024))
+
 ######################
 ## Data Handling
 
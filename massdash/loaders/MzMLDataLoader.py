@@ -3,18 +3,58 @@ massdash/loaders/MzMLDataLoader
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 """
 
+import itertools
 from os.path import basename, splitext
-from typing import Dict, List, Union, Literal
+from typing import Dict, List, Tuple, Union, Literal, Iterable, Iterator, Optional
 import numpy as np
 import pandas as pd
+from joblib import Parallel, delayed
 
 # Loaders
-from .access import MzMLDataAccess
+from .access import MzMLDataAccess, FeatureMapCache
+from .access.MzMLDataAccess import _get_worker_data_access
 from .GenericSpectrumLoader import GenericSpectrumLoader
 # Structs
-from ..structs import TransitionGroup, FeatureMap, TargetedDIAConfig, FeatureMapCollection, TopTransitionGroupFeatureCollection, TransitionGroupCollection
+from ..structs import TransitionGroup, TransitionGroupFeature, FeatureMap, TargetedDIAConfig, FeatureMapCollection, TopTransitionGroupFeatureCollection, TransitionGroupCollection
 # Utils
-from ..util import LOGGER
+from ..util import LOGGER, file_fingerprint
+
+def _reduce_spectra_columns(filename: str, readOptions: str, features: List[TransitionGroupFeature], config: TargetedDIAConfig, verbose: bool=False, cache_dir: Optional[str]=None, meta_data_sidecar: bool=False) -> List[Dict[str, np.ndarray]]:
+    '''
+    Extract a batch of features from a single run in a worker process, the spectra of the run are swept once for all features (see MzMLDataAccess.reduce_spectra). The worker opens its own handle on the run once and builds (or loads) its spectrum meta data index itself, only the file name is sent with every task (see _get_worker_data_access).
+
+    Args:
+        filename (str): The path to the mzML file
+        readOptions (str): The readOptions the run is opened with, see MzMLDataAccess
+        features (List[TransitionGroupFeature]): The features to extract
+        config (TargetedDIAConfig): Configuration object containing the extraction parameters
+        verbose (bool): Enables verbose mode
+        cache_dir (str): The directory of the cached mzML files, see MzMLDataAccess
+        meta_data_sidecar (bool): Whether the spectrum meta data index of the run is cached in a sidecar file, see MzMLDataAccess
+
+    Returns:
+        List[Dict[str, np.ndarray]]: The columns of the extracted feature map of every feature, the parent rebuilds the FeatureMaps from these arrays
+    '''
+    feature_maps = _get_worker_data_access(filename, readOptions, verbose, cache_dir, meta_data_sidecar).reduce_spectra(features, config)
+    return [{col: feature_map.feature_df[col].to_numpy() for col in feature_map.feature_df.columns} for feature_map in feature_maps]
+
+def _extract_chromatograms(filename: str, readOptions: str, features: List[TransitionGroupFeature], config: TargetedDIAConfig, verbose: bool=False, cache_dir: Optional[str]=None, meta_data_sidecar: bool=False) -> List[TransitionGroup]:
+    '''
+    Extract the chromatograms of a batch of features from a single run in a worker process, see _reduce_spectra_columns and MzMLDataAccess.extract_chromatograms
+
+    Args:
+        filename (str): The path to the mzML file
+        readOptions (str): The readOptions the run is opened with, see MzMLDataAccess
+        features (List[TransitionGroupFeature]): The features to extract
+        config (TargetedDIAConfig): Configuration object containing the extraction parameters
+        verbose (bool): Enables verbose mode
+        cache_dir (str): The directory of the cached mzML files, see MzMLDataAccess
+        meta_data_sidecar (bool): Whether the spectrum meta data index of the run is cached in a sidecar file, see MzMLDataAccess
+
+    Returns:
+        List[TransitionGroup]: The extracted chromatograms of every feature
+    '''
+    return _get_worker_data_access(filename, readOptions, verbose, cache_dir, meta_data_sidecar).extract_chromatograms(features, config)
 
 
 class MzMLDataLoader(GenericSpectrumLoader):
@@ -25,16 +65,60 @@ class MzMLDataLoader(GenericSpectrumLoader):
         rsltsFile: (str) The path to the report file (DIANN-TSV or OSW)
         dataFiles: (str/List[str]) The path to the mzML file(s)
         libraryFile: (str) The path to the library file (.tsv or .pqp)
+        threads: (int) Number of worker processes used to extract the runs in parallel, runs are extracted sequentially if 1
+        metaDataSidecar: (bool) Cache the spectrum meta data index of every mzML file in a sidecar file next to it, so that reopening a run does not parse its spectrum meta data again
+        readOptions: (str/Dict[str, str]) How the mzML files are read, either 'ondisk', 'cached', 'columnar' or 'hot' (see MzMLDataAccess). Either a single mode for all runs or a mode per run, keyed by run name or mzML file, runs not listed are read 'ondisk'
+        cachedMzMLDir: (str) The directory the cached mzML files of the runs read 'cached' are stored in, defaults to 'cached_mzml' in MASSDASH_CACHE_DIR
+        hotMemoryBudget: (int) The maximum size in bytes of the peaks of a run read 'hot', which are held in memory. Hot runs are always extracted by this process, not by worker processes
+        featureMapCache: (FeatureMapCache) Persistent on disk cache of extracted FeatureMaps, None if extracted FeatureMaps are not cached
         
     '''
-    def __init__(self, **kwargs):
+    def __init__(self, threads: int=1, metaDataSidecar: bool=False, readOptions: Union[Literal['ondisk', 'cached', 'columnar', 'hot'], Dict[str, Literal['ondisk', 'cached', 'columnar', 'hot']]]='ondisk', cachedMzMLDir: Optional[str]=None, hotMemoryBudget: int=4 * 1024**3, featureMapCache: Union[None, str, FeatureMapCache]=None, **kwargs):
         super().__init__(**kwargs) 
-        self.dataAccess = [MzMLDataAccess(f, 'ondisk', verbose=self.verbose) for f in self.dataFiles]
+        self.threads = threads
+        self.metaDataSidecar = metaDataSidecar
+        self.readOptions = readOptions
+        self.cachedMzMLDir = cachedMzMLDir
+        self.hotMemoryBudget = hotMemoryBudget
+        # a cache directory can be given instead of a FeatureMapCache
+        self.featureMapCache = FeatureMapCache(featureMapCache) if isinstance(featureMapCache, str) else featureMapCache
+        self._runHashes = {}
+        self.dataAccess = [MzMLDataAccess(f, self._getReadOptions(f), verbose=self.verbose, meta_data_sidecar=metaDataSidecar, cache_dir=cachedMzMLDir, hot_memory_budget=hotMemoryBudget) for f in self.dataFiles]
         self.has_im = np.all([d.has_im for d in self.dataAccess])
         if self.libraryAccess is None:
             raise ValueError("If .osw file is not supplied, library file is required for MzMLDataLoader to perform targeted extraction")
-                   
-    def loadTransitionGroups(self, pep_id: str, charge: int, config: TargetedDIAConfig, runNames: Union[None, str, List[str]]=None) -> Dict[str, TransitionGroup]:
+
+
+    def _getReadOptions(self, dataFile: str) -> str:
+        '''
+        Get the mode a run is read with
+
+        Args:
+            dataFile (str): The path to the mzML file
+
+        Returns:
+            str: The readOptions of the run, see MzMLDataAccess
+        '''
+        if isinstance(self.readOptions, str):
+            return self.readOptions
+        runName = splitext(basename(dataFile))[0]
+        return self.readOptions.get(dataFile, self.readOptions.get(runName, 'ondisk'))
+
+    def _getRunHash(self, dataAccess: MzMLDataAccess) -> str:
+        '''
+        Get the content hash of a run, computed once per run
+
+        Args:
+            dataAccess (MzMLDataAccess): The run
+
+        Returns:
+            str: The content hash of the run (see util.file_fingerprint)
+        '''
+        if dataAccess.runName not in self._runHashes:
+            self._runHashes[dataAccess.runName] = file_fingerprint(dataAccess.filename)['hash']
+        return self._runHashes[dataAccess.runName]
+
+    def loadTransitionGroups(self, pep_id: str, charge: int, config: TargetedDIAConfig, runNames: Union[None, str, List[str]]=None, chromatogramsOnly: bool=False) -> Dict[str, TransitionGroup]:
         '''
         Loads the transition group for a given peptide ID and charge across all files
 
@@ -43,9 +127,15 @@ class MzMLDataLoader(GenericSpectrumLoader):
             charge (int): Charge
             config (TargetedDIAConfig): Configuration object containing the extraction parameters
             runNames (None | str | List[str]): Name of the run to extract the transition group from. If None, all runs are extracted. If str, only the specified run is extracted. If List[str], only the specified runs are extracted.
+            chromatogramsOnly (bool): If True, the chromatograms are accumulated directly from the spectra without building (or caching) FeatureMaps, see MzMLDataAccess.extract_chromatograms
         Return:
             dict[str, TransitionGroup]: Dictionary of TransitionGroups, with keys as filenames
         '''
+        if chromatogramsOnly:
+            dataAccesses = self._getDataAccesses(runNames)
+            transition_groups = {runName: transition_group for runName, _, _, transition_group in self._iterRunTransitionGroups([(pep_id, charge)], config, dataAccesses)}
+            return TransitionGroupCollection({ d.runName: transition_groups[d.runName] for d in dataAccesses })
+
         out_feature_map = self.loadFeatureMaps(pep_id, charge, config, runNames=runNames)
 
         return TransitionGroupCollection({ run: data.to_chromatograms() for run, data in out_feature_map.items() })
@@ -77,6 +167,9 @@ class MzMLDataLoader(GenericSpectrumLoader):
         '''
         Loads a dictionary of FeatureMaps (where the keys are the filenames) from the results file
 
+        If the loader was created with more than one thread, the runs are extracted in parallel in a pool of worker processes. If only a single run is extracted, its spectra are filtered in parallel instead.
+        If the loader has a FeatureMapCache, cached FeatureMaps are not extracted again and newly extracted FeatureMaps are added to the cache.
+
         Args:
             pep_id (str): Peptide ID
             charge (int): Charge
@@ -84,29 +177,200 @@ class MzMLDataLoader(GenericSpectrumLoader):
         Returns:
             FeatureMapCollection: FeatureMapCollection containing FeatureMap objects for each file
         '''
+        dataAccesses = self._getDataAccesses(runNames)
+        feature_maps = {runName: feature_map for runName, _, _, feature_map in self._iterRunFeatureMaps([(pep_id, charge)], config, dataAccesses)}
+
         out = FeatureMapCollection()
-        
-        def _loadFeatureMap(dataAccess):
-            top_feature = self.rsltsAccess[0].getTopTransitionGroupFeature(dataAccess.runName, pep_id, charge)
-            self.libraryAccess.populateTransitionGroupFeature(top_feature)
-            if top_feature is None:
-                LOGGER.debug(f"No feature found for {pep_id} {charge} in {dataAccess.runName}")
-                return FeatureMap()
-            return dataAccess.reduce_spectra(top_feature, config)
+        for d in dataAccesses:
+            out[d.runName] = feature_maps[d.runName]
+        return out
+
+    def iterFeatureMaps(self, precursors: Iterable[Tuple[str, int]], config: TargetedDIAConfig, runNames: Union[None, str, List[str]] = None, batch_size: int=100) -> Iterator[Tuple[str, str, int, FeatureMap]]:
+        '''
+        Lazily extract the FeatureMaps of several precursors. The precursors are extracted in batches, the spectra of a run are swept once per batch (see MzMLDataAccess.reduce_spectra with a list of features) and the FeatureMaps of a batch are yielded as soon as the batch is extracted from a run.
+        Only the FeatureMaps of a single batch are held at a time, so long precursor lists can be processed with bounded memory. The precursors can be given as a generator.
+
+        The runs are extracted like in loadFeatureMaps, with more than one thread every run extracts a batch in a worker process. Within a batch, the empty FeatureMaps of precursors without a feature and cached FeatureMaps are yielded first, then the FeatureMaps of every run in the order the runs are extracted (runs read 'hot' first).
+
+        Args:
+            precursors (Iterable[Tuple[str, int]]): The (peptide ID, charge) pairs to extract
+            config (TargetedDIAConfig): Configuration object containing the extraction parameters
+            runNames (None | str | List[str]): Name of the run to extract the feature maps from. If None, all runs are extracted. If str, only the specified run is extracted. If List[str], only the specified runs are extracted.
+            batch_size (int): Number of precursors extracted in a single sweep over the spectra of a run
+
+        Yields:
+            Tuple[str, str, int, FeatureMap]: The run name, peptide ID, charge and the FeatureMap
+        '''
+        dataAccesses = self._getDataAccesses(runNames)
+        for batch in self._iterBatches(precursors, batch_size):
+            yield from self._iterRunFeatureMaps(batch, config, dataAccesses)
+
+    def iterTransitionGroups(self, precursors: Iterable[Tuple[str, int]], config: TargetedDIAConfig, runNames: Union[None, str, List[str]] = None, chromatogramsOnly: bool=False, batch_size: int=100) -> Iterator[Tuple[str, str, int, TransitionGroup]]:
+        '''
+        Lazily extract the transition groups of several precursors, see iterFeatureMaps
+
+        Args:
+            precursors (Iterable[Tuple[str, int]]): The (peptide ID, charge) pairs to extract
+            config (TargetedDIAConfig): Configuration object containing the extraction parameters
+            runNames (None | str | List[str]): Name of the run to extract the transition groups from. If None, all runs are extracted. If str, only the specified run is extracted. If List[str], only the specified runs are extracted.
+            chromatogramsOnly (bool): If True, the chromatograms are accumulated directly from the spectra without building (or caching) FeatureMaps, see MzMLDataAccess.extract_chromatograms
+            batch_size (int): Number of precursors extracted in a single sweep over the spectra of a run
+
+        Yields:
+            Tuple[str, str, int, TransitionGroup]: The run name, peptide ID, charge and the TransitionGroup
+        '''
+        if chromatogramsOnly:
+            dataAccesses = self._getDataAccesses(runNames)
+            for batch in self._iterBatches(precursors, batch_size):
+                yield from self._iterRunTransitionGroups(batch, config, dataAccesses)
+            return
+
+        for runName, pep_id, charge, feature_map in self.iterFeatureMaps(precursors, config, runNames, batch_size):
+            yield runName, pep_id, charge, feature_map.to_chromatograms()
+
+    @staticmethod
+    def _iterBatches(precursors: Iterable[Tuple[str, int]], batch_size: int) -> Iterator[List[Tuple[str, int]]]:
+        '''
+        Split a stream of precursors into batches of at most batch_size precursors
+        '''
+        precursors = iter(precursors)
+        batch = list(itertools.islice(precursors, batch_size))
+        while len(batch) > 0:
+            yield batch
+            batch = list(itertools.islice(precursors, batch_size))
+
+    def _getDataAccesses(self, runNames: Union[None, str, List[str]] = None) -> List[MzMLDataAccess]:
+        '''
+        Get the data accesses of the requested runs
+
+        Args:
+            runNames (None | str | List[str]): Name of the run(s). If None, all runs are returned.
 
+        Returns:
+            List[MzMLDataAccess]: The data accesses of the runs
+        '''
         if runNames is None:
-            for d in self.dataAccess:
-                out[d.runName] = _loadFeatureMap(d)
-            return out
+            return self.dataAccess
         elif isinstance(runNames, str):
-            data_access = self.dataAccess[self.runNames.index(runNames)]
-            out[runNames] = _loadFeatureMap(data_access)
+            return [self.dataAccess[self.runNames.index(runNames)]]
         elif isinstance(runNames, list):
-            for r in runNames:
-                for d in self.dataAccess:
-                    if d.runName == r:
-                        out[r] = _loadFeatureMap(d)
+            return [d for r in runNames for d in self.dataAccess if d.runName == r]
         else:
             raise ValueError("runName must be none, a string or list of strings")
 
-        return out
\ No newline at end of file
+    def _iterRunFeatureMaps(self, precursors: List[Tuple[str, int]], config: TargetedDIAConfig, dataAccesses: List[MzMLDataAccess]) -> Iterator[Tuple[str, str, int, FeatureMap]]:
+        '''
+        Extract the FeatureMaps of a batch of precursors from a set of runs, the spectra of every run are swept once for the whole batch. The FeatureMaps of a run are yielded as soon as the run is extracted. Cached FeatureMaps and empty FeatureMaps of precursors without a feature are yielded first.
+
+        Args:
+            precursors (List[Tuple[str, int]]): The (peptide ID, charge) pairs to extract
+            config (TargetedDIAConfig): Configuration object containing the extraction parameters
+            dataAccesses (List[MzMLDataAccess]): The runs to extract
+
+        Yields:
+            Tuple[str, str, int, FeatureMap]: The run name, peptide ID, charge and the FeatureMap
+        '''
+        # the (peptide ID, charge, top feature) of the precursors to extract from every run
+        top_features = {}
+        for d in dataAccesses:
+            top_features[d.runName] = []
+            for pep_id, charge in precursors:
+                top_feature = self._getTopTransitionGroupFeature(d, pep_id, charge)
+                if top_feature is None:
+                    yield d.runName, pep_id, charge, FeatureMap(pd.DataFrame(columns=['rt', 'int', 'Annotation']), pep_id, charge, config)
+                else:
+                    top_features[d.runName].append((pep_id, charge, top_feature))
+
+        cache_keys = {}
+        if self.featureMapCache is not None:
+            for d in dataAccesses:
+                uncached = []
+                for pep_id, charge, top_feature in top_features[d.runName]:
+                    cache_keys[(d.runName, pep_id, charge)] = FeatureMapCache.get_key(self._getRunHash(d), top_feature, config)
+                    feature_map = self.featureMapCache.get(cache_keys[(d.runName, pep_id, charge)], config)
+                    if feature_map is not None:
+                        LOGGER.debug(f"Loaded cached feature map for {pep_id} {charge} in {d.runName}")
+                        yield d.runName, pep_id, charge, feature_map
+                    else:
+                        uncached.append((pep_id, charge, top_feature))
+                top_features[d.runName] = uncached
+
+        to_extract = [d for d in dataAccesses if len(top_features[d.runName]) > 0]
+        features = {runName: [top_feature for _, _, top_feature in run_features] for runName, run_features in top_features.items()}
+        # the peaks of hot runs are held by this process, they are extracted here while the other runs are extracted by the worker processes
+        hot_runs = [d for d in to_extract if d.readOptions == 'hot']
+        to_extract = [d for d in to_extract if d.readOptions != 'hot']
+        n_jobs = min(self.threads, len(to_extract))
+        if n_jobs > 1:
+            LOGGER.info(f"Extracting {len(precursors)} precursors from {len(to_extract)} runs using {n_jobs} processes")
+            # results are returned as soon as the next run is extracted
+            columns = Parallel(n_jobs=n_jobs, return_as='generator')(delayed(_reduce_spectra_columns)(d.filename, d.readOptions, features[d.runName], config, self.verbose, d.cache_dir, d.meta_data_sidecar) for d in to_extract)
+            extracted = ((d, [FeatureMap(pd.DataFrame(cols), feature.sequence, feature.precursor_charge, config) for feature, cols in zip(features[d.runName], run_columns)]) for d, run_columns in zip(to_extract, columns))
+        else:
+            # A single run is split into blocks of spectra which are filtered in parallel instead
+            extracted = ((d, d.reduce_spectra(features[d.runName], config, threads=self.threads)) for d in to_extract)
+        extracted = itertools.chain(((d, d.reduce_spectra(features[d.runName], config)) for d in hot_runs), extracted)
+
+        for d, feature_maps in extracted:
+            for (pep_id, charge, _), feature_map in zip(top_features[d.runName], feature_maps):
+                if self.featureMapCache is not None:
+                    self.featureMapCache.put(cache_keys[(d.runName, pep_id, charge)], feature_map)
+                yield d.runName, pep_id, charge, feature_map
+
+    def _iterRunTransitionGroups(self, precursors: List[Tuple[str, int]], config: TargetedDIAConfig, dataAccesses: List[MzMLDataAccess]) -> Iterator[Tuple[str, str, int, TransitionGroup]]:
+        '''
+        Extract the chromatograms of a batch of precursors from a set of runs without building FeatureMaps (see MzMLDataAccess.extract_chromatograms), the TransitionGroups of a run are yielded as soon as the run is extracted. Empty TransitionGroups of precursors without a feature are yielded first.
+
+        Args:
+            precursors (List[Tuple[str, int]]): The (peptide ID, charge) pairs to extract
+            config (TargetedDIAConfig): Configuration object containing the extraction parameters
+            dataAccesses (List[MzMLDataAccess]): The runs to extract
+
+        Yields:
+            Tuple[str, str, int, TransitionGroup]: The run name, peptide ID, charge and the TransitionGroup
+        '''
+        top_features = {}
+        for d in dataAccesses:
+            top_features[d.runName] = []
+            for pep_id, charge in precursors:
+                top_feature = self._getTopTransitionGroupFeature(d, pep_id, charge)
+                if top_feature is None:
+                    yield d.runName, pep_id, charge, FeatureMap(pd.DataFrame(columns=['rt', 'int', 'Annotation']), pep_id, charge, config).to_chromatograms()
+                else:
+                    top_features[d.runName].append((pep_id, charge, top_feature))
+
+        to_extract = [d for d in dataAccesses if len(top_features[d.runName]) > 0]
+        features = {runName: [top_feature for _, _, top_feature in run_features] for runName, run_features in top_features.items()}
+        # hot runs are extracted by this process, see _iterRunFeatureMaps
+        hot_runs = [d for d in to_extract if d.readOptions == 'hot']
+        to_extract = [d for d in to_extract if d.readOptions != 'hot']
+        n_jobs = min(self.threads, len(to_extract))
+        if n_jobs > 1:
+            LOGGER.info(f"Extracting {len(precursors)} precursors from {len(to_extract)} runs using {n_jobs} processes")
+            transition_groups = Parallel(n_jobs=n_jobs, return_as='generator')(delayed(_extract_chromatograms)(d.filename, d.readOptions, features[d.runName], config, self.verbose, d.cache_dir, d.meta_data_sidecar) for d in to_extract)
+            extracted = itertools.chain(((d, d.extract_chromatograms(features[d.runName], config)) for d in hot_runs), zip(to_extract, transition_groups))
+        else:
+            extracted = ((d, d.extract_chromatograms(features[d.runName], config)) for d in hot_runs + to_extract)
+
+        for d, run_transition_groups in extracted:
+            for (pep_id, charge, _), transition_group in zip(top_features[d.runName], run_transition_groups):
+                yield d.runName, pep_id, charge, transition_group
+
+    def _getTopTransitionGroupFeature(self, dataAccess: MzMLDataAccess, pep_id: str, charge: int) -> Optional[TransitionGroupFeature]:
+        '''
+        Get the top feature of a precursor in a run, populated with the library coordinates
+
+        Args:
+            dataAccess (MzMLDataAccess): The run
+            pep_id (str): Peptide ID
+            charge (int): Charge
+
+        Returns:
+            TransitionGroupFeature: The top feature, None if the precursor has no feature in the run
+        '''
+        top_feature = self.rsltsAccess[0].getTopTransitionGroupFeature(dataAccess.runName, pep_id, charge)
+        if top_feature is None:
+            LOGGER.debug(f"No feature found for {pep_id} {charge} in {dataAccess.runName}")
+            return None
+        self.libraryAccess.populateTransitionGroupFeature(top_feature)
+        return top_feature
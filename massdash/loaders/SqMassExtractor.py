@@ -0,0 +1,264 @@
+"""
+massdash/loaders/SqMassExtractor
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+
+import os
+import copy
+import json
+import hashlib
+from contextlib import closing
+from typing import List, Optional, Tuple, Union
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+
+# Loaders
+from .access import MzMLDataAccess, OSWDataAccess, ResultsTSVDataAccess, SqMassWriter, TransitionPQPDataAccess, TransitionTSVDataAccess
+# Structs
+from ..structs import Chromatogram, TargetedDIAConfig, TransitionGroup, TransitionGroupFeature
+# Utils
+from ..util import LOGGER, file_fingerprint
+
+class SqMassExtractor:
+    '''
+    Headless, library wide extraction of XICs from mzML runs into one sqMass file per run, so the runs can be browsed with the much faster SqMassLoader instead of extracting the raw data in every session.
+
+    Every precursor of the library is extracted from every run. If a results file is given, precursors with a top feature in a run are extracted in an RT window (config.rt_window) around the apex of the feature, all other precursors are extracted across the whole run.
+    The chromatograms are named like the chromatograms of OpenSWATH: transition chromatograms by their transition ID and precursor chromatograms '<precursor ID>_Precursor_i0', with a PQP/OSW library these are the IDs of the library.
+
+    The precursors of a run are extracted in batches (see MzMLDataAccess.extract_chromatograms), every batch is committed to the sqMass file, so an interrupted extraction is resumed from the last committed batch (see SqMassWriter).
+    With at least as many runs as threads the runs are extracted in parallel in a pool of worker processes, every run by a single process. Otherwise the runs are extracted one after the other and the spectra of a run are split into blocks which are accumulated in parallel (see MzMLDataAccess.extract_chromatograms), so a single run uses all threads as well.
+
+    Attributes:
+        libraryFile (str): The path to the spectral library (.pqp, .osw or .tsv)
+        rsltsFile (str): The path to the results file (.osw or .tsv), None if the precursors are extracted across the whole run
+        config (TargetedDIAConfig): The extraction parameters
+        readOptions (str): How the mzML files are read, either 'ondisk', 'cached', 'columnar' or 'hot' (see MzMLDataAccess)
+        batchSize (int): The number of precursors extracted in a single sweep over the spectra and committed at once
+        verbose (bool): Enables verbose mode
+        library (pd.DataFrame): The transitions of the library, including their PrecursorId and TransitionId
+    '''
+    def __init__(self,
+                 libraryFile: str,
+                 rsltsFile: Optional[str] = None,
+                 config: Optional[TargetedDIAConfig] = None,
+                 readOptions: str = 'ondisk',
+                 batchSize: int = 1000,
+                 verbose: bool = False):
+        self.libraryFile = libraryFile
+        self.rsltsFile = rsltsFile
+        self.config = config if config is not None else TargetedDIAConfig()
+        self.readOptions = readOptions
+        self.batchSize = batchSize
+        self.verbose = verbose
+        self.library = self.loadLibrary(libraryFile)
+        self._precursors = self._getPrecursors()
+
+    def __str__(self):
+        return f"{'-'*8} {self.__class__.__name__} {'-'*8}\nlibraryFile: {self.libraryFile}\nrsltsFile: {self.rsltsFile}\nnumber of precursors: {len(self._precursors)}\n{self.config}"
+
+    @staticmethod
+    def loadLibrary(libraryFile: str) -> pd.DataFrame:
+        '''
+        Load the transitions of a spectral library together with their precursor and transition IDs. TSV libraries without TransitionGroupId and TransitionId columns get IDs derived from the peptide sequence, charge and annotation.
+
+        Args:
+            libraryFile (str): The path to the spectral library (.pqp, .osw or .tsv)
+
+        Returns:
+            pd.DataFrame: The transitions of the library
+        '''
+        _, file_extension = os.path.splitext(libraryFile)
+        if file_extension.lower() in ['.pqp', '.osw']:
+            library_access = TransitionPQPDataAccess(libraryFile)
+            library = library_access.getTransitionList(include_ids=True)
+            library_access.close()
+        elif file_extension.lower() == '.tsv':
+            library = TransitionTSVDataAccess(libraryFile).load()
+            precursor = library['ModifiedPeptideSequence'] + '_' + library['PrecursorCharge'].astype(str)
+            library['PrecursorId'] = library['TransitionGroupId'] if 'TransitionGroupId' in library.columns else precursor
+            library['TransitionId'] = library['TransitionId'] if 'TransitionId' in library.columns else precursor + '_' + library['Annotation'].astype(str)
+        else:
+            raise ValueError("Unsupported file format")
+        return library
+
+    def _getPrecursors(self) -> List[Tuple[str, List[str], TransitionGroupFeature]]:
+        # the precursor ID, the transition IDs and the library coordinates of every precursor
+        precursors = []
+        has_im = 'PrecursorIonMobility' in self.library.columns
+        for precursor_id, transitions in self.library.groupby('PrecursorId', sort=False):
+            first = transitions.iloc[0]
+            feature = TransitionGroupFeature(None, None,
+                                             consensusApexIM=self._validIM(first['PrecursorIonMobility']) if has_im else None,
+                                             precursor_mz=float(first['PrecursorMz']),
+                                             precursor_charge=int(first['PrecursorCharge']),
+                                             product_annotations=transitions['Annotation'].astype(str).tolist(),
+                                             product_mz=transitions['ProductMz'].astype(float).tolist(),
+                                             sequence=first['ModifiedPeptideSequence'])
+            precursors.append((str(precursor_id), transitions['TransitionId'].astype(str).tolist(), feature))
+        return precursors
+
+    @staticmethod
+    def _validIM(im: Optional[float]) -> Optional[float]:
+        # missing ion mobility is reported as -1 or NaN
+        if im is None or pd.isnull(im) or im < 0:
+            return None
+        return float(im)
+
+    @staticmethod
+    def getOutputFile(mzmlFile: str, outDir: str) -> str:
+        '''
+        Get the path of the sqMass file of a run
+
+        Args:
+            mzmlFile (str): The path to the mzML file
+            outDir (str): The output directory
+
+        Returns:
+            str: The path of the sqMass file
+        '''
+        return os.path.join(outDir, f"{os.path.splitext(os.path.basename(mzmlFile))[0]}.sqMass")
+
+    def extract(self, mzmlFiles: Union[str, List[str]], outDir: str, threads: int = 1) -> List[str]:
+        '''
+        Extract the XICs of all precursors from a set of runs, runs with a complete sqMass file in outDir are skipped and interrupted runs are resumed
+
+        Args:
+            mzmlFiles (str | List[str]): The path to the mzML file(s)
+            outDir (str): The output directory of the sqMass files
+            threads (int): Number of worker processes, either every run is extracted by a single process or the spectra of every run are split across the processes
+
+        Returns:
+            List[str]: The paths of the sqMass files, in the order of the mzML files
+        '''
+        if isinstance(mzmlFiles, str):
+            mzmlFiles = [mzmlFiles]
+        os.makedirs(outDir, exist_ok=True)
+        outFiles = [self.getOutputFile(f, outDir) for f in mzmlFiles]
+
+        to_extract = []
+        for mzmlFile, outFile in zip(mzmlFiles, outFiles):
+            if os.path.isfile(outFile):
+                LOGGER.info(f"{outFile} already exists, skipping {mzmlFile}")
+            else:
+                to_extract.append((mzmlFile, outFile))
+
+        if threads > 1 and len(to_extract) >= threads:
+            LOGGER.info(f"Extracting {len(to_extract)} runs using {threads} processes")
+            Parallel(n_jobs=threads)(delayed(self.extractRun)(mzmlFile, outFile) for mzmlFile, outFile in to_extract)
+        else:
+            # fewer runs than threads, the spectra of every run are split across the processes instead
+            for mzmlFile, outFile in to_extract:
+                self.extractRun(mzmlFile, outFile, threads=threads)
+        return outFiles
+
+    def extractRun(self, mzmlFile: str, outFile: str, threads: int = 1) -> str:
+        '''
+        Extract the XICs of all precursors from a single run into a sqMass file. A partial sqMass file of an interrupted extraction with the same inputs is resumed.
+        The top features of all precursors of the run are read from the results file with a single query.
+
+        Args:
+            mzmlFile (str): The path to the mzML file
+            outFile (str): The path of the sqMass file
+            threads (int): Number of worker processes the spectra of every batch are split across, the run is extracted by the calling process if 1
+
+        Returns:
+            str: The path of the sqMass file
+        '''
+        data_access = MzMLDataAccess(mzmlFile, self.readOptions, verbose=self.verbose)
+        top_features = {}
+        results_access = self._getResultsAccess(data_access.runName)
+        if results_access is not None:
+            with closing(results_access):
+                top_features = results_access.getTopTransitionGroupFeaturesOfRun(data_access.runName)
+
+        # precursors without a feature are extracted across the whole run
+        rt = data_access.meta_data_index.rt
+        run_config = copy.copy(self.config)
+        run_config.rt_window = float(rt.max() - rt.min()) + 1 if rt.shape[0] > 0 else 0
+        run_apex = float(rt.max() + rt.min()) / 2 if rt.shape[0] > 0 else 0
+
+        with SqMassWriter(outFile, os.path.basename(mzmlFile), self._getFingerprint(mzmlFile)) as writer:
+            extracted = writer.get_extracted_precursors()
+            precursors = [p for p in self._precursors if p[0] not in extracted]
+            if len(extracted) > 0:
+                LOGGER.info(f"Resuming extraction of {data_access.runName}, {len(extracted)} precursors already extracted")
+
+            for batch_start in range(0, len(precursors), self.batchSize):
+                batch = precursors[batch_start:batch_start + self.batchSize]
+                features = []
+                for _, _, library_feature in batch:
+                    feature = copy.copy(library_feature)
+                    top_feature = top_features.get((feature.sequence, int(feature.precursor_charge)))
+                    if top_feature is not None and top_feature.consensusApex is not None:
+                        feature.consensusApex = top_feature.consensusApex
+                        if self._validIM(top_feature.consensusApexIM) is not None:
+                            feature.consensusApexIM = self._validIM(top_feature.consensusApexIM)
+                    features.append(feature)
+
+                transition_groups = [None] * len(batch)
+                targeted = [i for i, feature in enumerate(features) if feature.consensusApex is not None]
+                untargeted = [i for i, feature in enumerate(features) if feature.consensusApex is None]
+                for feature_idx in untargeted:
+                    features[feature_idx].consensusApex = run_apex
+                for indices, config in [(targeted, self.config), (untargeted, run_config)]:
+                    if len(indices) > 0:
+                        for feature_idx, transition_group in zip(indices, data_access.extract_chromatograms([features[i] for i in indices], config, threads=threads)):
+                            transition_groups[feature_idx] = transition_group
+
+                for (precursor_id, transition_ids, library_feature), transition_group in zip(batch, transition_groups):
+                    self._writeTransitionGroup(writer, precursor_id, transition_ids, library_feature, transition_group)
+                    writer.mark_extracted(precursor_id)
+                writer.commit()
+                LOGGER.info(f"{data_access.runName}: extracted {len(extracted) + batch_start + len(batch)} of {len(self._precursors)} precursors")
+
+            return writer.finalize()
+
+    def _writeTransitionGroup(self, writer: SqMassWriter, precursor_id: str, transition_ids: List[str], library_feature: TransitionGroupFeature, transition_group: TransitionGroup):
+        '''
+        Write the chromatograms of a precursor, transitions without any peak get a chromatogram of zeros. Precursors without any peak are not written, OpenMS cannot read chromatograms without points.
+        '''
+        chromatograms = {chrom.label: chrom for chrom in transition_group.transitionData if chrom.data.shape[0] > 0}
+        # RTs of the transition chromatograms, all extracted transitions share the same RTs
+        if len(chromatograms) > 0:
+            rt = next(iter(chromatograms.values())).data
+            for transition_id, annotation, product_mz in zip(transition_ids, library_feature.product_annotations, library_feature.product_mz):
+                chromatogram = chromatograms.get(annotation, Chromatogram(rt, np.zeros(rt.shape[0]), annotation))
+                writer.add_chromatogram(transition_id, chromatogram, library_feature.precursor_mz, product_mz, library_feature.sequence, library_feature.precursor_charge)
+
+        chromatogram = transition_group.precursorData[0]
+        if 1 in self.config.mslevel and chromatogram.label == 'prec' and chromatogram.data.shape[0] > 0:
+            writer.add_chromatogram(f"{precursor_id}_Precursor_i0", chromatogram, library_feature.precursor_mz, None, library_feature.sequence, library_feature.precursor_charge)
+
+    def _getResultsAccess(self, runName: str) -> Union[None, OSWDataAccess, ResultsTSVDataAccess]:
+        '''
+        Open the results file, None if no results file is given or it does not contain the run. The caller closes the returned results access.
+        '''
+        if self.rsltsFile is None:
+            return None
+        if self.rsltsFile.endswith('.osw'):
+            results_access = OSWDataAccess(self.rsltsFile, verbose=self.verbose)
+        elif self.rsltsFile.endswith('.tsv'):
+            results_access = ResultsTSVDataAccess(self.rsltsFile, verbose=self.verbose)
+        else:
+            raise ValueError(f"Unsupported file type {self.rsltsFile}")
+        try:
+            if runName not in results_access.getRunNames():
+                LOGGER.warning(f"Run {runName} not found in {self.rsltsFile}, extracting all precursors across the whole run")
+                results_access.close()
+                return None
+        except BaseException:
+            results_access.close()
+            raise
+        return results_access
+
+    def _getFingerprint(self, mzmlFile: str) -> str:
+        '''
+        Fingerprint of the inputs of the extraction of a run, a partial sqMass file is only resumed if the inputs did not change
+        '''
+        inputs = {'mzml': file_fingerprint(mzmlFile)['hash'],
+                  'library': file_fingerprint(self.libraryFile)['hash'],
+                  'results': file_fingerprint(self.rsltsFile)['hash'] if self.rsltsFile is not None else None,
+                  'config': self.config.get_hash()}
+        return hashlib.blake2b(json.dumps(inputs, sort_keys=True).encode(), digest_size=16).hexdigest()
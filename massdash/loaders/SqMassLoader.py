@@ -4,14 +4,16 @@ massdash/loaders/SqMassLoader
 """
 
 
-from typing import List, Dict, Union
+from typing import Any, Callable, List, Dict, Optional, Tuple, Union
 from os.path import basename
 from pandas.core.api import DataFrame as DataFrame
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 
 # Loaders
 from .GenericChromatogramLoader import GenericChromatogramLoader
-from .access import SqMassDataAccess
+from .access import ChromatogramCache, SqMassDataAccess
+from .access.ChromatogramCache import SHARED_CHROMATOGRAM_CACHE
 # Structs
 from ..structs import TransitionGroup, TransitionGroupCollection
 # Utils
@@ -22,34 +24,63 @@ class SqMassLoader(GenericChromatogramLoader):
     ''' 
     Class for loading Chromatograms and peak features from SqMass files and OSW files
     Inherits from GenericChromatogramLoader
+
+    Attributes:
+        threads: (int) Number of threads used to read the sqMass files of the runs concurrently, runs are read sequentially if 1
+        chromatogramCache: (ChromatogramCache) The cache of decoded chromatograms, by default shared by all loaders of the process, None if chromatograms are not cached
     '''
 
-    def __init__(self, **kwargs):
+    def __init__(self, threads: int=1, chromatogramCache: Optional[ChromatogramCache]=SHARED_CHROMATOGRAM_CACHE, **kwargs):
         super().__init__(**kwargs) 
-        self.dataAccess = [SqMassDataAccess(f) for f in self.dataFiles]
-        
+        self.threads = threads
+        self.chromatogramCache = chromatogramCache
+        self._executor = None
+
         ## Check for OSW file in the list of results files, OSW file is required for parsing sqMass files
         ## Currently only 
+        # checked before the sqMass files are opened, so that a missing OSW file is reported before a missing data file
         self.oswAccess = self.getOSWAccessPtr()
         if self.oswAccess is None:
             raise ValueError("No OSW file found in SqMassLoader, OSW file required for parsing sqMass files")
+
+        self.dataAccess = [SqMassDataAccess(f, cache=chromatogramCache) for f in self.dataFiles]
                 
+    def _mapRuns(self, func: Callable[[SqMassDataAccess], Any], dataAccess: List[SqMassDataAccess]) -> List[Any]:
+        '''
+        Apply a function to the sqMass files of several runs, the files are read by a pool of threads if threads > 1.
+        sqlite and zlib release the GIL, so reading and decompressing the chromatograms of different runs overlaps.
+
+        Args:
+            func (Callable): The function applied to the SqMassDataAccess of every run
+            dataAccess (List[SqMassDataAccess]): The runs
+
+        Returns:
+            List[Any]: The results in the order of the runs
+        '''
+        if self.threads > 1 and len(dataAccess) > 1:
+            # the pool is kept for the lifetime of the loader, starting threads on every request would cost more than reading a precursor
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.threads)
+            return list(self._executor.map(func, dataAccess))
+        return [func(t) for t in dataAccess]
+
     def loadTransitionGroupsDf(self, pep_id: str, charge: int) -> pd.DataFrame:
         transitionMetaInfo = self.oswAccess.getTransitionIDAnnotationFromSequence(pep_id, charge)
         precursor_id = self.oswAccess.getPrecursorIDFromPeptideAndCharge(pep_id, charge)
         columns=['run_name', 'rt', 'intensity', 'annotation']
         if transitionMetaInfo.empty:
             return pd.DataFrame(columns=columns)
-        out = {}
-        for t in self.dataAccess:
-
+        def _loadChromatogramsDf(t):
             ### Get Transition chromatogram IDs
             transition_chroms = t.getDataForChromatogramsFromNativeIdsDf(transitionMetaInfo['TRANSITION_ID'], transitionMetaInfo['ANNOTATION'])
 
             ### Get Precursor chromatogram IDs
             prec_chrom_ids = t.getPrecursorChromIDs(precursor_id) 
             precursor_chroms = t.getDataForChromatogramsDf(prec_chrom_ids['chrom_ids'], prec_chrom_ids['native_ids'])
+            return transition_chroms, precursor_chroms
 
+        out = {}
+        for t, (transition_chroms, precursor_chroms) in zip(self.dataAccess, self._mapRuns(_loadChromatogramsDf, self.dataAccess)):
             # only add if there is data
             if not transition_chroms.empty or precursor_chroms.empty:
                 out[t.runName] = pd.concat([precursor_chroms, transition_chroms])
@@ -89,19 +120,37 @@ class SqMassLoader(GenericChromatogramLoader):
             precursor_chroms = dataAccess.getDataForChromatograms(prec_chrom_ids['chrom_ids'], prec_chrom_ids['native_ids'])
             return TransitionGroup(precursor_chroms, transition_chroms, pep_id, charge)
 
+        runs = self._selectRuns(runNames)
+        for (runName, _), transitionGroup in zip(runs, self._mapRuns(_loadTransitionGroup, [t for _, t in runs])):
+            out[runName] = transitionGroup
+
+        return out
+
+    def loadTransitionGroupsFromPrecursorIds(self, precursor_ids: Optional[List[int]] = None, runNames: Union[None, str, List[str]] = None) -> Dict[str, TransitionGroupCollection]:
+        '''
+        Loads the transition groups of many precursors across all files, e.g. all precursors of a protein or the whole library for export.
+        The chromatograms of all precursors of a run are fetched with a single query (see SqMassDataAccess.getTransitionGroups).
+
+        Args:
+            precursor_ids (List[int], optional): The precursor IDs. Defaults to None, all precursors in the OSW file.
+            runNames (None | str | List[str]): Name of the run to extract the transition groups from. If None, all runs are extracted. If str, only the specified run is extracted. If List[str], only the specified runs are extracted.
+
+        Returns:
+            Dict[str, TransitionGroupCollection]: Dictionary of TransitionGroupCollections keyed by precursor ID, with keys as sqMass filenames
+        '''
+        transitions = self.oswAccess.getTransitionIDAnnotationFromPrecursorIds(precursor_ids)
+        runs = self._selectRuns(runNames)
+        return {runName: transitionGroups for (runName, _), transitionGroups in zip(runs, self._mapRuns(lambda t: t.getTransitionGroups(transitions), [t for _, t in runs]))}
+
+    def _selectRuns(self, runNames: Union[None, str, List[str]]) -> List[Tuple[str, SqMassDataAccess]]:
+        '''
+        Select the runs by name, see loadTransitionGroups
+        '''
         if runNames is None:
-            for t in self.dataAccess:
-                out[t.runName] = _loadTransitionGroup(t)
+            return [(t.runName, t) for t in self.dataAccess]
         elif isinstance(runNames, str):
-            t = self.dataAccess[self.runNames.index(runNames)]
-            out[runNames] = _loadTransitionGroup(t)
+            return [(runNames, self.dataAccess[self.runNames.index(runNames)])]
         elif isinstance(runNames, list):
-            out = TransitionGroupCollection()
-            for r in runNames:
-                for t in self.dataAccess:
-                    if t.runName == r:
-                        out[t.runName] = _loadTransitionGroup(t)
+            return [(t.runName, t) for r in runNames for t in self.dataAccess if t.runName == r]
         else:
-            raise ValueError("runName must be none, a string or list of strings")
-
-        return out
\ No newline at end of file
+            raise ValueError("runName must be none, a string or list of strings")
\ No newline at end of file
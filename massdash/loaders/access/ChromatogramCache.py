@@ -0,0 +1,99 @@
+"""
+massdash/loaders/access/ChromatogramCache
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Hashable, Optional, Tuple
+
+import numpy as np
+
+# Internal
+from ...constants import CHROMATOGRAM_CACHE_SIZE
+
+class ChromatogramCache:
+    '''
+    In memory, size bounded cache of decoded chromatograms, e.g. of the chromatograms read from sqMass files (see SqMassDataAccess), so that reading a
+    chromatogram again (e.g. when a plot setting is changed and the page reruns) does not query and decode the file again.
+    When the cache grows beyond its maximum size the least recently used chromatograms are removed.
+
+    The cache may be shared by several threads. The cached arrays are read only, as they are handed out to every reader of the chromatogram.
+
+    Attributes:
+        max_size (int): The maximum size of the cached arrays in bytes
+        size (int): The size of the cached arrays in bytes
+        hits (int): The number of chromatograms found in the cache
+        misses (int): The number of chromatograms not found in the cache
+    '''
+    def __init__(self, max_size: int=CHROMATOGRAM_CACHE_SIZE):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # key -> (retention times, intensities), the least recently used chromatogram comes first
+        self._chromatograms = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __str__(self):
+        return f"{'-'*8} {self.__class__.__name__} {'-'*8}\nmax_size: {self.max_size}\nsize: {self.size}\nchromatograms: {len(self)}\nhits: {self.hits}\nmisses: {self.misses}"
+
+    def __len__(self):
+        return len(self._chromatograms)
+
+    def get(self, key: Hashable) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        '''
+        Get a chromatogram from the cache
+
+        Args:
+            key (Hashable): The cache key, e.g. the file and the ID of the chromatogram
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The retention times and intensities of the chromatogram, None if it is not cached
+        '''
+        with self._lock:
+            chromatogram = self._chromatograms.get(key)
+            if chromatogram is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._chromatograms.move_to_end(key)
+            return chromatogram
+
+    def put(self, key: Hashable, rt: np.ndarray, intensity: np.ndarray):
+        '''
+        Add a chromatogram to the cache, the least recently used chromatograms are removed if the cache exceeds its maximum size. A chromatogram larger than the cache is not cached.
+
+        Args:
+            key (Hashable): The cache key, e.g. the file and the ID of the chromatogram
+            rt (np.ndarray): The retention times, the array is made read only
+            intensity (np.ndarray): The intensities, the array is made read only
+        '''
+        rt, intensity = np.asarray(rt), np.asarray(intensity)
+        nbytes = rt.nbytes + intensity.nbytes
+        if nbytes > self.max_size:
+            return
+        rt.flags.writeable = False
+        intensity.flags.writeable = False
+        with self._lock:
+            previous = self._chromatograms.pop(key, None)
+            if previous is not None:
+                self.size -= previous[0].nbytes + previous[1].nbytes
+            self._chromatograms[key] = (rt, intensity)
+            self.size += nbytes
+            while self.size > self.max_size:
+                _, (evicted_rt, evicted_intensity) = self._chromatograms.popitem(last=False)
+                self.size -= evicted_rt.nbytes + evicted_intensity.nbytes
+
+    def clear(self):
+        '''
+        Remove all chromatograms from the cache and reset the hit and miss counters
+        '''
+        with self._lock:
+            self._chromatograms.clear()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+
+# The cache shared by all SqMassDataAccess (and so all SqMassLoader) instances of the process
+SHARED_CHROMATOGRAM_CACHE = ChromatogramCache()
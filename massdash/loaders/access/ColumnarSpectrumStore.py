@@ -0,0 +1,261 @@
+"""
+massdash/loaders/access/ColumnarSpectrumStore
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+
+import os
+import shutil
+from contextlib import ExitStack
+from typing import Dict, Iterator, Optional, Tuple
+
+import numpy as np
+import pyopenms as po
+
+# Structs
+from ...structs.SpectrumMetaDataIndex import SpectrumMetaDataIndex
+
+class ColumnarSpectrumStore:
+    '''
+    Columnar, memory mappable copy of the peaks of an mzML run. The peaks of all spectra are decoded once and concatenated into flat m/z, intensity and ion mobility arrays.
+    The spectra are stored grouped by isolation window (MS1 spectra first, then the MS2 spectra of every isolation window) and sorted by RT within each group, so the spectra of a targeted query (a RT window in the isolation windows containing a precursor) lie in a few contiguous regions of the file.
+    Accessing a spectrum is a slice of the memory mapped arrays, no base64 or zlib decoding is required.
+    For runs with ion mobility the peaks of every spectrum are stored sorted by ion mobility, so the peaks of a spectrum in an ion mobility window are a single slice found by binary search and the rest of the spectrum is never read (see get_spectrum_im_window).
+    The same layout can also be held in memory instead of on disk (see build_in_memory).
+
+    The store is a directory containing:
+        index.npz: The SpectrumMetaDataIndex of the run together with the fingerprint of the mzML file it was built from
+        layout.npz: The file version, the number of peaks and the peak range [peak_start, peak_end) of every spectrum
+        mz.f64, int.f32, im.f32: The raw peak arrays, im.f32 only if the run has ion mobility
+        order.i32: The position of every peak in its spectrum in the mzML file, only if the run has ion mobility
+
+    Attributes:
+        path (str): The directory of the store, None if the store is held in memory
+        meta_data_index (SpectrumMetaDataIndex): The spectrum meta data index of the run
+        fingerprint (dict): The fingerprint of the mzML file the store was built from (see util.file_fingerprint), None if the store is held in memory
+        peak_start (np.ndarray): The position of the first peak of every spectrum in the peak arrays
+        peak_end (np.ndarray): The position after the last peak of every spectrum in the peak arrays
+        mz (np.ndarray): The m/z of all peaks
+        intensity (np.ndarray): The intensity of all peaks
+        im (np.ndarray): The ion mobility of all peaks, None if the run has no ion mobility
+        order (np.ndarray): The position of every peak in its spectrum in the mzML file, None if the run has no ion mobility
+    '''
+    # Version of the store layout, increase when the stored arrays change
+    FILE_VERSION = 2
+
+    # dtype of the peak arrays, same as the dtypes of decoded spectra
+    PEAK_DTYPES = {'mz': np.float64, 'int': np.float32, 'im': np.float32, 'order': np.int32}
+    PEAK_FILES = {'mz': 'mz.f64', 'int': 'int.f32', 'im': 'im.f32', 'order': 'order.i32'}
+
+    def __init__(self,
+                 path: str,
+                 meta_data_index: SpectrumMetaDataIndex,
+                 fingerprint: dict,
+                 peak_start: np.ndarray,
+                 peak_end: np.ndarray,
+                 mz: np.ndarray,
+                 intensity: np.ndarray,
+                 im: Optional[np.ndarray] = None,
+                 order: Optional[np.ndarray] = None):
+        self.path = path
+        self.meta_data_index = meta_data_index
+        self.fingerprint = fingerprint
+        self.peak_start = peak_start
+        self.peak_end = peak_end
+        self.mz = mz
+        self.intensity = intensity
+        self.im = im
+        self.order = order
+
+    def __len__(self) -> int:
+        return self.peak_start.shape[0]
+
+    def __str__(self):
+        return f"{'-'*8} {self.__class__.__name__} {'-'*8}\npath: {self.path}\nnumber of spectra: {len(self)}\nnumber of peaks: {self.mz.shape[0]}\nhas_im: {self.im is not None}"
+
+    @staticmethod
+    def get_storage_order(meta_data_index: SpectrumMetaDataIndex) -> np.ndarray:
+        '''
+        Get the order in which the spectra are stored, the MS1 spectra sorted by RT followed by the MS2 spectra of every isolation window sorted by RT. Spectra without isolation window are stored last.
+
+        Args:
+            meta_data_index (SpectrumMetaDataIndex): The spectrum meta data index of the run
+
+        Returns:
+            np.ndarray: The spectrum indices in storage order
+        '''
+        ms1_spectra = meta_data_index.get_ms_level_indices([1])
+        groups = [ms1_spectra[np.argsort(meta_data_index.rt[ms1_spectra], kind='stable')]]
+        groups += [meta_data_index.get_window_spectrum_indices(window_idx) for window_idx in range(meta_data_index.isolation_windows.shape[0])]
+        stored = np.concatenate(groups)
+        remaining = np.setdiff1d(meta_data_index.spectrum_index, stored)
+        return np.concatenate([stored, remaining]).astype(np.int64)
+
+    @classmethod
+    def _iter_peaks(cls, exp: po.OnDiscMSExperiment, meta_data_index: SpectrumMetaDataIndex) -> Iterator[Tuple[int, Dict[str, np.ndarray]]]:
+        # decode the spectra in storage order, with ion mobility the peaks of every spectrum are sorted by ion mobility
+        for spectrum_indice in cls.get_storage_order(meta_data_index).tolist():
+            spec = exp.getSpectrum(spectrum_indice)
+            mz_array, int_array = spec.get_peaks()
+            peaks = {}
+            if meta_data_index.has_im:
+                float_data_arrays = spec.getFloatDataArrays()
+                if len(float_data_arrays) > 0:
+                    im_array = np.array(float_data_arrays[0].get_data(), dtype=cls.PEAK_DTYPES['im'])
+                else:
+                    im_array = np.full(mz_array.shape[0], np.nan, dtype=cls.PEAK_DTYPES['im'])
+                # sort the peaks by ion mobility and remember their original position
+                order = np.argsort(im_array, kind='stable').astype(cls.PEAK_DTYPES['order'])
+                mz_array, int_array = mz_array[order], int_array[order]
+                peaks['im'] = im_array[order]
+                peaks['order'] = order
+            peaks['mz'] = np.ascontiguousarray(mz_array, dtype=cls.PEAK_DTYPES['mz'])
+            peaks['int'] = np.ascontiguousarray(int_array, dtype=cls.PEAK_DTYPES['int'])
+            yield spectrum_indice, peaks
+
+    @classmethod
+    def build(cls, exp: po.OnDiscMSExperiment, meta_data_index: SpectrumMetaDataIndex, path: str, fingerprint: Optional[dict] = None) -> 'ColumnarSpectrumStore':
+        '''
+        Decode all spectra of a run once and write them to a new store. The store is written to a temporary directory first which replaces an existing store at path once complete.
+
+        Args:
+            exp (po.OnDiscMSExperiment): The opened run
+            meta_data_index (SpectrumMetaDataIndex): The spectrum meta data index of the run
+            path (str): The directory of the store
+            fingerprint (dict): The fingerprint of the mzML file (see util.file_fingerprint), used to detect stale stores
+
+        Returns:
+            ColumnarSpectrumStore: The memory mapped store
+        '''
+        columns = ['mz', 'int', 'im', 'order'] if meta_data_index.has_im else ['mz', 'int']
+        peak_start = np.zeros(len(meta_data_index), dtype=np.int64)
+        peak_end = np.zeros(len(meta_data_index), dtype=np.int64)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        os.makedirs(tmp_path, exist_ok=True)
+        try:
+            n_peaks = 0
+            with ExitStack() as stack:
+                files = {col: stack.enter_context(open(os.path.join(tmp_path, cls.PEAK_FILES[col]), 'wb')) for col in columns}
+                for spectrum_indice, peaks in cls._iter_peaks(exp, meta_data_index):
+                    for col in columns:
+                        files[col].write(peaks[col].tobytes())
+                    peak_start[spectrum_indice] = n_peaks
+                    n_peaks += peaks['mz'].shape[0]
+                    peak_end[spectrum_indice] = n_peaks
+
+            with open(os.path.join(tmp_path, 'layout.npz'), 'wb') as f:
+                np.savez(f, version=cls.FILE_VERSION, n_peaks=n_peaks, peak_start=peak_start, peak_end=peak_end)
+            meta_data_index.save(os.path.join(tmp_path, 'index.npz'), fingerprint)
+
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        return cls.open(path)
+
+    @classmethod
+    def build_in_memory(cls, exp: po.OnDiscMSExperiment, meta_data_index: SpectrumMetaDataIndex, max_bytes: Optional[int] = None) -> 'ColumnarSpectrumStore':
+        '''
+        Decode all spectra of a run once into a store held in memory, the peak arrays have the same layout as the arrays of a store on disk (see build)
+
+        Args:
+            exp (po.OnDiscMSExperiment): The opened run
+            meta_data_index (SpectrumMetaDataIndex): The spectrum meta data index of the run
+            max_bytes (int): The maximum size of the peak arrays in bytes, no limit if None
+
+        Returns:
+            ColumnarSpectrumStore: The store held in memory
+
+        Raises:
+            MemoryError: If the peak arrays of the run exceed max_bytes
+        '''
+        columns = ['mz', 'int', 'im', 'order'] if meta_data_index.has_im else ['mz', 'int']
+        peak_start = np.zeros(len(meta_data_index), dtype=np.int64)
+        peak_end = np.zeros(len(meta_data_index), dtype=np.int64)
+        chunks = {col: [] for col in columns}
+        n_peaks, n_bytes = 0, 0
+        for spectrum_indice, peaks in cls._iter_peaks(exp, meta_data_index):
+            for col in columns:
+                chunks[col].append(peaks[col])
+                n_bytes += peaks[col].nbytes
+            if max_bytes is not None and n_bytes > max_bytes:
+                raise MemoryError(f"The peaks of the run exceed the memory budget of {max_bytes} bytes")
+            peak_start[spectrum_indice] = n_peaks
+            n_peaks += peaks['mz'].shape[0]
+            peak_end[spectrum_indice] = n_peaks
+
+        arrays = {col: np.concatenate(chunks[col]) if len(chunks[col]) > 0 else np.empty(0, dtype=cls.PEAK_DTYPES[col]) for col in columns}
+        return cls(None, meta_data_index, None, peak_start, peak_end, arrays['mz'], arrays['int'], arrays.get('im'), arrays.get('order'))
+
+    @classmethod
+    def open(cls, path: str) -> 'ColumnarSpectrumStore':
+        '''
+        Open an existing store, the peak arrays are memory mapped read-only
+
+        Args:
+            path (str): The directory of the store
+
+        Returns:
+            ColumnarSpectrumStore: The memory mapped store
+        '''
+        meta_data_index, fingerprint = SpectrumMetaDataIndex.load(os.path.join(path, 'index.npz'))
+        with np.load(os.path.join(path, 'layout.npz'), allow_pickle=False) as layout:
+            if int(layout['version']) != cls.FILE_VERSION:
+                raise ValueError(f"Unsupported columnar spectrum store version {int(layout['version'])} (expected {cls.FILE_VERSION})")
+            n_peaks = int(layout['n_peaks'])
+            peak_start = layout['peak_start']
+            peak_end = layout['peak_end']
+        im = cls._memmap(path, 'im', n_peaks) if meta_data_index.has_im else None
+        order = cls._memmap(path, 'order', n_peaks) if meta_data_index.has_im else None
+        return cls(path, meta_data_index, fingerprint, peak_start, peak_end, cls._memmap(path, 'mz', n_peaks), cls._memmap(path, 'int', n_peaks), im, order)
+
+    @classmethod
+    def _memmap(cls, path: str, column: str, n_peaks: int) -> np.ndarray:
+        # empty files cannot be memory mapped
+        if n_peaks == 0:
+            return np.empty(0, dtype=cls.PEAK_DTYPES[column])
+        return np.memmap(os.path.join(path, cls.PEAK_FILES[column]), dtype=cls.PEAK_DTYPES[column], mode='r', shape=(n_peaks,))
+
+    def get_spectrum(self, spec_indice: int) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
+        '''
+        Get the peaks of a spectrum in the order of the mzML file. Without ion mobility the arrays are read-only views on the memory mapped store.
+
+        Args:
+            spec_indice (int): The spectrum indice
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]: The m/z, intensity and ion mobility (None if the run has no ion mobility) arrays
+        '''
+        start, end = self.peak_start[spec_indice], self.peak_end[spec_indice]
+        if self.im is None:
+            return self.mz[start:end], self.intensity[start:end], None
+        return self._restore_peak_order(start, end)
+
+    def get_spectrum_im_window(self, spec_indice: int, im_start: float, im_end: float) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
+        '''
+        Get the peaks of a spectrum in an ion mobility window in the order of the mzML file. Only the slice of the ion mobility sorted spectrum which can fall in the window is read.
+        The returned peaks include the peaks on the window bounds (and, with float32 rounding, peaks just outside of the window), the caller applies the exact ion mobility filter.
+        Without ion mobility all peaks of the spectrum are returned.
+
+        Args:
+            spec_indice (int): The spectrum indice
+            im_start (float): The lower bound of the ion mobility window
+            im_end (float): The upper bound of the ion mobility window
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]: The m/z, intensity and ion mobility (None if the run has no ion mobility) arrays
+        '''
+        if self.im is None:
+            return self.get_spectrum(spec_indice)
+        start, end = self.peak_start[spec_indice], self.peak_end[spec_indice]
+        im = self.im[start:end]
+        # the bounds are rounded to float32 like the ion mobility filter, so the slice contains every peak passing the filter
+        im_end = start + np.searchsorted(im, np.float32(im_end), side='right')
+        im_start = start + np.searchsorted(im, np.float32(im_start), side='left')
+        return self._restore_peak_order(im_start, max(im_start, im_end))
+
+    def _restore_peak_order(self, start: int, end: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # peaks of a single spectrum, put back into the order of the mzML file
+        order = np.argsort(self.order[start:end], kind='stable')
+        return self.mz[start:end][order], self.intensity[start:end][order], self.im[start:end][order]
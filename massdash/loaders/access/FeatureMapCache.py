@@ -0,0 +1,191 @@
+"""
+massdash/loaders/access/FeatureMapCache
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+
+import os
+import json
+import hashlib
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+# Structs
+from ...structs.FeatureMap import FeatureMap
+from ...structs.TargetedDIAConfig import TargetedDIAConfig
+from ...structs.TransitionGroupFeature import TransitionGroupFeature
+# Internal
+from ...constants import MASSDASH_CACHE_DIR
+from ...util import LOGGER
+
+class FeatureMapCache:
+    '''
+    Persistent, size bounded on disk cache of extracted FeatureMaps. Every FeatureMap is stored in its own .npz file named after its key (see get_key), which is derived from the content of the run, the coordinates of the extracted feature and the extraction parameters, so the cache never has to be invalidated explicitly.
+    When the cache grows beyond its maximum size the least recently used FeatureMaps are removed. The size of the cache is tracked by a running estimate of the sizes of the stored FeatureMaps,
+    the cache directory is only scanned when the estimate exceeds the maximum size, so FeatureMaps written by other processes are only accounted for at the next eviction.
+
+    Attributes:
+        cache_dir (str): The directory the FeatureMaps are stored in
+        max_size (int): The maximum size of the cache in bytes
+    '''
+    # Version of the file format of the cached FeatureMaps, increase when the stored columns change
+    FILE_VERSION = 1
+
+    def __init__(self, cache_dir: str=os.path.join(MASSDASH_CACHE_DIR, 'feature_maps'), max_size: int=2 * 1024**3):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # running estimate of the size of the cache in bytes, None until the cache directory is first scanned
+        self._size = None
+
+    def __str__(self):
+        return f"{'-'*8} {self.__class__.__name__} {'-'*8}\ncache_dir: {self.cache_dir}\nmax_size: {self.max_size}\nsize: {self.get_size()}"
+
+    @staticmethod
+    def get_key(run_hash: str, feature: TransitionGroupFeature, config: TargetedDIAConfig) -> str:
+        '''
+        Get the cache key of a FeatureMap
+
+        Args:
+            run_hash (str): The content hash of the run the FeatureMap is extracted from (see util.file_fingerprint)
+            feature (TransitionGroupFeature): The extracted feature
+            config (TargetedDIAConfig): The extraction parameters
+
+        Returns:
+            str: The cache key
+        '''
+        to_float = lambda value: None if value is None else float(value)
+        params = {'run': run_hash,
+                  'sequence': feature.sequence,
+                  'precursor_charge': feature.precursor_charge,
+                  'precursor_mz': to_float(feature.precursor_mz),
+                  'consensusApex': to_float(feature.consensusApex),
+                  'consensusApexIM': to_float(feature.consensusApexIM),
+                  'product_mz': [float(mz) for mz in feature.product_mz] if feature.product_mz is not None else None,
+                  'product_annotations': [str(annotation) for annotation in feature.product_annotations] if feature.product_annotations is not None else None,
+                  'config': config.get_hash()}
+        return hashlib.blake2b(json.dumps(params, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def get(self, key: str, config: Optional[TargetedDIAConfig]=None) -> Optional[FeatureMap]:
+        '''
+        Get a FeatureMap from the cache
+
+        Args:
+            key (str): The cache key (see get_key)
+            config (TargetedDIAConfig): The extraction parameters, attached to the returned FeatureMap
+
+        Returns:
+            FeatureMap: The cached FeatureMap, None if it is not cached
+        '''
+        path = self._get_path(key)
+        if not os.path.isfile(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if int(data['version']) != self.FILE_VERSION:
+                    raise ValueError(f"Unsupported feature map cache file version {int(data['version'])} (expected {self.FILE_VERSION})")
+                object_columns = set(data['object_columns'].tolist())
+                feature_df = pd.DataFrame({col: data[f'column_{i}'].astype(object) if col in object_columns else data[f'column_{i}'] for i, col in enumerate(data['columns'].tolist())})
+                sequence, precursor_charge = str(data['sequence']), int(data['precursor_charge'])
+        except Exception as e:
+            LOGGER.warning(f"Could not read cached feature map {path}, removing it ({e})")
+            self._remove(path)
+            return None
+
+        # mark as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return FeatureMap(feature_df, sequence, precursor_charge, config)
+
+    def put(self, key: str, feature_map: FeatureMap):
+        '''
+        Add a FeatureMap to the cache, the least recently used FeatureMaps are removed if the cache exceeds its maximum size. Failing to write to the cache is not an error.
+
+        Args:
+            key (str): The cache key (see get_key)
+            feature_map (FeatureMap): The FeatureMap to cache
+        '''
+        path = self._get_path(key)
+        columns = list(feature_map.feature_df.columns)
+        arrays, object_columns = {}, []
+        for i, col in enumerate(columns):
+            values = feature_map.feature_df[col].to_numpy()
+            # object columns (e.g. annotations) are stored as strings, so that the cache can be read without pickle
+            if values.dtype == object:
+                values = values.astype(str)
+                object_columns.append(col)
+            arrays[f'column_{i}'] = values
+
+        # write to a temporary file first so that concurrent readers never see a partially written FeatureMap
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.savez(f,
+                         version=self.FILE_VERSION,
+                         sequence=str(feature_map.sequence),
+                         precursor_charge=int(feature_map.precursor_charge),
+                         columns=np.array(columns, dtype=str),
+                         object_columns=np.array(object_columns, dtype=str),
+                         **arrays)
+            os.replace(tmp_path, path)
+            entry_size = os.path.getsize(path)
+        except OSError as e:
+            LOGGER.warning(f"Could not write feature map to cache {self.cache_dir} ({e})")
+            self._remove(tmp_path)
+            return
+
+        # replacing a cached FeatureMap overestimates the size, which is corrected by the scan of the next eviction
+        if self._size is None:
+            self._size = self.get_size()
+        else:
+            self._size += entry_size
+        if self._size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        '''
+        Remove the least recently used FeatureMaps until the cache fits into its maximum size, this scans the cache directory and resets the running size estimate
+        '''
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith('.npz'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_size:
+                break
+            self._remove(path)
+            size -= entry_size
+        self._size = size
+
+    def get_size(self) -> int:
+        '''
+        Get the size of the cache
+
+        Returns:
+            int: The size of the cached FeatureMaps in bytes
+        '''
+        return sum(entry.stat().st_size for entry in os.scandir(self.cache_dir) if entry.is_file() and entry.name.endswith('.npz'))
+
+    def clear(self):
+        '''
+        Remove all FeatureMaps from the cache
+        '''
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith('.npz'):
+                self._remove(entry.path)
+        self._size = 0
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
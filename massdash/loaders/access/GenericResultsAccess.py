@@ -5,7 +5,7 @@ massdash/loaders/access/GenericResultsAccess
 
 from abc import ABC, abstractmethod
 import pandas as pd
-from typing import List, Optional, Callable, Union, Dict
+from typing import List, Optional, Callable, Union, Dict, Tuple
 
 # Structs
 from ...structs.TransitionGroupFeature import TransitionGroupFeature
@@ -32,6 +32,12 @@ class GenericResultsAccess(ABC):
     def has_im(self) -> bool:
         pass
 
+    def close(self):
+        '''
+        Release the handles on the results file, results files which are loaded into memory do not hold any
+        '''
+        pass
+
     @property
     def columns(self) -> List[str]:
         if self.has_im:
@@ -51,6 +57,18 @@ class GenericResultsAccess(ABC):
     def getTopTransitionGroupFeature(self, runname: str, pep: str, charge: int) -> TransitionGroupFeature:
         pass
 
+    @abstractmethod
+    def getTopTransitionGroupFeaturesOfRun(self, runname: str) -> Dict[Tuple[str, int], TransitionGroupFeature]:
+        '''
+        Get the top TransitionGroupFeature of every precursor of a run at once, instead of a call of getTopTransitionGroupFeature per precursor.
+
+        Args:
+            runname: (str) The run name
+        Returns:
+            The top feature by modified sequence and charge, precursors without a feature in the run are missing
+        '''
+        pass
+
     @abstractmethod
     def getRunNames(self) -> List[str]:
         pass
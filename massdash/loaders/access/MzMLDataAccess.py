@@ -3,15 +3,15 @@ massdash/loaders/access/MzMLDataAccess
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 """
 
+import os
+import copy
 import click
-from typing import List, Tuple, Literal
-import itertools
+import hashlib
+from typing import Dict, List, Tuple, Literal, Union, Optional, Iterable, Iterator
 from tqdm import tqdm
-from joblib import Parallel, delayed
-import traceback
-import sys
 import mmap
 from pathlib import Path
+from joblib import Parallel, delayed
 
 # data modules
 import pyopenms as po
@@ -22,8 +22,14 @@ import numpy as np
 from ...structs.TargetedDIAConfig import TargetedDIAConfig
 from ...structs.FeatureMap import FeatureMap
 from ...structs.TransitionGroupFeature import TransitionGroupFeature
+from ...structs.TransitionGroup import TransitionGroup
+from ...structs.Chromatogram import Chromatogram
+from ...structs.SpectrumMetaDataIndex import SpectrumMetaDataIndex
+# Access
+from .ColumnarSpectrumStore import ColumnarSpectrumStore
 # Internal
-from ...util import LOGGER, method_timer, code_block_timer
+from ...constants import MASSDASH_CACHE_DIR
+from ...util import LOGGER, method_timer, code_block_timer, file_fingerprint, is_file_fingerprint_current
 
 class MzMLDataAccess():
     """
@@ -31,9 +37,15 @@ class MzMLDataAccess():
     
     Attributes:
         filename (str): The mzML file to load.
-        readOptions (str): The readOptions to use, either 'ondisk' or 'cached'.
-        exp (OnDiscMSExperiment): The on disk experiment.
+        readOptions (str): The readOptions to use, either 'ondisk', 'cached', 'columnar' or 'hot'.
+        exp (OnDiscMSExperiment): The on disk experiment, the CachedmzML with readOptions 'cached' or the ColumnarSpectrumStore with readOptions 'columnar' and 'hot'.
         meta_data (MSExperiment): The meta data.
+        meta_data_index (SpectrumMetaDataIndex): Columnar index of the spectrum meta data, built once when the file is opened.
+        meta_data_sidecar (bool): Whether the spectrum meta data index is cached in a sidecar file next to the mzML file.
+        columnar_store (ColumnarSpectrumStore): The memory mapped columnar copy of the peaks, only used with readOptions 'columnar'. With readOptions 'hot' the columnar copy of the peaks held in memory.
+        hot_memory_budget (int): The maximum size in bytes of the peaks held in memory with readOptions 'hot'.
+        cache_dir (str): The directory the OpenMS cached representation of the mzML file is stored in, only used with readOptions 'cached'.
+        cached_mzml (CachedmzML): The OpenMS cached representation of the mzML file, only used with readOptions 'cached'.
         has_im (bool): Whether the data has ion mobility.
         
     Methods:
@@ -42,22 +54,36 @@ class MzMLDataAccess():
         get_spectra_rt_list: Get a list of RT for all the spectra using meta_exp.
     """
 
-    def __init__(self, filename: str, readOptions="ondisk", verbose=False):
+    # Suffix of the sidecar file caching the spectrum meta data index next to the mzML file
+    META_DATA_SIDECAR_SUFFIX = '.massdash-index.npz'
+    # Suffix of the directory holding the columnar spectrum store next to the mzML file
+    COLUMNAR_STORE_SUFFIX = '.massdash-store'
+    # Suffix of the binary peak data of an OpenMS cached mzML file, the meta data is stored in the mzML file without the suffix
+    CACHED_MZML_SUFFIX = '.cached'
+
+    def __init__(self, filename: str, readOptions="ondisk", verbose=False, meta_data_index: Optional[SpectrumMetaDataIndex]=None, meta_data_sidecar: bool=False, cache_dir: Optional[str]=None, hot_memory_budget: int=4 * 1024**3):
         """
         Initialise mzMLLoader object
 
         Args:
           mzml_file: (str) mzML file to load
-          readOptions: (str) readOptions to use, either 'ondisk' or 'cached'
+          readOptions: (str) readOptions to use, either 'ondisk', 'cached', 'columnar' or 'hot'. 'columnar' reads the peaks from a memory mapped columnar store next to the mzML file (see ColumnarSpectrumStore), which is built on first open. 'cached' reads the peaks from the OpenMS cached representation of the mzML file in cache_dir, which is built on first open. If the file is already an OpenMS cached mzML file (i.e. the '.cached' file exists next to it) it is read directly. 'hot' decodes all spectra once when the file is opened and keeps the peaks in memory in the layout of the columnar store, grouped by isolation window, so extracting a feature only slices numpy arrays. Runs exceeding hot_memory_budget are read 'ondisk' instead.
           verbose (bool): Enables verbose mode.
+          meta_data_index (SpectrumMetaDataIndex): Spectrum meta data index of the file, e.g. built by another MzMLDataAccess of the same file. If given the spectrum meta data is not parsed again.
+          meta_data_sidecar (bool): Cache the spectrum meta data index in a sidecar file next to the mzML file. If a valid sidecar exists the spectrum meta data is not parsed and the file is not scanned for ion mobility data.
+          cache_dir (str): The directory the OpenMS cached representation of the mzML file is stored in with readOptions 'cached'. Defaults to 'cached_mzml' in MASSDASH_CACHE_DIR.
+          hot_memory_budget (int): The maximum size in bytes of the peaks held in memory with readOptions 'hot'. Defaults to 4 GB.
         """
         
         self.filename = filename
         self.runName = str(Path(filename).stem)
         self.readOptions = readOptions
+        self.verbose = verbose
+        self.meta_data_sidecar = meta_data_sidecar
+        self.cache_dir = cache_dir if cache_dir is not None else os.path.join(MASSDASH_CACHE_DIR, 'cached_mzml')
+        self.hot_memory_budget = hot_memory_budget
         self.exp = po.OnDiscMSExperiment()
         self.meta_data = po.MSExperiment()
-        self.has_im = self.check_ion_mobility()
         
         LOGGER.name = self.__class__.__name__
         if verbose:
@@ -65,8 +91,33 @@ class MzMLDataAccess():
         else:
             LOGGER.setLevel("INFO")
 
-        
+        self.meta_data_index = meta_data_index
+        self.columnar_store = None
+        if self.readOptions == "columnar":
+            # the columnar store carries the spectrum meta data index of the run
+            self.columnar_store = self.load_columnar_store()
+            if self.columnar_store is not None and self.meta_data_index is None:
+                self.meta_data_index = self.columnar_store.meta_data_index
+        self.cached_mzml = None
+        if self.readOptions == "cached":
+            # the cached representation is stored together with the spectrum meta data index of the run
+            self.cached_mzml, cached_meta_data_index = self.load_cached_mzml()
+            if self.cached_mzml is not None and self.meta_data_index is None:
+                self.meta_data_index = cached_meta_data_index
+        if self.meta_data_index is None and self.meta_data_sidecar:
+            self.meta_data_index = self.load_meta_data_sidecar()
+        write_sidecar = self.meta_data_sidecar and self.meta_data_index is None
+        if self.meta_data_index is not None:
+            self.has_im = self.meta_data_index.has_im
+        elif self.cached_mzml is not None:
+            # the meta data mzML file of an OpenMS cached mzML file does not contain the data arrays
+            self.has_im = self.check_cached_ion_mobility()
+        else:
+            self.has_im = self.check_ion_mobility()
+
         self.load_data()
+        if write_sidecar:
+            self.write_meta_data_sidecar()
 
     def __str__(self):
         return f"MzMLDataAccess(filename={self.filename}, has_im={self.has_im})"
@@ -97,6 +148,198 @@ class MzMLDataAccess():
                     break
         return has_ion_mobility
 
+    def check_cached_ion_mobility(self, num_spectra_to_check=100):
+        """
+        Check if an OpenMS cached mzML file contains ion mobility data
+
+        Args:
+        num_spectra_to_check: (int) Number of spectra to check for an "Ion Mobility" data array
+
+        Returns:
+        Return a boolean indicating if the cached mzML file contains ion mobility data
+        """
+        for spectrum_indice in range(min(num_spectra_to_check, self.cached_mzml.getNrSpectra())):
+            if any(fda.getName() == 'Ion Mobility' for fda in self.cached_mzml.getSpectrum(spectrum_indice).getFloatDataArrays()):
+                return True
+        return False
+
+    def get_meta_data_sidecar_path(self) -> str:
+        """
+        Get the path of the sidecar file caching the spectrum meta data index
+
+        Return:
+          Return the path of the sidecar file
+        """
+        return f"{self.filename}{self.META_DATA_SIDECAR_SUFFIX}"
+
+    def load_meta_data_sidecar(self) -> Optional[SpectrumMetaDataIndex]:
+        """
+        Load the spectrum meta data index from the sidecar file. The sidecar is only used if it was built from the same file, i.e. if the size and either the modification time or the content hash of the file match.
+
+        Return:
+          Return the spectrum meta data index, None if there is no valid sidecar file
+        """
+        sidecar_path = self.get_meta_data_sidecar_path()
+        if not os.path.isfile(sidecar_path):
+            return None
+        try:
+            with code_block_timer(f'Loading spectrum meta data index from {sidecar_path}...', LOGGER.debug):
+                meta_data_index, fingerprint = SpectrumMetaDataIndex.load(sidecar_path)
+        except Exception as e:
+            LOGGER.warning(f"Could not read spectrum meta data sidecar {sidecar_path}, rebuilding it ({e})")
+            return None
+
+        if not is_file_fingerprint_current(self.filename, fingerprint):
+            LOGGER.info(f"Spectrum meta data sidecar {sidecar_path} is out of date, rebuilding it")
+            return None
+        return meta_data_index
+
+    def write_meta_data_sidecar(self):
+        """
+        Write the spectrum meta data index to the sidecar file, together with the fingerprint of the mzML file. Failing to write the sidecar (e.g. read-only data directory) is not an error.
+        """
+        sidecar_path = self.get_meta_data_sidecar_path()
+        # write to a temporary file first so that concurrent readers never see a partially written sidecar
+        tmp_path = f"{sidecar_path}.{os.getpid()}.tmp"
+        try:
+            self.meta_data_index.save(tmp_path, file_fingerprint(self.filename))
+            os.replace(tmp_path, sidecar_path)
+            LOGGER.debug(f"Wrote spectrum meta data sidecar {sidecar_path}")
+        except OSError as e:
+            LOGGER.warning(f"Could not write spectrum meta data sidecar {sidecar_path} ({e})")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def get_columnar_store_path(self) -> str:
+        """
+        Get the directory of the columnar spectrum store of the mzML file
+
+        Return:
+          Return the path of the columnar spectrum store
+        """
+        return f"{self.filename}{self.COLUMNAR_STORE_SUFFIX}"
+
+    def load_columnar_store(self) -> Optional[ColumnarSpectrumStore]:
+        """
+        Open the columnar spectrum store of the mzML file. Like the meta data sidecar, the store is only used if it was built from the same file.
+
+        Return:
+          Return the columnar spectrum store, None if there is no valid store
+        """
+        store_path = self.get_columnar_store_path()
+        if not os.path.isdir(store_path):
+            return None
+        try:
+            store = ColumnarSpectrumStore.open(store_path)
+        except Exception as e:
+            LOGGER.warning(f"Could not read columnar spectrum store {store_path}, rebuilding it ({e})")
+            return None
+
+        if not is_file_fingerprint_current(self.filename, store.fingerprint):
+            LOGGER.info(f"Columnar spectrum store {store_path} is out of date, rebuilding it")
+            return None
+        return store
+
+    def write_columnar_store(self, exp: po.OnDiscMSExperiment) -> ColumnarSpectrumStore:
+        """
+        Decode all spectra of the mzML file once and write them to the columnar spectrum store next to it
+
+        Args:
+          exp: (OnDiscMSExperiment) the opened mzML file
+
+        Return:
+          Return the memory mapped columnar spectrum store
+        """
+        store_path = self.get_columnar_store_path()
+        with code_block_timer(f'Writing columnar spectrum store {store_path}...', LOGGER.info):
+            return ColumnarSpectrumStore.build(exp, self.meta_data_index, store_path, file_fingerprint(self.filename))
+
+    def get_cached_mzml_path(self) -> str:
+        """
+        Get the path of the OpenMS cached representation of the mzML file in the cache directory. The name contains a hash of the absolute path of the mzML file, so runs with the same name in different directories do not share a cached file.
+
+        Return:
+          Return the path of the meta data mzML file, the peaks are stored in the same path with the '.cached' suffix
+        """
+        path_hash = hashlib.blake2b(os.path.abspath(self.filename).encode(), digest_size=8).hexdigest()
+        return os.path.join(self.cache_dir, f"{self.runName}-{path_hash}.mzML")
+
+    def load_cached_mzml(self) -> Tuple[Optional[po.CachedmzML], Optional[SpectrumMetaDataIndex]]:
+        """
+        Open the OpenMS cached representation of the mzML file. Like the columnar spectrum store, the cached file in the cache directory is only used if it was built from the same file.
+
+        Return:
+          Return the cached mzML file and the spectrum meta data index stored with it (None if the file itself is an OpenMS cached mzML file), (None, None) if there is no valid cached file
+        """
+        if os.path.isfile(f"{self.filename}{self.CACHED_MZML_SUFFIX}"):
+            # the file is already an OpenMS cached mzML file
+            with code_block_timer(f'Loading cached data from {self.filename} file...', LOGGER.info):
+                cached_mzml = po.CachedmzML()
+                po.CachedmzML.load(self.filename, cached_mzml)
+            return cached_mzml, None
+
+        cached_path = self.get_cached_mzml_path()
+        index_path = f"{cached_path}{self.META_DATA_SIDECAR_SUFFIX}"
+        # the index is written last, a cached file without index is incomplete
+        if not os.path.isfile(index_path):
+            return None, None
+        try:
+            meta_data_index, fingerprint = SpectrumMetaDataIndex.load(index_path)
+            if not is_file_fingerprint_current(self.filename, fingerprint):
+                LOGGER.info(f"Cached mzML file {cached_path} is out of date, rebuilding it")
+                return None, None
+            with code_block_timer(f'Loading cached data from {cached_path} file...', LOGGER.info):
+                cached_mzml = po.CachedmzML()
+                po.CachedmzML.load(cached_path, cached_mzml)
+        except Exception as e:
+            LOGGER.warning(f"Could not read cached mzML file {cached_path}, rebuilding it ({e})")
+            return None, None
+        return cached_mzml, meta_data_index
+
+    def write_cached_mzml(self, exp: po.OnDiscMSExperiment, meta_data: po.MSExperiment) -> po.CachedmzML:
+        """
+        Convert the mzML file to the OpenMS cached representation in the cache directory. The spectra are decoded and written one at a time, so the run is never loaded into memory.
+
+        Args:
+          exp: (OnDiscMSExperiment) the opened mzML file
+          meta_data: (MSExperiment) the meta data of the mzML file
+
+        Return:
+          Return the cached mzML file
+        """
+        cached_path = self.get_cached_mzml_path()
+        index_path = f"{cached_path}{self.META_DATA_SIDECAR_SUFFIX}"
+        # write to temporary files first so that concurrent readers never see a partially written cached file
+        tmp_path = f"{cached_path}.{os.getpid()}.tmp"
+        os.makedirs(self.cache_dir, exist_ok=True)
+        try:
+            with code_block_timer(f'Writing cached mzML file {cached_path}...', LOGGER.info):
+                consumer = po.MSDataCachedConsumer(f"{tmp_path}{self.CACHED_MZML_SUFFIX}", True)
+                consumer.setExpectedSize(exp.getNrSpectra(), exp.getNrChromatograms())
+                for spectrum_indice in range(exp.getNrSpectra()):
+                    consumer.consumeSpectrum(exp.getSpectrum(spectrum_indice))
+                for chromatogram_indice in range(exp.getNrChromatograms()):
+                    consumer.consumeChromatogram(exp.getChromatogram(chromatogram_indice))
+                # the cached file is completed when the consumer is destroyed
+                del consumer
+                po.CachedMzMLHandler().writeMetadata(meta_data, tmp_path)
+                self.meta_data_index.save(f"{tmp_path}{self.META_DATA_SIDECAR_SUFFIX}", file_fingerprint(self.filename))
+
+            if os.path.exists(index_path):
+                os.remove(index_path)
+            os.replace(f"{tmp_path}{self.CACHED_MZML_SUFFIX}", f"{cached_path}{self.CACHED_MZML_SUFFIX}")
+            os.replace(tmp_path, cached_path)
+            os.replace(f"{tmp_path}{self.META_DATA_SIDECAR_SUFFIX}", index_path)
+        except BaseException:
+            for path in [tmp_path, f"{tmp_path}{self.CACHED_MZML_SUFFIX}", f"{tmp_path}{self.META_DATA_SIDECAR_SUFFIX}"]:
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+
+        cached_mzml = po.CachedmzML()
+        po.CachedmzML.load(cached_path, cached_mzml)
+        return cached_mzml
+
     @method_timer
     def load_data(self):
         """
@@ -108,74 +351,122 @@ class MzMLDataAccess():
                 exp = po.OnDiscMSExperiment()
 
             with code_block_timer(f'Opening {self.filename} file...', LOGGER.info):
-                exp.openFile(self.filename)
+                # The spectrum meta data does not have to be parsed if the index is already known
+                exp.openFile(self.filename, self.meta_data_index is not None)
 
-            with code_block_timer('Extracting meta data...', LOGGER.debug):
-                meta_data = exp.getMetaData()
+            if self.meta_data_index is None:
+                with code_block_timer('Extracting meta data...', LOGGER.debug):
+                    meta_data = exp.getMetaData()
+            else:
+                meta_data = po.MSExperiment()
 
             LOGGER.info(
-                f"There are {meta_data.getNrSpectra()} spectra and {exp.getNrChromatograms()} chromatograms.")
-            LOGGER.info(
-                f"There are {sum([spec.getMSLevel()==1  for spec in meta_data.getSpectra()])} MS1 spectra and {sum([spec.getMSLevel()==2  for spec in meta_data.getSpectra()])} MS2 spectra.")
+                f"There are {exp.getNrSpectra()} spectra and {exp.getNrChromatograms()} chromatograms.")
         elif self.readOptions=="cached":
-            # Because data is cached, we need to make an assumption about whether the file is MS1 or MS2
-            with code_block_timer(f'Loading Cached Data from {self.filename} file...', LOGGER.info):
-                exp = po.SpectrumAccessOpenMSCached(self.filename)
-            ## Still need access to the meta data, so we need to create an on-disk experiment
-            with code_block_timer('Creating OnDiscExperiment...', LOGGER.debug):
-                od_exp = po.OnDiscMSExperiment()
-            with code_block_timer(f'Opening {self.filename} file to extract meta-data...', LOGGER.info):
-                od_exp.openFile(self.filename)
-            with code_block_timer(f'Extracting meta data...', LOGGER.debug):
-                meta_data = od_exp.getMetaData()
-            # Delete OnDiskExperiment since we don't need it anymore, we only need the meta data
-            del od_exp
-    
+            meta_data = po.MSExperiment()
+            if self.cached_mzml is None:
+                # The mzML file is converted once, later opens only load the cached file
+                with code_block_timer(f'Opening {self.filename} file to build the cached mzML file...', LOGGER.info):
+                    od_exp = po.OnDiscMSExperiment()
+                    od_exp.openFile(self.filename)
+                with code_block_timer('Extracting meta data...', LOGGER.debug):
+                    meta_data = od_exp.getMetaData()
+                if self.meta_data_index is None:
+                    with code_block_timer('Building spectrum meta data index...', LOGGER.debug):
+                        self.meta_data_index = SpectrumMetaDataIndex.from_experiment(meta_data, self.has_im)
+                try:
+                    self.cached_mzml = self.write_cached_mzml(od_exp, meta_data)
+                except (OSError, RuntimeError) as e:
+                    LOGGER.warning(f"Could not write cached mzML file {self.get_cached_mzml_path()}, reading {self.filename} on disk instead ({e})")
+                    self.readOptions = "ondisk"
+                    exp = od_exp
+            elif self.meta_data_index is None:
+                # The file itself is an OpenMS cached mzML file
+                meta_data = self.cached_mzml.getMetaData()
+            if self.readOptions == "cached":
+                exp = self.cached_mzml
+
             LOGGER.info(
                 f"There are {exp.getNrSpectra()} spectra and {exp.getNrChromatograms()} chromatograms.")
-            LOGGER.info(
-                f"There are {sum([spec.getMSLevel()==1  for spec in meta_data.getSpectra()])} MS1 spectra and {sum([spec.getMSLevel()==2  for spec in meta_data.getSpectra()])} MS2 spectra.")
+        elif self.readOptions=="columnar":
+            meta_data = po.MSExperiment()
+            if self.columnar_store is None:
+                # The peaks are decoded once to build the store, later opens only memory map it
+                with code_block_timer(f'Opening {self.filename} file to build the columnar spectrum store...', LOGGER.info):
+                    od_exp = po.OnDiscMSExperiment()
+                    od_exp.openFile(self.filename, self.meta_data_index is not None)
+                if self.meta_data_index is None:
+                    with code_block_timer('Extracting meta data...', LOGGER.debug):
+                        meta_data = od_exp.getMetaData()
+                    with code_block_timer('Building spectrum meta data index...', LOGGER.debug):
+                        self.meta_data_index = SpectrumMetaDataIndex.from_experiment(meta_data, self.has_im)
+                try:
+                    self.columnar_store = self.write_columnar_store(od_exp)
+                except OSError as e:
+                    LOGGER.warning(f"Could not write columnar spectrum store {self.get_columnar_store_path()}, reading {self.filename} on disk instead ({e})")
+                    self.readOptions = "ondisk"
+                    exp = od_exp
+            if self.readOptions == "columnar":
+                exp = self.columnar_store
+
+            LOGGER.info(f"There are {len(self.meta_data_index)} spectra.")
+        elif self.readOptions=="hot":
+            meta_data = po.MSExperiment()
+            with code_block_timer(f'Opening {self.filename} file...', LOGGER.info):
+                od_exp = po.OnDiscMSExperiment()
+                od_exp.openFile(self.filename, self.meta_data_index is not None)
+            if self.meta_data_index is None:
+                with code_block_timer('Extracting meta data...', LOGGER.debug):
+                    meta_data = od_exp.getMetaData()
+                with code_block_timer('Building spectrum meta data index...', LOGGER.debug):
+                    self.meta_data_index = SpectrumMetaDataIndex.from_experiment(meta_data, self.has_im)
+            try:
+                # The peaks are decoded once, every extraction afterwards only slices the arrays in memory
+                with code_block_timer(f'Loading the peaks of {self.filename} into memory...', LOGGER.info):
+                    self.columnar_store = ColumnarSpectrumStore.build_in_memory(od_exp, self.meta_data_index, self.hot_memory_budget)
+                exp = self.columnar_store
+            except MemoryError as e:
+                LOGGER.warning(f"Could not load {self.filename} into memory, reading it on disk instead ({e})")
+                self.readOptions = "ondisk"
+                exp = od_exp
+
+            LOGGER.info(f"There are {len(self.meta_data_index)} spectra.")
         else:
-            click.ClickException(f"ERROR: Unknown readOptions ({self.readOptions}) given! Has to be one of 'ondisk', 'cached'")
+            click.ClickException(f"ERROR: Unknown readOptions ({self.readOptions}) given! Has to be one of 'ondisk', 'cached', 'columnar', 'hot'")
 
         self.exp = exp
         self.meta_data = meta_data
-            
+
+        if self.meta_data_index is None:
+            with code_block_timer('Building spectrum meta data index...', LOGGER.debug):
+                self.meta_data_index = SpectrumMetaDataIndex.from_experiment(meta_data, self.has_im)
+        LOGGER.info(
+            f"There are {self.meta_data_index.count_ms_level(1)} MS1 spectra and {self.meta_data_index.count_ms_level(2)} MS2 spectra.")
+
     def get_target_ms_level_indices(self, mslevel=[1,2]) -> np.array:
         """
         Extract spectrum indices for a specific mslevel(s).
 
         Args:
-          self: (object) self object containing meta_data
+          self: (object) self object containing meta_data_index
           mslevel: (list) list of mslevel(s) to extract indices for
 
         Return:
           Return mslevel_indices a list of indices with request mslevel(s) to self
         """
-        if self.readOptions=="ondisk":
-            spectra = self.meta_data.getSpectra()
-            return np.array([indice for indice, spec in enumerate(
-                spectra) if spec.getMSLevel() in mslevel])
-        elif self.readOptions=="cached":
-            return np.array(range(0,self.exp.getNrSpectra()))
-        else:
-            click.ClickException(f"ERROR: Unknown readOptions ({self.readOptions}) given! Has to be one of 'ondisk', 'cached'")
+        return self.meta_data_index.get_ms_level_indices(mslevel)
 
     def get_spectra_rt_list(self) -> np.array:
         """
-        Get a list of RT for all the spectra using meta_exp
+        Get a list of RT for all the spectra using the spectrum meta data index
 
         Args:
-          self: (object) self object containing meta_data
+          self: (object) self object containing meta_data_index
 
         Return:
           Return a list of RT values for spectra
         """
-        if self.readOptions=="ondisk":
-            meta_rt_list = np.array([meta_spec.getRT() for meta_spec in self.meta_data.getSpectra()])
-        else: # self.readOptions=="cached"
-            meta_rt_list = np.array([meta_spec.getRT()for meta_spec in self.meta_data.getSpectra()])
-        return meta_rt_list
+        return self.meta_data_index.rt
     
     def load_spectrum(self, spec_indice: int) -> Tuple[np.array, np.array, np.array]:
         """
@@ -189,8 +480,8 @@ class MzMLDataAccess():
           int_array: intensity array
           im_array: ion mobility array 
         """
-        # Get data arrays
-        if (self.readOptions=="ondisk"):
+        # Get data arrays, the spectra of a cached mzML file are read like the spectra of an on disk experiment
+        if (self.readOptions=="ondisk" or self.readOptions=="cached"):
             with code_block_timer(f'Extracting mz, int, im data arrays...', LOGGER.debug):
                 spec = self.exp.getSpectrum(spec_indice)
                 mz_array = spec.get_peaks()[0]
@@ -199,18 +490,12 @@ class MzMLDataAccess():
                     im_array = spec.getFloatDataArrays()
                 else:
                     im_array = []
-        elif (self.readOptions=="cached"):
-            spec = self.meta_data.getSpectrum(spec_indice)
-            with code_block_timer(f'Extracting mz, int, im data arrays...', LOGGER.debug):
-                das = self.exp.getSpectrumById(spec_indice).getDataArrays()
-                mz_array = das[0].getData()
-                int_array = das[1].getData()
-                if self.has_im:
-                    im_array = das[2].getData()
-                else:
-                    im_array = []
+        elif (self.readOptions=="columnar" or self.readOptions=="hot"):
+            mz_array, int_array, im_array = self.exp.get_spectrum(spec_indice)
+            if im_array is None:
+                im_array = []
         else:
-            LOGGER.error(f"ERROR: Unknown readOptions ({self.readOptions}) given! Has to be one of 'ondisk', 'cached'")
+            LOGGER.error(f"ERROR: Unknown readOptions ({self.readOptions}) given! Has to be one of 'ondisk', 'cached', 'columnar', 'hot'")
         
         return (mz_array, int_array, im_array)
  
@@ -230,229 +515,632 @@ class MzMLDataAccess():
         Return:
           po.MSSpectrum() a MSSpectrum object 
         """
-        # create extraction parameters 
+        if not self._get_spectra_in_scope(np.array([spec_indice]), feature, config).any():
+            LOGGER.debug(f"Feature {feature.sequence}{feature.precursor_charge} Skipping spectrum with spectrum indice {spec_indice} because of its ms level or because its isolation window does not contain target precursor m/z ({feature.precursor_mz})")
+            return None
+
+        return self._filter_spectrum_data(spec_indice, self._load_spectrum_arrays(spec_indice, self._get_feature_im_window(feature, config)), feature, config)
+
+    def _get_feature_im_window(self, feature: TransitionGroupFeature, config: TargetedDIAConfig) -> Optional[Tuple[float, float]]:
+        """
+        Get the ion mobility window the peaks of a feature are filtered for.
+
+        Args:
+          feature: (TransitionGroupFeature) metadata on feature
+          config: (TargetedDIAConfig object) an object of TargetedDIAConfig that contains configuration parameters of how wide filtering windows should be
+
+        Return:
+          (tuple) the lower and upper bound of the ion mobility window, None if the peaks are not filtered by ion mobility
+        """
+        if not self.has_im or feature.consensusApexIM is None:
+            return None
+        return config.get_im_upper_lower(feature.consensusApexIM)
+
+    def _load_spectrum_arrays(self, spec_indice: int, im_window: Optional[Tuple[float, float]] = None) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
+        """
+        Load a single spectrum as numpy arrays.
+
+        Args:
+          spec_indice: (int) an interger of the spectrum indice to extra a spectrum for
+          im_window: (tuple) the ion mobility window the peaks are filtered for afterwards (see _get_feature_im_window). With readOptions 'columnar' and 'hot' only the peaks which can fall in the window are read, otherwise all peaks are returned.
+
+        Return:
+          mz_array: mz array
+          int_array: intensity array
+          im_array: ion mobility array, None if the data has no ion mobility
+        """
+        if (self.readOptions == "columnar" or self.readOptions == "hot") and im_window is not None:
+            return self.exp.get_spectrum_im_window(spec_indice, *im_window)
+        mz_array, int_array, im_array = self.load_spectrum(spec_indice)
+        if not self.has_im:
+            return mz_array, int_array, None
+        if self.readOptions == "ondisk" or self.readOptions == "cached":
+            # get_data returns a view on the FloatDataArray, copy it while the FloatDataArray is still alive
+            return mz_array, int_array, np.array(im_array[0].get_data())
+        return mz_array, int_array, np.asarray(im_array)
+
+    def _get_spectra_in_scope(self, spectrum_indices: np.ndarray, feature: TransitionGroupFeature, config: TargetedDIAConfig) -> np.ndarray:
+        """
+        Check whether spectra have to be decoded for a feature, i.e. whether they have a requested ms level and, for MS2 spectra, whether their isolation window contains the feature's precursor m/z.
+
+        Args:
+          spectrum_indices: (np.ndarray) the spectrum indices to check
+          feature: (TransitionGroupFeature) metadata on feature
+          config: (TargetedDIAConfig object) an object of TargetedDIAConfig that contains configuration parameters of how wide filtering windows should be
+
+        Return:
+          (np.ndarray) boolean mask, True for spectra that have to be loaded and filtered for the feature
+        """
+        ms_level = self.meta_data_index.ms_level[spectrum_indices]
+        ms1_in_scope = (ms_level == 1) & (1 in config.mslevel)
+        # Only load and extract product spectra if current spectrums isolation window contains precursor mz
+        ms2_in_scope = (ms_level == 2) & (2 in config.mslevel) & self.meta_data_index.get_isolation_window_mask(spectrum_indices, feature.precursor_mz)
+        return ms1_in_scope | ms2_in_scope
+
+    def _get_peak_mask(self,
+                       spec_indice: int,
+                       mz_array: np.ndarray,
+                       im_array: Optional[np.ndarray],
+                       feature: TransitionGroupFeature,
+                       config: TargetedDIAConfig,
+                       product_mz_tol_bounds: Optional[Tuple[np.ndarray, np.ndarray]] = None) -> np.ndarray:
+        """
+        Get the peaks of an already decoded spectrum that pass the filter of a feature. The caller is responsible for checking that the spectrum is in scope of the feature (see _get_spectra_in_scope).
+
+        Args:
+          spec_indice: (int) the spectrum indice of the decoded spectrum
+          mz_array: (np.ndarray) the mz array of the spectrum
+          im_array: (np.ndarray) the ion mobility array of the spectrum, None if the data has no ion mobility
+          feature: (TransitionGroupFeature) metadata on feature
+          config: (TargetedDIAConfig object) an object of TargetedDIAConfig that contains configuration parameters of how wide filtering windows should be
+          product_mz_tol_bounds: (tuple) precomputed product mz tolerance bounds of the feature (see TargetedDIAConfig.get_product_mz_tol_bounds), computed if not given
+
+        Return:
+          (np.ndarray) boolean mask of the peaks that pass the filter
+        """
+        # first filter IM
+        im_match_bool = np.ones(mz_array.shape, dtype=bool)
         if self.has_im:
             if feature.consensusApexIM is not None:
                 im_start, im_end = config.get_im_upper_lower(feature.consensusApexIM)
+                im_match_bool = (im_array > im_start) & (im_array < im_end)
             else:
                 LOGGER.critical(f"ion mobility information not found in feature {feature.sequence} but present in mzML file")
-        # Get tolerance bounds on coordinates
-        target_precursor_mz_lower, target_precursor_mz_upper = config.get_upper_lower_tol(feature.precursor_mz)
-        target_product_upper_lower_list = [config.get_upper_lower_tol(mz) for mz in feature.product_mz]
 
-        spec_meta = self.meta_data.getSpectrum(spec_indice)
+        ms_level = self.meta_data_index.ms_level[spec_indice]
+        if ms_level == 1:
+            # Get tolerance bounds on coordinates
+            target_precursor_mz_lower, target_precursor_mz_upper = config.get_upper_lower_tol(feature.precursor_mz)
+            mz_match_bool = (mz_array > target_precursor_mz_lower) & (mz_array < target_precursor_mz_upper)
+        elif ms_level == 2:
+            if product_mz_tol_bounds is None:
+                product_mz_tol_bounds = config.get_product_mz_tol_bounds(feature.product_mz)
+            mz_match_bool = config.is_mz_in_product_mz_tol_window_array(mz_array, product_mz_tol_bounds)
+        else:
+            mz_match_bool = np.zeros(mz_array.shape, dtype=bool)
+
+        return mz_match_bool & im_match_bool
 
+    def _filter_spectrum_data(self, 
+                              spec_indice: int,
+                              spectrum_data: Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]],
+                              feature: TransitionGroupFeature,
+                              config: TargetedDIAConfig,
+                              product_mz_tol_bounds: Optional[Tuple[np.ndarray, np.ndarray]] = None) -> po.MSSpectrum:
+        """
+        Filter already decoded spectrum data for a given feature. The caller is responsible for checking that the spectrum is in scope of the feature (see _get_spectra_in_scope).
 
-        writeSpectrum = False # boolean flag of whether to write out filtered spectrum
+        Args:
+          spec_indice: (int) the spectrum indice of the decoded spectrum
+          spectrum_data: (tuple) the mz, intensity and ion mobility arrays as returned by _load_spectrum_arrays
+          feature: (TransitionGroupFeature) metadata on feature
+          config: (TargetedDIAConfig object) an object of TargetedDIAConfig that contains configuration parameters of how wide filtering windows should be
+          product_mz_tol_bounds: (tuple) precomputed product mz tolerance bounds of the feature (see TargetedDIAConfig.get_product_mz_tol_bounds), computed if not given
 
-        if spec_meta.getMSLevel() == 1 and 1 in config.mslevel:
-            mz_array, int_array, im_array = self.load_spectrum(spec_indice)
-            # first filter IM
-            if self.has_im:
-                if (self.readOptions=="ondisk"): 
-                    im_match_bool = (im_array[0].get_data() > im_start) & (
-                        im_array[0].get_data() < im_end)
-                elif (self.readOptions=="cached"):
-                    im_match_bool = (im_array > im_start) & (
-                        im_array < im_end)
-            else:
-                im_match_bool = np.ones(mz_array.shape)
+        Return:
+          po.MSSpectrum() a MSSpectrum object, None if no peaks passed the filter
+        """
+        mz_array, int_array, im_array = spectrum_data
+        peak_mask = self._get_peak_mask(spec_indice, mz_array, im_array, feature, config, product_mz_tol_bounds)
 
-            mz_match_bool = (mz_array > target_precursor_mz_lower) & (
-                mz_array < target_precursor_mz_upper)
+        # Only write out filtered spectra if there is any fitlered spectra to write out
+        if not np.any(peak_mask):
+            return None
 
-            writeSpectrum = any(mz_match_bool*im_match_bool)
-            if writeSpectrum:
-                LOGGER.debug(
-                    f"Adding MS1 spectrum {spec_meta.getNativeID()} with spectrum indice {spec_indice} filtered for {sum(mz_match_bool*im_match_bool)} spectra between {target_precursor_mz_lower} m/z and {target_precursor_mz_upper} m/z") # and IM between {im_start} and {im_end}")
+        ms_level = self.meta_data_index.ms_level[spec_indice]
+        LOGGER.debug(
+            f"Feature {feature.sequence}{feature.precursor_charge} - Adding MS{ms_level} spectrum with spectrum indice {spec_indice} filtered for {np.sum(peak_mask)} peaks")
 
+        spec_out = po.MSSpectrum()
+        # replace peak data with filtered peak data
+        spec_out.set_peaks((mz_array[peak_mask], int_array[peak_mask]))
+        if self.has_im:
+            # repalce float data arrays with filtered ion mobility data
+            fda = po.FloatDataArray()
+            fda.set_data(im_array[peak_mask].astype(np.float32))
+            fda.setName("Ion Mobility")
+            spec_out.setFloatDataArrays([fda])
+        spec_out.setMSLevel(int(ms_level))
+        spec_out.setRT(self.meta_data_index.rt[spec_indice])
+        return spec_out
 
-        elif spec_meta.getMSLevel() == 2 and 2 in config.mslevel:
-            # Get SWATH windows upper and lower
-            current_prec = spec_meta.getPrecursors()[0]
+    def _filter_spectra_block(self,
+                              spectrum_indices: np.ndarray,
+                              spectrum_features: List[List[int]],
+                              features: List[TransitionGroupFeature],
+                              config: TargetedDIAConfig,
+                              product_mz_tol_bounds: List[Tuple[np.ndarray, np.ndarray]]) -> List[Dict[str, np.ndarray]]:
+        """
+        Filter a contiguous block of spectra for a set of features. Every spectrum is decoded once and the peaks passing the filter are written straight into growable numpy column buffers, no spectrum objects are created.
+        With readOptions 'columnar' or 'hot' and ion mobility data, only the ion mobility slice of every feature is read from a spectrum instead.
 
-            swath_mz_win_lower = current_prec.getMZ() - current_prec.getIsolationWindowLowerOffset()
-            swath_mz_win_upper = current_prec.getMZ() + current_prec.getIsolationWindowUpperOffset()
+        Args:
+          spectrum_indices: (np.ndarray) the sorted spectrum indices of the block
+          spectrum_features: (List[List[int]]) for every spectrum of the block the indices of the features it has to be filtered for
+          features: (List[TransitionGroupFeature]) metadata on the features
+          config: (TargetedDIAConfig object) an object of TargetedDIAConfig that contains configuration parameters of how wide filtering windows should be
+          product_mz_tol_bounds: (List[tuple]) the product mz tolerance bounds of every feature
 
-            # Only load and extract product spectra if current spectrums isolation window contains precursor mz
-            if feature.precursor_mz > swath_mz_win_lower and feature.precursor_mz < swath_mz_win_upper:
-                mz_array, int_array, im_array = self.load_spectrum(spec_indice)
-                if self.has_im:
-                    if (self.readOptions=="ondisk"): 
-                        im_match_bool = (im_array[0].get_data() > im_start) & (
-                            im_array[0].get_data() < im_end)
-                    elif (self.readOptions=="cached"):
-                        im_match_bool = (im_array > im_start) & (
-                            im_array < im_end)
+        Return:
+          List[Dict[str, np.ndarray]]: for every feature the columns of the peaks that passed the filter, 'spectrum' (spectrum indice of the peak), 'mz', 'int' and 'im' (only if the data has ion mobility)
+        """
+        peak_buffers = [_PeakBuffer(self.has_im) for _ in features]
+        im_windows = [self._get_feature_im_window(feat, config) for feat in features] if self.readOptions in ("columnar", "hot") else [None] * len(features)
+        for spectrum_indice, feature_indices in zip(spectrum_indices.tolist(), spectrum_features):
+            spectrum_data = None
+            for feature_idx in feature_indices:
+                if im_windows[feature_idx] is not None:
+                    mz_array, int_array, im_array = self._load_spectrum_arrays(spectrum_indice, im_windows[feature_idx])
                 else:
-                    im_match_bool = np.ones(mz_array.shape)
-
-                mz_match_bool = np.array(list(map(config.is_mz_in_product_mz_tol_window, mz_array, itertools.repeat(
-                    target_product_upper_lower_list, len(mz_array)))))
-                writeSpectrum = any(mz_match_bool*im_match_bool)
-                if writeSpectrum:
-                    LOGGER.debug(
-                        f"Feature {feature.sequence}{feature.precursor_charge} - Adding MS2 spectrum {spec_meta.getNativeID()} with spectrum indice {spec_indice} filtered for {sum(mz_match_bool*im_match_bool)} spectra between {target_product_upper_lower_list} m/z") #and IM between {im_start} and {im_end}")
-            else:
-                LOGGER.debug(f"Feature {feature.sequence}{feature.precursor_charge} Skipping MS2 spectrum {spec_meta.getNativeID()} with spectrum indice {spec_indice} because current swath isolation window ({swath_mz_win_lower} m/z - {swath_mz_win_upper} m/z) does not contain target precursor m/z ({feature.consensusApex})")
+                    if spectrum_data is None:
+                        spectrum_data = self._load_spectrum_arrays(spectrum_indice)
+                    mz_array, int_array, im_array = spectrum_data
+                peak_mask = self._get_peak_mask(spectrum_indice, mz_array, im_array, features[feature_idx], config, product_mz_tol_bounds[feature_idx])
+                peak_buffers[feature_idx].append(spectrum_indice, mz_array, int_array, im_array, peak_mask)
 
-        # Only write out filtered spectra if there is any fitlered spectra to write out
-        spec_out = po.MSSpectrum()
-        if writeSpectrum:
-            with code_block_timer(f'Getting filtered spectrum...', LOGGER.debug):
-                extract_target_indices = np.where(mz_match_bool * im_match_bool)
-                filtered_mz = mz_array[extract_target_indices]
-                filtered_int = int_array[extract_target_indices]
-                if self.has_im:
-                    if (self.readOptions=="ondisk"):
-                        filtered_im = im_array[0].get_data()[extract_target_indices]
-                    elif (self.readOptions=="cached"):
-                        filtered_im = im_array[extract_target_indices]
-                else:
-                    filtered_im = []
-                LOGGER.debug(f"INFO: Adding filtered mz data of length {len(filtered_mz)} | int of length {len(filtered_int)} | im of length {len(filtered_im)}")
-                # replace peak data with filtered peak data
-                spec_out.set_peaks((filtered_mz, filtered_int))
-                
-                if self.has_im:
-                    # repalce float data arrays with filtered ion mobility data
-                    fda = po.FloatDataArray()
-                    filtered_im_np = np.array(filtered_im).astype(np.float32)
-                    fda.set_data(filtered_im_np)
-                    fda.setName("Ion Mobility")
-                    spec_out.setFloatDataArrays([fda])
-            
-            spec_out.setMSLevel(spec_meta.getMSLevel())
-            spec_out.setRT(spec_meta.getRT())
-            # If you have a lot of filtered spectra to return, it becomes memory heavy.
-            return spec_out
+        return [peak_buffer.to_columns() for peak_buffer in peak_buffers]
 
     @method_timer
-    def reduce_spectra(self, feature: TransitionGroupFeature , config: TargetedDIAConfig) -> FeatureMap:
+    def reduce_spectra(self, feature: Union[TransitionGroupFeature, List[TransitionGroupFeature]], config: TargetedDIAConfig, threads: int=1) -> Union[FeatureMap, List[FeatureMap]]:
         """
         Main method for filtering raw mzML DIA/diaPASEF data given specific set of coordinates to filter for.
 
+        Multiple precursors can be extracted at once by passing a list of features. In this case the spectra of the run are swept only once and every spectrum is decoded at most once, no matter how many of the precursors it is relevant to.
+
         Args:
-            feature: (TransitionGroupFeature) a TransitionGroupFeature object that contains coordinates to filter for
+            feature: (TransitionGroupFeature | List[TransitionGroupFeature]) a TransitionGroupFeature object (or a list of them) that contains coordinates to filter for
             config: (TargetedDIAConfig object) an object of TargetedDIAConfig that contains configuration parameters of how wide filtering windows should be
+            threads: (int) number of worker processes, if larger than 1 the spectra are split into contiguous blocks which are decoded and filtered in parallel
 
         Return:
-          FeatureMap: a FeatureMap object that contains filtered spectra
+          FeatureMap | List[FeatureMap]: a FeatureMap object that contains filtered spectra, or a list of FeatureMap objects (in the order of the features given) if a list of features was given
         """
+        if isinstance(feature, TransitionGroupFeature):
+            return self.reduce_spectra([feature], config, threads)[0]
+        features = feature
 
-        # Get indices for requested ms level spectra
         LOGGER.debug(f"Extracting indices for MS Levels: {config.mslevel}")
 
-        # Initialize empty MSExperiment container to store filtered data
-        filtered = po.MSExperiment()
+        # Map each candidate spectrum to the features it has to be filtered for
+        spectrum_to_features = {}
+        for feature_idx, feat in enumerate(features):
+            rt_start, rt_end = config.get_rt_upper_lower(feat.consensusApex)
 
-       
-        rt_start, rt_end = config.get_rt_upper_lower(feature.consensusApex)
-         
-        LOGGER.debug(
-            f"Extracting spectra for {feature.sequence}{feature.precursor_charge} | RT: {feature.consensusApex} sec ({rt_start} - {rt_end})")
+            LOGGER.debug(
+                f"Extracting spectra for {feat.sequence}{feat.precursor_charge} | RT: {feat.consensusApex} sec ({rt_start} - {rt_end})")
 
-        # Restrict spectra list further for RT window, to reduce the number of spectra we need to check to perform filtering on
-        use_rt_spec_indices = np.where(np.array(
-            [spec_rt >= rt_start and spec_rt <= rt_end for spec_rt in self.get_spectra_rt_list()]))
-        target_spectra_indices = np.intersect1d(
-            self.get_target_ms_level_indices(config.mslevel), use_rt_spec_indices)
-        
-        with code_block_timer(f"Filtering {target_spectra_indices.shape[0]} Spectra for {feature.sequence}{feature.precursor_charge}...", LOGGER.debug):
-            try:
-                filt_spec_list = Parallel(n_jobs=1)(delayed(self.filter_single_spectrum)(spectrum_indice, feature, config) for spectrum_indice in target_spectra_indices.tolist())
-            except:
-                traceback.print_exc(file=sys.stdout)
+            # Restrict spectra list to the requested ms levels in the RT window and to the isolation windows containing the precursor
+            target_spectra_indices = self.meta_data_index.get_target_spectrum_indices(feat.precursor_mz, rt_start, rt_end, config.mslevel)
+            for spectrum_indice in target_spectra_indices.tolist():
+                spectrum_to_features.setdefault(spectrum_indice, []).append(feature_idx)
+
+        spectrum_indices = np.array(sorted(spectrum_to_features), dtype=np.int64)
+        spectrum_features = [spectrum_to_features[spectrum_indice] for spectrum_indice in spectrum_indices.tolist()]
+
+        # Product mz tolerance bounds only have to be sorted once per feature
+        product_mz_tol_bounds = [config.get_product_mz_tol_bounds(feat.product_mz) for feat in features]
+
+        # Single sweep over the candidate spectra, each spectrum is decoded at most once. The peaks of a hot run are only held by this process, filtering them is cheaper than loading the run in worker processes
+        n_jobs = min(threads, spectrum_indices.shape[0] // _MIN_SPECTRA_PER_BLOCK) if self.readOptions != "hot" else 1
+        with code_block_timer(f"Filtering {spectrum_indices.shape[0]} Spectra for {len(features)} feature(s) using {max(n_jobs, 1)} process(es)...", LOGGER.debug):
+            if n_jobs > 1:
+                # Contiguous blocks of spectra, every worker decodes its block from its own handle on the file
+                blocks = np.array_split(np.arange(spectrum_indices.shape[0]), n_jobs)
+                block_peaks = Parallel(n_jobs=n_jobs)(delayed(_filter_spectra_block)(self.filename, self.readOptions, spectrum_indices[block], [spectrum_features[i] for i in block], features, config, product_mz_tol_bounds, self.cache_dir, self.meta_data_sidecar) for block in blocks)
+            else:
+                block_peaks = [self._filter_spectra_block(spectrum_indices, spectrum_features, features, config, product_mz_tol_bounds)]
 
-        # Add filtered spectra to MSExperiment container
-        filt_spec_list = list(
-            filter(lambda spectra: spectra is not None, filt_spec_list))
-        # Add filtered spectrum to filtered MSExperiment container
-        _ = [filtered.addSpectrum(spec) for spec in filt_spec_list]
+        feature_maps = []
+        for feature_idx, feat in enumerate(features):
+            peaks = {col: np.concatenate([b[feature_idx][col] for b in block_peaks]) for col in block_peaks[0][feature_idx]}
+            feature_maps.append(self._peaksToFeatureMap(peaks, feat, config))
 
-        #return filtered
-        return self.msExperimentToFeatureMap(filtered, feature, config)
+        return feature_maps
 
-    # @method_timer
-    def msExperimentToFeatureMap(self, msExperiment: po.MSExperiment, feature: TransitionGroupFeature, config: TargetedDIAConfig ) -> FeatureMap:
+    def iter_reduce_spectra(self, features: Iterable[TransitionGroupFeature], config: TargetedDIAConfig, batch_size: int=100, threads: int=1) -> Iterator[Tuple[TransitionGroupFeature, FeatureMap]]:
         """
-        Convert filtered spectra to Pandas DataFrame
+        Lazily filter the spectra for a stream of features. The features are extracted in batches (see reduce_spectra with a list of features) and the FeatureMaps of a batch are yielded as soon as the batch is extracted, so at most batch_size FeatureMaps are held at a time.
 
         Args:
-            msExperiment: (MSExperiment) MSExperiment object that contains filtered data
+            features: (Iterable[TransitionGroupFeature]) the features to filter for, can be a generator
+            config: (TargetedDIAConfig object) an object of TargetedDIAConfig that contains configuration parameters of how wide filtering windows should be
+            batch_size: (int) number of features extracted in a single sweep over the spectra
+            threads: (int) number of worker processes used for every batch, see reduce_spectra
+
+        Yields:
+            Tuple[TransitionGroupFeature, FeatureMap]: the feature and its FeatureMap, in the order of the features given
+        """
+        batch = []
+        for feature in features:
+            batch.append(feature)
+            if len(batch) == batch_size:
+                yield from zip(batch, self.reduce_spectra(batch, config, threads))
+                batch = []
+        if len(batch) > 0:
+            yield from zip(batch, self.reduce_spectra(batch, config, threads))
+
+    @method_timer
+    def extract_chromatograms(self, feature: Union[TransitionGroupFeature, List[TransitionGroupFeature]], config: TargetedDIAConfig, threads: int=1) -> Union[TransitionGroup, List[TransitionGroup]]:
+        """
+        Chromatogram only extraction, the summed intensity of every transition (and of the precursor) in every spectrum is accumulated into a dense preallocated matrix while sweeping the spectra.
+        No peak level FeatureMap is built, the peaks passing the filter are never materialized.
+
+        The chromatograms are the same as from reduce_spectra followed by FeatureMap.to_chromatograms: MS2 peaks are assigned to the transition with the closest product m/z, spectra with the same RT are summed and only RTs (and transitions) with at least one peak are reported.
+        The precursor intensities of a spectrum are summed as well.
+
+        Multiple precursors can be extracted at once by passing a list of features, the spectra of the run are swept only once and every spectrum is decoded at most once (see reduce_spectra).
+
+        Args:
+            feature: (TransitionGroupFeature | List[TransitionGroupFeature]) a TransitionGroupFeature object (or a list of them) that contains coordinates to filter for
+            config: (TargetedDIAConfig object) an object of TargetedDIAConfig that contains configuration parameters of how wide filtering windows should be
+            threads: (int) number of worker processes, if larger than 1 the spectra are split into contiguous blocks which are accumulated in parallel (see reduce_spectra)
+
+        Return:
+            TransitionGroup | List[TransitionGroup]: a TransitionGroup object storing the precursor and transition chromatograms, or a list of TransitionGroup objects (in the order of the features given) if a list of features was given
+        """
+        if isinstance(feature, TransitionGroupFeature):
+            return self.extract_chromatograms([feature], config, threads)[0]
+        features = feature
+
+        # the peaks of a hot run are only held by this process, see reduce_spectra
+        n_jobs = 1
+        if threads > 1 and self.readOptions != "hot" and len(features) > 0:
+            spectrum_indices = np.unique(np.concatenate([self.meta_data_index.get_target_spectrum_indices(feat.precursor_mz, *config.get_rt_upper_lower(feat.consensusApex), config.mslevel) for feat in features]))
+            n_jobs = min(threads, spectrum_indices.shape[0] // _MIN_SPECTRA_PER_BLOCK)
+        if n_jobs > 1:
+            with code_block_timer(f"Accumulating chromatograms from {spectrum_indices.shape[0]} Spectra for {len(features)} feature(s) using {n_jobs} processes...", LOGGER.debug):
+                # Contiguous blocks of spectra, every worker accumulates the rows of its block from its own handle on the file
+                blocks = np.array_split(spectrum_indices, n_jobs)
+                block_accumulators = Parallel(n_jobs=n_jobs)(delayed(_accumulate_chromatograms_block)(self.filename, self.readOptions, features, config, (int(block[0]), int(block[-1]) + 1), self.cache_dir, self.meta_data_sidecar) for block in blocks)
+            accumulators = [_ChromatogramAccumulator.concatenate([b[feature_idx] for b in block_accumulators]) for feature_idx in range(len(features))]
+        else:
+            accumulators = self._accumulate_chromatograms(features, config)
+
+        transition_groups = []
+        for feat, accumulator in zip(features, accumulators):
+            if not accumulator.has_peaks():
+                LOGGER.warning(f"No spectra found for peptide: {feat.sequence}{feat.precursor_charge}. Try adjusting the extraction parameters")
+            transition_groups.append(accumulator.to_transition_group(self.meta_data_index.rt))
+        return transition_groups
+
+    def _accumulate_chromatograms(self, features: List[TransitionGroupFeature], config: TargetedDIAConfig, spectrum_range: Optional[Tuple[int, int]]=None) -> List['_ChromatogramAccumulator']:
+        """
+        Sweep the target spectra of a set of features once and accumulate their chromatograms, see extract_chromatograms
+
+        Args:
+            features: (List[TransitionGroupFeature]) metadata on the features
+            config: (TargetedDIAConfig object) an object of TargetedDIAConfig that contains configuration parameters of how wide filtering windows should be
+            spectrum_range: (Tuple[int, int]) if given only the spectra with an indice in [start, end) are accumulated, e.g. a block of spectra of a worker process
+
+        Return:
+            List[_ChromatogramAccumulator]: the accumulator of every feature
+        """
+        # Map each candidate spectrum to the features (and their matrix rows) it has to be accumulated for
+        accumulators = []
+        spectrum_to_features = {}
+        for feature_idx, feat in enumerate(features):
+            rt_start, rt_end = config.get_rt_upper_lower(feat.consensusApex)
+            target_spectra_indices = self.meta_data_index.get_target_spectrum_indices(feat.precursor_mz, rt_start, rt_end, config.mslevel)
+            if spectrum_range is not None:
+                target_spectra_indices = target_spectra_indices[(target_spectra_indices >= spectrum_range[0]) & (target_spectra_indices < spectrum_range[1])]
+            accumulators.append(_ChromatogramAccumulator(target_spectra_indices, feat, config))
+            for row, spectrum_indice in enumerate(target_spectra_indices.tolist()):
+                spectrum_to_features.setdefault(spectrum_indice, []).append((feature_idx, row))
+
+        im_windows = [self._get_feature_im_window(feat, config) for feat in features] if self.readOptions in ("columnar", "hot") else [None] * len(features)
+        with code_block_timer(f"Accumulating chromatograms from {len(spectrum_to_features)} Spectra for {len(features)} feature(s)...", LOGGER.debug):
+            for spectrum_indice in sorted(spectrum_to_features):
+                spectrum_data = None
+                ms_level = self.meta_data_index.ms_level[spectrum_indice]
+                for feature_idx, row in spectrum_to_features[spectrum_indice]:
+                    if im_windows[feature_idx] is not None:
+                        mz_array, int_array, im_array = self._load_spectrum_arrays(spectrum_indice, im_windows[feature_idx])
+                    else:
+                        if spectrum_data is None:
+                            spectrum_data = self._load_spectrum_arrays(spectrum_indice)
+                        mz_array, int_array, im_array = spectrum_data
+                    accumulator = accumulators[feature_idx]
+                    peak_mask = self._get_peak_mask(spectrum_indice, mz_array, im_array, features[feature_idx], config, accumulator.product_mz_tol_bounds)
+                    accumulator.add(row, ms_level, mz_array, int_array, peak_mask)
+        return accumulators
+
+    def _peaksToFeatureMap(self, peaks: Dict[str, np.ndarray], feature: TransitionGroupFeature, config: TargetedDIAConfig) -> FeatureMap:
+        """
+        Convert the filtered peak columns of a feature (see _filter_spectra_block) to a FeatureMap
+
+        Args:
+            peaks: (Dict[str, np.ndarray]) the columns of the filtered peaks
             feature: (TransitionGroupFeature) metadata on feature
             config: (TargetedDIAConfig object) an object of TargetedDIAConfig that contains configuration parameters of how wide filtering windows should be
-          
+
         Return:
             FeatureMap: a FeatureMap object that contains filtered spectra
         """
-        results_df = pd.DataFrame()
-        for k in range(msExperiment.getNrSpectra()):
-            spec = msExperiment.getSpectrum(k)
-            mz, intensity = spec.get_peaks()
-            if (len(mz) == 0 and len(intensity) == 0):
-                LOGGER.warning(
-                    f"MS{spec.getMSLevel()} spectrum native id {spec.getNativeID()} had no m/z or intensity array, skipping this spectrum")
-                continue
-            rt = np.full([mz.shape[0]], spec.getRT(), float)
-            
-            if not self.has_im:
-                if config.im_window is not None:
-                    LOGGER.warning(
-                        f"MS{spec.getMSLevel()} spectrum native id {spec.getNativeID()} had no ion mobility array")
-                im = np.full([mz.shape[0]], np.nan, float)
-            else:
-                im_tmp = spec.getFloatDataArrays()[0]
-                im = im_tmp.get_data()
-                
-            LOGGER.debug(
-                f"Adding MS{spec.getMSLevel()} spectrum for peptide: {feature.sequence}{feature.precursor_charge} with native id: {spec.getNativeID()}")
-            add_df = pd.DataFrame({'native_id': spec.getNativeID(), 'ms_level': spec.getMSLevel(), 'precursor_mz': feature.precursor_mz,
-                                   'mz': mz, 'rt': rt, 'im': im, 'int': intensity})
-            results_df = pd.concat([results_df, add_df])
-
-        if not results_df.empty:
-            ## Add annotation and column
-            results_df['Annotation'] = results_df.apply(self._apply_mz_mapping, args=(feature.product_mz, feature.product_annotations) , axis=1)
-            
-            ## Add product/precursor mz column
-            annotation_mz_mapping = pd.DataFrame({'Annotation': feature.product_annotations, 'product_mz': feature.product_mz})
-            annotation_mz_mapping = pd.concat([annotation_mz_mapping, pd.DataFrame({'Annotation': ['prec'], 'product_mz': [feature.precursor_mz]})])
-            results_df = results_df.merge(annotation_mz_mapping, on='Annotation', how='left')
-        else:
+        if not self.has_im and config.im_window is not None and peaks['mz'].shape[0] > 0:
+            LOGGER.warning(f"Spectra for peptide: {feature.sequence}{feature.precursor_charge} have no ion mobility array")
+
+        # filtered spectra do not carry a native id
+        return self._columnsToFeatureMap('', self.meta_data_index.ms_level[peaks['spectrum']], peaks['mz'], self.meta_data_index.rt[peaks['spectrum']],
+                                         peaks.get('im'), peaks['int'], feature, config)
+
+    def _columnsToFeatureMap(self,
+                             native_id: Union[str, np.ndarray],
+                             ms_level: np.ndarray,
+                             mz: np.ndarray,
+                             rt: np.ndarray,
+                             im: Optional[np.ndarray],
+                             intensity: np.ndarray,
+                             feature: TransitionGroupFeature,
+                             config: TargetedDIAConfig) -> FeatureMap:
+        """
+        Build the FeatureMap of a feature from the columns of its filtered peaks, the DataFrame is created once and annotated in a single vectorized pass
+
+        Args:
+            native_id: (str | np.ndarray) the native id of the spectrum of every peak
+            ms_level: (np.ndarray) the ms level of every peak
+            mz: (np.ndarray) the m/z of every peak
+            rt: (np.ndarray) the retention time of every peak
+            im: (np.ndarray) the ion mobility of every peak, None if the data has no ion mobility
+            intensity: (np.ndarray) the intensity of every peak
+            feature: (TransitionGroupFeature) metadata on feature
+            config: (TargetedDIAConfig object) an object of TargetedDIAConfig that contains configuration parameters of how wide filtering windows should be
+
+        Return:
+            FeatureMap: a FeatureMap object that contains filtered spectra
+        """
+        if mz.shape[0] == 0:
             LOGGER.warning(f"No spectra found for peptide: {feature.sequence}{feature.precursor_charge}. Try adjusting the extraction parameters")
-            results_df = pd.DataFrame(columns=['rt', 'int', 'Annotation'])
+            return FeatureMap(pd.DataFrame(columns=['rt', 'int', 'Annotation']), feature.sequence, feature.precursor_charge, config)
+
+        if im is None:
+            im = np.full(mz.shape[0], np.nan, float)
+        results_df = pd.DataFrame({'native_id': native_id, 'ms_level': ms_level, 'precursor_mz': feature.precursor_mz,
+                                   'mz': mz, 'rt': rt, 'im': im, 'int': intensity})
+        return FeatureMap(self._annotateFeatureDf(results_df, feature), feature.sequence, feature.precursor_charge, config)
 
-        return FeatureMap(results_df, feature.sequence, feature.precursor_charge, config)
+    @staticmethod
+    def _annotateFeatureDf(results_df: pd.DataFrame, feature: TransitionGroupFeature) -> pd.DataFrame:
+        """
+        Add the Annotation and product_mz columns to the filtered peaks of a feature
+
+        Args:
+            results_df: (pd.DataFrame) the filtered peaks, containing at least the ms_level and mz columns
+            feature: (TransitionGroupFeature) metadata on feature
+
+        Return:
+            pd.DataFrame: the annotated peaks
+        """
+        ## Add annotation column, MS1 peaks are annotated as precursor and MS2 peaks with their closest product m/z
+        ms_level = results_df['ms_level'].to_numpy()
+        unknown_ms_level = (ms_level != 1) & (ms_level != 2)
+        if np.any(unknown_ms_level):
+            raise ValueError(f"Unknown ms_level {ms_level[unknown_ms_level][0]} encountered.")
+        annotation = np.full(ms_level.shape[0], 'prec', dtype=object)
+        is_ms2 = ms_level == 2
+        if np.any(is_ms2):
+            annotation[is_ms2] = MzMLDataAccess._find_closest_reference_annotations(results_df['mz'].to_numpy()[is_ms2], np.array(feature.product_mz), np.array(feature.product_annotations))
+        results_df['Annotation'] = annotation
+
+        ## Add product/precursor mz column
+        annotation_mz_mapping = pd.DataFrame({'Annotation': feature.product_annotations, 'product_mz': feature.product_mz})
+        annotation_mz_mapping = pd.concat([annotation_mz_mapping, pd.DataFrame({'Annotation': ['prec'], 'product_mz': [feature.precursor_mz]})])
+        return results_df.merge(annotation_mz_mapping, on='Annotation', how='left')
     
     @staticmethod
-    def _find_closest_reference_mz(given_mz: np.array, reference_mz_values: np.array, peptide_product_annotation_list: np.array) -> np.array:
+    def _find_closest_reference_annotations(given_mz: np.ndarray, reference_mz_values: np.ndarray, peptide_product_annotation_list: np.ndarray) -> np.ndarray:
         """
-        Find the closest reference m/z value in the given list to provided m/z values.
+        Find the annotations of the closest reference m/z values for an array of m/z values.
+        Ties are resolved to the reference listed first, like np.argmin.
         Args:
-            given_mz (np.array): An array of m/z values for which to find the closest reference m/z values.
-            reference_mz_values (np.array): An array of reference m/z values to compare against.
-            peptide_product_annotation_list (np.array): An array of reference m/z value annotations.
+            given_mz (np.ndarray): An array of m/z values for which to find the closest reference m/z values.
+            reference_mz_values (np.ndarray): An array of reference m/z values to compare against.
+            peptide_product_annotation_list (np.ndarray): An array of reference m/z value annotations.
         Returns:
-            np.array: An array of the closest reference m/z values annotations from the provided list.
+            np.ndarray: An array of the closest reference m/z values annotations, one for every given m/z value.
+        """
+        # distinct reference m/z values, each mapped to its first occurrence
+        sorted_mz, first_idx = np.unique(reference_mz_values, return_index=True)
+        pos = np.searchsorted(sorted_mz, given_mz)
+        left = np.clip(pos - 1, 0, sorted_mz.shape[0] - 1)
+        right = np.clip(pos, 0, sorted_mz.shape[0] - 1)
+        left_dist = np.abs(sorted_mz[left] - given_mz)
+        right_dist = np.abs(sorted_mz[right] - given_mz)
+        use_right = (right_dist < left_dist) | ((right_dist == left_dist) & (first_idx[right] < first_idx[left]))
+        return peptide_product_annotation_list[first_idx[np.where(use_right, right, left)]]
+
+
+# Smallest block of spectra handed to a worker process in reduce_spectra, smaller blocks do not amortize the scheduling overhead
+_MIN_SPECTRA_PER_BLOCK = 50
+
+# dtypes of the filtered peak columns (see MzMLDataAccess._filter_spectra_block), same as the dtypes of filtered MSSpectrum objects
+_PEAK_COLUMN_DTYPES = {'spectrum': np.int64, 'mz': np.float64, 'int': np.float32, 'im': np.float32}
+
+class _PeakBuffer:
+    """
+    Growable numpy column buffers collecting the filtered peaks of a feature, the capacity is doubled when full so appending is amortized constant time per peak
+    """
+    def __init__(self, has_im: bool, capacity: int = 1024):
+        columns = ['spectrum', 'mz', 'int', 'im'] if has_im else ['spectrum', 'mz', 'int']
+        self.columns = {col: np.empty(capacity, dtype=_PEAK_COLUMN_DTYPES[col]) for col in columns}
+        self.size = 0
+
+    def append(self, spectrum_indice: int, mz_array: np.ndarray, int_array: np.ndarray, im_array: Optional[np.ndarray], peak_mask: Optional[np.ndarray] = None):
+        """
+        Append the (masked) peaks of a spectrum
+        """
+        if peak_mask is not None:
+            n_peaks = np.count_nonzero(peak_mask)
+            if n_peaks == 0:
+                return
+            if n_peaks < peak_mask.shape[0]:
+                mz_array, int_array = mz_array[peak_mask], int_array[peak_mask]
+                im_array = im_array[peak_mask] if im_array is not None else None
+        n_peaks = mz_array.shape[0]
+        end = self.size + n_peaks
+        capacity = self.columns['mz'].shape[0]
+        if end > capacity:
+            capacity = max(end, 2 * capacity)
+            for col, buffer in self.columns.items():
+                grown = np.empty(capacity, dtype=buffer.dtype)
+                grown[:self.size] = buffer[:self.size]
+                self.columns[col] = grown
+        self.columns['spectrum'][self.size:end] = spectrum_indice
+        self.columns['mz'][self.size:end] = mz_array
+        self.columns['int'][self.size:end] = int_array
+        if 'im' in self.columns:
+            self.columns['im'][self.size:end] = im_array
+        self.size = end
+
+    def to_columns(self) -> Dict[str, np.ndarray]:
+        """
+        Get the collected columns, trimmed to the number of peaks
+        """
+        return {col: buffer[:self.size].copy() for col, buffer in self.columns.items()}
+
+class _ChromatogramAccumulator:
+    """
+    Dense matrices accumulating the summed intensity of every transition (one column per distinct annotation) and of the precursor in every target spectrum (one row per spectrum) of a feature
+    """
+    def __init__(self, spectrum_indices: np.ndarray, feature: TransitionGroupFeature, config: TargetedDIAConfig):
+        self.spectrum_indices = spectrum_indices
+        self.sequence = feature.sequence
+        self.precursor_charge = feature.precursor_charge
+        self.product_mz = np.asarray(feature.product_mz if feature.product_mz is not None else [], dtype=float)
+        self.product_mz_tol_bounds = config.get_product_mz_tol_bounds(self.product_mz)
+        self.annotations, self.annotation_codes = np.unique(np.asarray(feature.product_annotations if feature.product_annotations is not None else [], dtype=object).astype(str), return_inverse=True)
+        self.precursor_int = np.zeros(spectrum_indices.shape[0], dtype=np.float64)
+        self.transition_int = np.zeros((spectrum_indices.shape[0], self.annotations.shape[0]), dtype=np.float64)
+        self.precursor_found = np.zeros(spectrum_indices.shape[0], dtype=bool)
+        self.transition_found = np.zeros(spectrum_indices.shape[0], dtype=bool)
+        self.annotation_found = np.zeros(self.annotations.shape[0], dtype=bool)
+
+    def add(self, row: int, ms_level: int, mz_array: np.ndarray, int_array: np.ndarray, peak_mask: np.ndarray):
         """
-        return peptide_product_annotation_list[np.argmin(np.abs(reference_mz_values - given_mz))]
+        Add the peaks of a spectrum passing the filter, MS2 peaks are assigned to the transition with the closest product m/z
+        """
+        if not np.any(peak_mask):
+            return
+        if ms_level == 1:
+            self.precursor_int[row] = np.sum(int_array[peak_mask], dtype=np.float64)
+            self.precursor_found[row] = True
+        else:
+            codes = MzMLDataAccess._find_closest_reference_annotations(mz_array[peak_mask], self.product_mz, self.annotation_codes)
+            self.transition_int[row] = np.bincount(codes, weights=int_array[peak_mask], minlength=self.annotations.shape[0])
+            self.transition_found[row] = True
+            self.annotation_found[codes] = True
+
+    def has_peaks(self) -> bool:
+        return bool(np.any(self.precursor_found) or np.any(self.transition_found))
 
     @staticmethod
-    def _apply_mz_mapping(row: pd.Series, peptide_product_mz_list: List[float], peptide_product_annotation_list: List[str]) -> Literal["float", "np.nan"]:
+    def concatenate(accumulators: List['_ChromatogramAccumulator']) -> '_ChromatogramAccumulator':
+        """
+        Concatenate the accumulators of a feature over consecutive blocks of spectra, see MzMLDataAccess.extract_chromatograms
+        """
+        accumulator = copy.copy(accumulators[0])
+        for attr in ['spectrum_indices', 'precursor_int', 'transition_int', 'precursor_found', 'transition_found']:
+            setattr(accumulator, attr, np.concatenate([getattr(a, attr) for a in accumulators]))
+        accumulator.annotation_found = np.logical_or.reduce([a.annotation_found for a in accumulators])
+        return accumulator
+
+    def to_transition_group(self, rt: np.ndarray) -> TransitionGroup:
         """
-        Apply mz mapping to the given row based on the ms_level.
+        Collapse the spectra with the same RT and convert the matrices to chromatograms
+
         Args:
-            row (pd.Series): The row containing the data.
-            peptide_product_mz_list (List): The list of peptide product m/z values.
-            peptide_product_annotation_list (List): The list of peptide product annotations.
-        Returns:
-            Union[float, np.nan]: The mapped m/z value.
+            rt: the RT of every spectrum of the run
         """
-        if row['ms_level'] == 2:
-            return MzMLDataAccess._find_closest_reference_mz(row['mz'], np.array(peptide_product_mz_list), np.array(peptide_product_annotation_list))
-        elif row['ms_level'] == 1:
-            return 'prec'
+        if not self.has_peaks():
+            return TransitionGroup([Chromatogram(np.array([]), np.array([]), 'No precursor chromatograms found')],
+                                   [Chromatogram(np.array([]), np.array([]), 'No transition chromatograms found')], self.sequence, self.precursor_charge)
+
+        spectrum_rt = rt[self.spectrum_indices]
+        if np.any(self.precursor_found):
+            # sum up spectra with the same RT
+            precursor_rt, rt_rows = np.unique(spectrum_rt[self.precursor_found], return_inverse=True)
+            precursor_chromatograms = [Chromatogram(precursor_rt, np.bincount(rt_rows, weights=self.precursor_int[self.precursor_found]), 'prec')]
         else:
-            raise ValueError(f"Unknown ms_level {row['ms_level']} encountered.")
+            precursor_chromatograms = [Chromatogram(np.array([]), np.array([]), 'No precursor chromatograms found')]
+
+        transition_rt, rt_rows = np.unique(spectrum_rt[self.transition_found], return_inverse=True)
+        transition_matrix = np.zeros((transition_rt.shape[0], self.annotations.shape[0]), dtype=np.float64)
+        np.add.at(transition_matrix, rt_rows, self.transition_int[self.transition_found])
+        transition_chromatograms = [Chromatogram(transition_rt, transition_matrix[:, col], annotation) for col, annotation in enumerate(self.annotations.tolist()) if self.annotation_found[col]]
+
+        return TransitionGroup(precursor_chromatograms, transition_chromatograms, self.sequence, self.precursor_charge)
+
+# MzMLDataAccess objects opened by a worker process, reused across tasks since loky keeps its worker processes alive
+_WORKER_DATA_ACCESS: Dict[Tuple[str, str, int, int], MzMLDataAccess] = {}
+
+def _get_worker_data_access(filename: str, readOptions: str, verbose: bool=False, cache_dir: Optional[str]=None, meta_data_sidecar: bool=False) -> MzMLDataAccess:
+    """
+    Get the MzMLDataAccess of a file in a worker process. The file is opened once per worker and version of the file, the worker builds the spectrum meta data index itself (or loads it from the sidecar file, the columnar store or the cached mzML file) so the index is never sent to the worker with a task.
+    The file is opened again once its size or modification time changes, so a reused worker does not serve a rewritten file from a stale data access.
 
+    Args:
+        filename: (str) the mzML file
+        readOptions: (str) readOptions to use, either 'ondisk', 'cached', 'columnar' or 'hot'
+        verbose: (bool) Enables verbose mode.
+        cache_dir: (str) the directory of the cached mzML files, see MzMLDataAccess
+        meta_data_sidecar: (bool) whether the spectrum meta data index is cached in a sidecar file next to the mzML file, see MzMLDataAccess
+
+    Return:
+        MzMLDataAccess: the MzMLDataAccess of the file
+    """
+    # keyed like the sqMass chromatogram cache, a rewritten file does not hit the data access of its previous version
+    stat = os.stat(filename)
+    key = (filename, readOptions, stat.st_size, stat.st_mtime_ns)
+    dataAccess = _WORKER_DATA_ACCESS.get(key)
+    if dataAccess is None:
+        # the data access of a previous version of the file is dropped
+        for stale_key in [k for k in _WORKER_DATA_ACCESS if k[:2] == key[:2]]:
+            del _WORKER_DATA_ACCESS[stale_key]
+        dataAccess = MzMLDataAccess(filename, readOptions, verbose=verbose, meta_data_sidecar=meta_data_sidecar, cache_dir=cache_dir)
+        _WORKER_DATA_ACCESS[key] = dataAccess
+    return dataAccess
+
+def _filter_spectra_block(filename: str,
+                          readOptions: str,
+                          spectrum_indices: np.ndarray,
+                          spectrum_features: List[List[int]],
+                          features: List[TransitionGroupFeature],
+                          config: TargetedDIAConfig,
+                          product_mz_tol_bounds: List[Tuple[np.ndarray, np.ndarray]],
+                          cache_dir: Optional[str]=None,
+                          meta_data_sidecar: bool=False) -> List[Dict[str, np.ndarray]]:
+    """
+    Filter a contiguous block of spectra in a worker process, see MzMLDataAccess._filter_spectra_block
+    """
+    return _get_worker_data_access(filename, readOptions, cache_dir=cache_dir, meta_data_sidecar=meta_data_sidecar)._filter_spectra_block(spectrum_indices, spectrum_features, features, config, product_mz_tol_bounds)
+
+def _accumulate_chromatograms_block(filename: str,
+                                    readOptions: str,
+                                    features: List[TransitionGroupFeature],
+                                    config: TargetedDIAConfig,
+                                    spectrum_range: Tuple[int, int],
+                                    cache_dir: Optional[str]=None,
+                                    meta_data_sidecar: bool=False) -> List[_ChromatogramAccumulator]:
+    """
+    Accumulate the chromatograms of a contiguous block of spectra in a worker process, see MzMLDataAccess._accumulate_chromatograms
+    """
+    return _get_worker_data_access(filename, readOptions, cache_dir=cache_dir, meta_data_sidecar=meta_data_sidecar)._accumulate_chromatograms(features, config, spectrum_range)
@@ -0,0 +1,155 @@
+"""
+massdash/loaders/access/NumpressDecoder
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+
+from typing import List, Tuple
+
+import numpy as np
+
+class NumpressDecoder:
+    '''
+    Vectorized decoder of the MS-Numpress linear and slof encodings (as written by OpenSwath to sqMass files, see SqMassDataAccess).
+
+    The raw (not base64 encoded) numpress byte arrays are decoded with numpy only. Several arrays are decoded together in a single pass, so the cost of the numpy calls is shared by all chromatograms of a query.
+
+    The byte layout follows the MS-Numpress reference implementation:
+        - linear: an 8 byte big endian fixed point, the first two values as 4 byte little endian integers followed by the residuals of a linear extrapolation as variable length half byte integers
+        - slof: an 8 byte big endian fixed point followed by 2 byte little endian unsigned integers of log(x + 1) * fixed point
+    '''
+    # The number of half bytes of a half byte integer by its head half byte
+    HALF_BYTE_INT_LENGTH = np.array([9 - (h if h <= 8 else h - 8) for h in range(16)], dtype=np.int64)
+    # From this number of arrays on the half byte integers of all arrays are followed one at a time, fewer arrays are followed by pointer doubling
+    FRONTIER_MIN_REGIONS = 64
+
+    @staticmethod
+    def decode_slof(blobs: List[bytes]) -> List[np.ndarray]:
+        '''
+        Decode numpress slof encoded arrays
+
+        Args:
+            blobs (List[bytes]): The raw numpress encoded arrays
+
+        Returns:
+            List[np.ndarray]: The decoded values of each array
+        '''
+        blob_lengths = np.array([len(b) for b in blobs], dtype=np.int64)
+        header = np.frombuffer(b''.join(b[:8].ljust(8, b'\0') for b in blobs), dtype=np.uint8).reshape(-1, 8)
+        fixed_points = NumpressDecoder._fixed_points(header, blob_lengths)
+        # an odd trailing byte is not part of a value
+        lengths = np.maximum(blob_lengths - 8, 0) // 2
+        values = np.frombuffer(b''.join(b[8:8 + 2 * n] for b, n in zip(blobs, lengths)), dtype='<u2')
+        decoded = np.expm1(values / np.repeat(fixed_points, lengths))
+        return [decoded[end - length:end] for end, length in zip(np.cumsum(lengths), lengths)]
+
+    @staticmethod
+    def decode_linear(blobs: List[bytes]) -> List[np.ndarray]:
+        '''
+        Decode numpress linear encoded arrays
+
+        Args:
+            blobs (List[bytes]): The raw numpress encoded arrays
+
+        Returns:
+            List[np.ndarray]: The decoded values of each array
+        '''
+        blob_lengths = np.array([len(b) for b in blobs], dtype=np.int64)
+        # the fixed point and the first two values as 4 byte integers
+        header = np.frombuffer(b''.join(b[:16].ljust(16, b'\0') for b in blobs), dtype=np.uint8).reshape(-1, 16)
+        fixed_points = NumpressDecoder._fixed_points(header[:, :8], blob_lengths)
+        leading = header[:, 8:16].copy().view('<i4').astype(np.int64)
+        n_leading = np.clip((blob_lengths - 8) // 4, 0, 2)
+
+        # the residuals are a stream of half bytes, the high half of a byte comes first
+        residuals = np.frombuffer(b''.join(b[16:] for b in blobs), dtype=np.uint8)
+        nibbles = np.empty(2 * residuals.shape[0], dtype=np.uint8)
+        nibbles[0::2] = residuals >> 4
+        nibbles[1::2] = residuals & 0xf
+        region_ends = np.cumsum(2 * np.maximum(blob_lengths - 16, 0))
+        region_starts = region_ends - 2 * np.maximum(blob_lengths - 16, 0)
+        diffs, n_residuals = NumpressDecoder._decode_half_byte_ints(nibbles, region_starts, region_ends)
+
+        # y[k] = 2 * y[k - 1] - y[k - 2] + diff[k], i.e. the first differences are the cumulative sum of the residuals
+        steps = np.repeat(leading[:, 1] - leading[:, 0], n_residuals) + NumpressDecoder._segmented_cumsum(diffs, n_residuals)
+        ints = np.repeat(leading[:, 1], n_residuals) + NumpressDecoder._segmented_cumsum(steps, n_residuals)
+
+        lengths = n_leading + n_residuals
+        ends = np.cumsum(lengths)
+        is_leading = np.zeros(ends[-1] if len(blobs) > 0 else 0, dtype=bool)
+        values = np.empty(is_leading.shape[0], dtype=np.int64)
+        for i in range(2):
+            positions = (ends - lengths)[n_leading > i] + i
+            is_leading[positions] = True
+            values[positions] = leading[n_leading > i, i]
+        values[~is_leading] = ints
+        decoded = values / np.repeat(fixed_points, lengths)
+        return [decoded[end - length:end] for end, length in zip(ends, lengths)]
+
+    @staticmethod
+    def _fixed_points(header: np.ndarray, blob_lengths: np.ndarray) -> np.ndarray:
+        # the fixed point is stored as a big endian double
+        return np.where(blob_lengths >= 8, np.ascontiguousarray(header).view('>f8')[:, 0], 1.0).astype(np.float64)
+
+    @staticmethod
+    def _segmented_cumsum(values: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+        # cumulative sum restarting at every segment
+        cumsum = np.cumsum(values)
+        segment_offsets = np.concatenate([[0], cumsum])[np.cumsum(lengths) - lengths]
+        return cumsum - np.repeat(segment_offsets, lengths)
+
+    @staticmethod
+    def _decode_half_byte_ints(nibbles: np.ndarray, region_starts: np.ndarray, region_ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        Decode the variable length half byte integers of several regions of a half byte stream
+
+        Every integer starts with a head half byte h, h <= 8 means h leading zero half bytes and h > 8 means h - 8 leading 0xf half bytes,
+        the remaining half bytes follow, least significant first. A region may end with a single 0 half byte of padding.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The decoded integers and the number of integers of each region
+        '''
+        # the integers of a region are a chain of positions starting at the region start, all chains are followed at once
+        positions = np.arange(nibbles.shape[0])
+        position_ends = np.repeat(region_ends, region_ends - region_starts)
+        next_positions = positions + NumpressDecoder.HALF_BYTE_INT_LENGTH[nibbles]
+        valid = (next_positions <= position_ends) & ~((positions == position_ends - 1) & (nibbles == 0))
+        # a chain ends at the end of its region, at the padding or at corrupt data
+        jump = np.where(valid & (next_positions < position_ends), next_positions, -1)
+        jump[jump >= 0] = np.where(valid[jump[jump >= 0]], jump[jump >= 0], -1)
+
+        region_starts = region_starts[region_starts < region_ends]
+        if region_starts.shape[0] >= NumpressDecoder.FRONTIER_MIN_REGIONS:
+            # follow the chains one integer at a time
+            frontier = region_starts[valid[region_starts]]
+            starts = []
+            while frontier.shape[0] > 0:
+                starts.append(frontier)
+                frontier = jump[frontier]
+                frontier = frontier[frontier >= 0]
+            starts = np.sort(np.concatenate(starts)) if len(starts) > 0 else np.zeros(0, dtype=np.int64)
+        else:
+            # few long chains, follow them by pointer doubling (-1 points to an extra last position ending all chains)
+            reached = np.zeros(nibbles.shape[0] + 1, dtype=bool)
+            reached[region_starts[valid[region_starts]]] = True
+            jump = np.append(jump, -1)
+            while True:
+                targets = jump[reached]
+                if np.all(targets < 0):
+                    break
+                reached[targets] = True
+                jump = np.where(jump >= 0, jump[jump], -1)
+            starts = np.flatnonzero(reached[:-1])
+        counts = np.diff(np.searchsorted(starts, np.concatenate([[0], region_ends])))
+
+        # gather the half bytes of each integer, least significant first
+        heads = nibbles[starts].astype(np.int64)
+        n_remaining = 8 - np.where(heads <= 8, heads, heads - 8)
+        padded = np.append(nibbles, np.zeros(8, dtype=nibbles.dtype)).astype(np.int64)
+        offsets = np.arange(8)
+        digits = padded[starts[:, None] + 1 + offsets[None, :]]
+        digits = np.where(offsets[None, :] < n_remaining[:, None], digits, 0)
+        values = (digits << (4 * offsets[None, :])).sum(axis=1)
+        # leading 0xf half bytes of negative integers
+        ones = np.where(heads > 8, (0xffffffff << (4 * n_remaining)) & 0xffffffff, 0)
+        values = (values | ones).astype(np.uint32).view(np.int32).astype(np.int64)
+        return values, counts
@@ -39,18 +39,18 @@ $Maintainer: Justin Sing$
 $Authors: Hannes Roest, Justin Sing$
 --------------------------------------------------------------------------
 """
-import sqlite3
 import pandas as pd
-from typing import List, Literal, Optional, Dict, Union, Callable
+from typing import List, Literal, Optional, Dict, Tuple, Union, Callable
 from pathlib import Path
-from functools import lru_cache
+from functools import cached_property, lru_cache
 
 # Loaders
 from .GenericResultsAccess import GenericResultsAccess
+from .OSWIndexer import OSWIndexer
 # Structs
 from ...structs.TransitionGroupFeature import TransitionGroupFeature
 # Utils
-from ...util import check_sqlite_column_in_table, check_sqlite_table, LOGGER
+from ...util import check_sqlite_column_in_table, check_sqlite_table, connect_sqlite_readonly, LOGGER
 
 class OSWDataAccess(GenericResultsAccess):
     """
@@ -61,6 +61,14 @@ class OSWDataAccess(GenericResultsAccess):
         c (sqlite3.Cursor): A cursor for executing SQL statements on the database.
         verbose (bool): Whether to print verbose output.
         mode (str): The mode to use when intiating the data access object, to control which attributes get initialized.
+        indexFile (str): The indexed copy of the file (see OSWIndexer) which is read instead of the file, None if the file has no up to date index.
+        peptideHash (pd.DataFrame): The precursor IDs indexed by modified sequence and charge, read on first use.
+        runHashTable (pd.DataFrame): The runs (RUN table) with their run names, read on first use.
+        validScores (Dict[str, List[str]]): The scores of each score table, read on first use.
+        featureScoreHash (pd.DataFrame): The scores of all features, read on first use.
+
+    Opening the file does not read any of these tables, they are read when first used and kept for the lifetime of the object,
+    so accessing the runs or the features of a single precursor does not read the features and scores of the whole file.
     """
 
     def __init__(self, *args, mode: Literal['module', 'gui'] = 'module', **kwargs): 
@@ -71,17 +79,16 @@ class OSWDataAccess(GenericResultsAccess):
             filename (str): The path to the SQLite database file.
         """
         super().__init__(*args, **kwargs)
-        self.conn = sqlite3.connect(self.filename, check_same_thread=False)
+        # the indexed copy of the file is read instead of the file if it is up to date, see OSWIndexer
+        self.indexFile = OSWIndexer.get_index_file(self.filename)
+        self.conn = connect_sqlite_readonly(self.indexFile or self.filename, check_same_thread=False)
         self.c = self.conn.cursor()
         
-        # hashtable, each run is its own data 
-        self._initializePeptideHashtable()
-        self._initializeRunHashtable()
-        self._initializeValidScores()
-        self._initializeFeatureScoreHashtable()
-        
         if mode == 'gui':
             self.df = self.load_data()
+
+    def close(self):
+        self.conn.close()
     
     @property
     @lru_cache(maxsize=None) # cache so only computed once
@@ -104,30 +111,40 @@ class OSWDataAccess(GenericResultsAccess):
     def has_SCORE_PROTEIN(self) -> bool:
         return check_sqlite_table(self.conn, "SCORE_PROTEIN")
 
-    ###### INDICES CREATOR ######
-    def _initialize_indices(self):
-        # Create indices if they do not exist
-        idx_query = ''' CREATE INDEX IF NOT EXISTS idx_transition_precursor_mapping_transition_id on TRANSITION_PRECURSOR_MAPPING(Transition_id);'''
-        idx_query += ''' CREATE INDEX IF NOT EXISTS idx_transition_precursor_mapping_precursor_id on TRANSITION_PRECURSOR_MAPPING(Precursor_id);'''
-        idx_query += ''' CREATE INDEX IF NOT EXISTS idx_feature_precursor_id ON FEATURE (PRECURSOR_ID); '''
-        self.conn.executescript(idx_query)
+    ###### LAZY HASHTABLES ######
+    @cached_property
+    def peptideHash(self) -> pd.DataFrame:
+        return self._initializePeptideHashtable()
+
+    @cached_property
+    def runHashTable(self) -> pd.DataFrame:
+        return self._initializeRunHashtable()
+
+    @cached_property
+    def validScores(self) -> Dict[str, List[str]]:
+        return self._initializeValidScores()
+
+    @cached_property
+    def featureScoreHash(self) -> pd.DataFrame:
+        return self._initializeFeatureScoreHashtable()
 
     ###### HASHTABLE INITIALIZERS ######
-    def _initializeRunHashtable(self):
+    def _initializeRunHashtable(self) -> pd.DataFrame:
         stmt = "select * from run"
-        self.runHashTable = pd.read_sql(stmt, self.conn)
-        self.runHashTable['RUN_NAME'] = self.runHashTable['FILENAME'].apply(lambda x: Path(x).stem)
+        runHashTable = pd.read_sql(stmt, self.conn)
+        runHashTable['RUN_NAME'] = runHashTable['FILENAME'].apply(lambda x: Path(x).stem)
+        return runHashTable
 
-    def _initializePeptideHashtable(self):
+    def _initializePeptideHashtable(self) -> pd.DataFrame:
         stmt = '''
             SELECT MODIFIED_SEQUENCE, CHARGE, PRECURSOR_ID 
             FROM PRECURSOR
             INNER JOIN PRECURSOR_PEPTIDE_MAPPING ON PRECURSOR_PEPTIDE_MAPPING.PRECURSOR_ID = PRECURSOR.ID
             INNER JOIN PEPTIDE ON PEPTIDE.ID = PRECURSOR_PEPTIDE_MAPPING.PEPTIDE_ID'''
         tmp = pd.read_sql(stmt, self.conn)
-        self.peptideHash = tmp.set_index(['MODIFIED_SEQUENCE', 'CHARGE'])
+        return tmp.set_index(['MODIFIED_SEQUENCE', 'CHARGE'])
     
-    def _initializeFeatureScoreHashtable(self):
+    def _initializeFeatureScoreHashtable(self) -> pd.DataFrame:
         if self.has_SCORE_MS2: 
             join_score_ms2 = "INNER JOIN SCORE_MS2 ON SCORE_MS2.FEATURE_ID = FEATURE.ID"
             select_score_ms2 = """SCORE_MS2.RANK AS peakgroup_rank,
@@ -210,10 +227,11 @@ SCORE_MS2.QVALUE AS ms2_mscore,"""
             if check_sqlite_table(self.conn, "SCORE_PROTEIN"):
                 tmp = pd.merge(tmp, extra_scores_dfs['PROTEIN_ID'], on=['RUN_ID', 'PROTEIN_ID'], how='left')
         
-        self.featureScoreHash = tmp.set_index(['FEATURE_ID', 'PRECURSOR_ID', 'PEPTIDE_ID', 'PROTEIN_ID', 'RUN_ID'])
+        return tmp.set_index(['FEATURE_ID', 'PRECURSOR_ID', 'PEPTIDE_ID', 'PROTEIN_ID', 'RUN_ID'])
 
     ###### INTERNAL ACCESSORS ######
-    def _getFeaturesFromPrecursorIdAndRunDf(self, run_id: str, precursor_id: int) -> pd.DataFrame:
+    def _getFeaturesFromPrecursorIdAndRunDf(self, run_id: str, precursor_id: Optional[int] = None) -> pd.DataFrame:
+        # all features of the run if precursor_id is None
         if check_sqlite_table(self.conn, "SCORE_MS2"):
             join_score_ms2 = "INNER JOIN SCORE_MS2 ON SCORE_MS2.FEATURE_ID = FEATURE.ID"
             select_score_ms2 = """SCORE_MS2.SCORE AS ms2_dscore,
@@ -258,7 +276,7 @@ SCORE_MS2.QVALUE AS ms2_mscore,"""
                 INNER JOIN PEPTIDE ON PEPTIDE.ID = PRECURSOR_PEPTIDE_MAPPING.PEPTIDE_ID
                 {join_score_ms2}
                 {join_score_ipf}
-                WHERE RUN_ID = {run_id} AND FEATURE.PRECURSOR_ID = {precursor_id}
+                WHERE RUN_ID = {run_id}{f' AND FEATURE.PRECURSOR_ID = {precursor_id}' if precursor_id is not None else ''}
                 """
 
         out = pd.read_sql(stmt, self.conn)
@@ -296,18 +314,25 @@ SCORE_MS2.QVALUE AS ms2_mscore,"""
     def _getTopFeatureFromPrecursorIdAndRun(self, run_id: str, precursor_id: int) -> List[TransitionGroupFeature]:
         df = self._getFeaturesFromPrecursorIdAndRunDf(run_id, precursor_id)
         if 'peakgroup_rank' in df.columns:
-            df = df[df['peakgroup_rank'] == 1].iloc[0]
+            df = df[df['peakgroup_rank'] == 1]
         else:
             raise ValueError("SCORE_MS2 table not found, cannot get top feature")
-        return TransitionGroupFeature(df['leftBoundary'], 
-                                            df['rightBoundary'], 
-                                            areaIntensity=df['consensusApexIntensity'], 
-                                            qvalue= df['ipf_mscore'] if 'ipf_mscore' in df else df['qvalue'], 
-                                            precursor_charge=df['precursor_charge'], 
-                                            sequence=df['sequence'], 
-                                            consensusApex=df['consensusApex'],
-                                            consensusApexIntensity=df['consensusApexIntensity'],
-                                            consensusApexIM=df['consensusApexIM'],
+        # precursor has no feature in this run
+        if df.empty:
+            return None
+        return self._topFeatureFromRow(df.iloc[0])
+
+    @staticmethod
+    def _topFeatureFromRow(row: Union[pd.Series, Dict]) -> TransitionGroupFeature:
+        return TransitionGroupFeature(row['leftBoundary'], 
+                                            row['rightBoundary'], 
+                                            areaIntensity=row['consensusApexIntensity'], 
+                                            qvalue= row['ipf_mscore'] if 'ipf_mscore' in row else row['qvalue'], 
+                                            precursor_charge=row['precursor_charge'], 
+                                            sequence=row['sequence'], 
+                                            consensusApex=row['consensusApex'],
+                                            consensusApexIntensity=row['consensusApexIntensity'],
+                                            consensusApexIM=row['consensusApexIM'],
                                             software='OpenSWATH') # will be -1 if IM is not present
  
     def _getTopFeatureFromPrecursorIdAndRunDf(self, run_id: str, precursor_id: int) -> List[TransitionGroupFeature]:
@@ -700,6 +725,25 @@ SCORE_MS2.QVALUE AS ms2_mscore,"""
             return None
         else:
             return self._getTopFeatureFromPrecursorIdAndRun(run_id, precursor_id)
+
+    def getTopTransitionGroupFeaturesOfRun(self, run_basename_wo_ext: str) -> Dict[Tuple[str, int], TransitionGroupFeature]:
+        """
+        Retrieves the top (rank 1) features of all precursors of a run with a single query, see getTopTransitionGroupFeature
+
+        Args:
+            run_basename_wo_ext (str): The run name.
+
+        Returns:
+            Dict[Tuple[str, int], TransitionGroupFeature]: The top feature by modified sequence and charge, precursors without a feature in the run are missing
+        """
+        run_id = self._runIDFromRunName(run_basename_wo_ext)
+        if run_id is None:
+            return {}
+        df = self._getFeaturesFromPrecursorIdAndRunDf(run_id)
+        if 'peakgroup_rank' not in df.columns:
+            raise ValueError("SCORE_MS2 table not found, cannot get top feature")
+        df = df[df['peakgroup_rank'] == 1].drop_duplicates(['sequence', 'precursor_charge'])
+        return {(row['sequence'], int(row['precursor_charge'])): self._topFeatureFromRow(row) for row in df.to_dict('records')}
     
     def getTransitionIDAnnotationFromSequence(self, fullpeptidename, charge):
         """
@@ -717,7 +761,57 @@ SCORE_MS2.QVALUE AS ms2_mscore,"""
             return self._getTransitionsFromPrecursorId(precursor_id)
         else:
             return pd.DataFrame(columns=['TRANSITION_ID', 'ANNOTATION'])
-        
+
+    def getTransitionIDAnnotationFromPrecursorIds(self, precursor_ids: Optional[List[int]] = None) -> pd.DataFrame:
+        """
+        Retrieves the detecting transitions of many precursors with a single query, see SqMassDataAccess.getTransitionGroups
+
+        The precursor IDs are inserted into a temporary table which is joined with the transitions, so only the transitions of the requested precursors are read.
+
+        Args:
+            precursor_ids (List[int], optional): The precursor IDs. Defaults to None, all precursors.
+
+        Returns:
+            pandas.DataFrame: The transitions with the columns PRECURSOR_ID, TRANSITION_ID, ANNOTATION, MODIFIED_SEQUENCE and PRECURSOR_CHARGE
+        """
+        # Older OSW files (<v2.4) do not have the ANNOTATION column in the TRANSITION table
+        if check_sqlite_column_in_table(self.conn, "TRANSITION", "ANNOTATION"):
+            annotation = "TRANSITION.ANNOTATION"
+        else:
+            annotation = "TRANSITION.TYPE || TRANSITION.ORDINAL || '^' || TRANSITION.CHARGE AS ANNOTATION"
+        if precursor_ids is None:
+            source = "TRANSITION_PRECURSOR_MAPPING"
+        else:
+            # CROSS JOIN keeps the temporary table as the outer loop, so the transitions of the requested precursors are looked up instead of scanning all transitions
+            source = "temp.QUERY_PRECURSOR CROSS JOIN TRANSITION_PRECURSOR_MAPPING ON TRANSITION_PRECURSOR_MAPPING.PRECURSOR_ID = QUERY_PRECURSOR.ID"
+        stmt = f'''
+            SELECT TRANSITION_PRECURSOR_MAPPING.PRECURSOR_ID,
+                   TRANSITION_PRECURSOR_MAPPING.TRANSITION_ID,
+                   {annotation},
+                   PEPTIDE.MODIFIED_SEQUENCE,
+                   PRECURSOR.CHARGE AS PRECURSOR_CHARGE
+                   FROM {source}
+                   INNER JOIN TRANSITION ON TRANSITION_PRECURSOR_MAPPING.TRANSITION_ID = TRANSITION.ID
+                   LEFT JOIN PRECURSOR ON PRECURSOR.ID = TRANSITION_PRECURSOR_MAPPING.PRECURSOR_ID
+                   LEFT JOIN PRECURSOR_PEPTIDE_MAPPING ON PRECURSOR_PEPTIDE_MAPPING.PRECURSOR_ID = PRECURSOR.ID
+                   LEFT JOIN PEPTIDE ON PEPTIDE.ID = PRECURSOR_PEPTIDE_MAPPING.PEPTIDE_ID
+                   WHERE TRANSITION.DETECTING = 1
+            '''
+        if precursor_ids is None:
+            transitions = pd.read_sql(stmt, self.conn)
+        else:
+            # temporary tables are private to the connection and can be written on a read only connection
+            self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS QUERY_PRECURSOR (ID INTEGER PRIMARY KEY)")
+            try:
+                self.conn.executemany("INSERT OR IGNORE INTO temp.QUERY_PRECURSOR (ID) VALUES (?)", ((int(precursor_id),) for precursor_id in precursor_ids))
+                transitions = pd.read_sql(stmt, self.conn)
+            finally:
+                # the inserted IDs are discarded with the transaction, the empty table is reused by the next query
+                self.conn.rollback()
+        # a precursor mapped to several peptides is reported with its first peptide
+        transitions = transitions.drop_duplicates(['PRECURSOR_ID', 'TRANSITION_ID'])
+        return transitions.sort_values(['PRECURSOR_ID', 'TRANSITION_ID']).reset_index(drop=True)
+
     def getRunNames(self) -> List[str]:
         '''
         Infer the run names from the results file, extensions are removed
@@ -727,7 +821,7 @@ SCORE_MS2.QVALUE AS ms2_mscore,"""
         '''
         return self.runHashTable['RUN_NAME'].tolist()
 
-    def _initializeValidScores(self):
+    def _initializeValidScores(self) -> Dict[str, List[str]]:
         # get valid scores for selection 
         print("Initializing valid scores for selection")
         validScores = {}
@@ -762,7 +856,7 @@ SCORE_MS2.QVALUE AS ms2_mscore,"""
                 if isinstance(v, (int, float)) and c.startswith("VAR"):
                     validScores['FEATURE_MS1'].append(c)
 
-        self.validScores = validScores 
+        return validScores
     
     def getScoreTable(self, 
                       score_table: Literal['SCORE_MS2', 'SCORE_MS1', 'SCORE_TRANSITION', 'SCORE_PEPTIDE', 'SCORE_PROTEIN', 'SCORE_IPF', 'FEATURE_MS2', 'FEATURE_MS1'], 
@@ -0,0 +1,194 @@
+"""
+massdash/loaders/access/OSWIndexer
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+
+import os
+import json
+import sqlite3
+import timeit
+from contextlib import closing
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+# Internal
+from ...util import LOGGER, check_sqlite_column_in_table, check_sqlite_table, code_block_timer, connect_sqlite_readonly, file_fingerprint, is_file_fingerprint_current
+
+class OSWIndexer:
+    '''
+    Builds covering indices for the queries MassDash runs against an OSW file (see OSWDataAccess). The indices are built in an indexed copy of the OSW file,
+    the sidecar file next to it, so the original file is never changed. OSWDataAccess reads the sidecar instead of the OSW file as long as the sidecar was built from the
+    current version of the OSW file (see get_index_file). The sidecar is a full copy, it needs as much disk space as the OSW file plus the indices.
+
+    Attributes:
+        filename (str): The path of the OSW file
+        index_file (str): The path of the sidecar file
+    '''
+    # Suffix of the indexed copy of the OSW file
+    SIDECAR_SUFFIX = '.massdash-index.osw'
+    # Version of the indices, increase when the indices change so that outdated sidecars are rebuilt
+    INDEX_VERSION = 1
+    # The covering indices by name, (table, columns), the queries are answered from the index without reading the table rows
+    INDICES = {'idx_massdash_feature_precursor_run': ('FEATURE', ['PRECURSOR_ID', 'RUN_ID', 'ID', 'EXP_RT', 'LEFT_WIDTH', 'RIGHT_WIDTH']),
+               'idx_massdash_feature_run_precursor': ('FEATURE', ['RUN_ID', 'PRECURSOR_ID', 'ID']),
+               'idx_massdash_feature_ms2_feature': ('FEATURE_MS2', ['FEATURE_ID', 'AREA_INTENSITY', 'APEX_INTENSITY']),
+               'idx_massdash_feature_transition_feature': ('FEATURE_TRANSITION', ['FEATURE_ID', 'TRANSITION_ID']),
+               'idx_massdash_score_ms2_feature': ('SCORE_MS2', ['FEATURE_ID', 'RANK', 'QVALUE', 'SCORE']),
+               'idx_massdash_score_ipf_feature': ('SCORE_IPF', ['FEATURE_ID', 'QVALUE']),
+               'idx_massdash_score_peptide_context': ('SCORE_PEPTIDE', ['CONTEXT', 'RUN_ID', 'PEPTIDE_ID', 'QVALUE']),
+               'idx_massdash_score_protein_context': ('SCORE_PROTEIN', ['CONTEXT', 'RUN_ID', 'PROTEIN_ID', 'QVALUE']),
+               'idx_massdash_precursor_peptide_mapping_precursor': ('PRECURSOR_PEPTIDE_MAPPING', ['PRECURSOR_ID', 'PEPTIDE_ID']),
+               'idx_massdash_precursor_peptide_mapping_peptide': ('PRECURSOR_PEPTIDE_MAPPING', ['PEPTIDE_ID', 'PRECURSOR_ID']),
+               'idx_massdash_transition_precursor_mapping_precursor': ('TRANSITION_PRECURSOR_MAPPING', ['PRECURSOR_ID', 'TRANSITION_ID']),
+               'idx_massdash_peptide_protein_mapping_protein': ('PEPTIDE_PROTEIN_MAPPING', ['PROTEIN_ID', 'PEPTIDE_ID']),
+               'idx_massdash_peptide_protein_mapping_peptide': ('PEPTIDE_PROTEIN_MAPPING', ['PEPTIDE_ID', 'PROTEIN_ID']),
+               'idx_massdash_peptide_sequence': ('PEPTIDE', ['MODIFIED_SEQUENCE', 'ID'])}
+    # The query shapes MassDash issues by name, (required tables, query), the parameters are taken from the file (see _getQueryParameters)
+    QUERIES = {'features of a precursor': (['FEATURE', 'FEATURE_MS2', 'SCORE_MS2'], '''
+                    SELECT FEATURE.ID, FEATURE.EXP_RT, FEATURE.LEFT_WIDTH, FEATURE.RIGHT_WIDTH, FEATURE_MS2.AREA_INTENSITY, FEATURE_MS2.APEX_INTENSITY, SCORE_MS2.RANK, SCORE_MS2.QVALUE
+                    FROM FEATURE
+                    INNER JOIN FEATURE_MS2 ON FEATURE_MS2.FEATURE_ID = FEATURE.ID
+                    INNER JOIN SCORE_MS2 ON SCORE_MS2.FEATURE_ID = FEATURE.ID
+                    WHERE FEATURE.RUN_ID = :run_id AND FEATURE.PRECURSOR_ID = :precursor_id'''),
+               'transitions of a precursor': (['TRANSITION_PRECURSOR_MAPPING', 'TRANSITION'], '''
+                    SELECT TRANSITION_ID, TRANSITION.ANNOTATION
+                    FROM TRANSITION_PRECURSOR_MAPPING
+                    INNER JOIN TRANSITION ON TRANSITION_PRECURSOR_MAPPING.TRANSITION_ID = TRANSITION.ID
+                    WHERE TRANSITION.DETECTING = 1 AND PRECURSOR_ID = :precursor_id'''),
+               'transitions of a feature': (['FEATURE_TRANSITION'], '''
+                    SELECT FEATURE_ID, TRANSITION_ID
+                    FROM FEATURE_TRANSITION
+                    WHERE FEATURE_ID = :feature_id'''),
+               'precursors of a peptide': (['PEPTIDE', 'PRECURSOR_PEPTIDE_MAPPING', 'PRECURSOR'], '''
+                    SELECT PRECURSOR.ID, PRECURSOR.CHARGE
+                    FROM PRECURSOR
+                    INNER JOIN PRECURSOR_PEPTIDE_MAPPING ON PRECURSOR_PEPTIDE_MAPPING.PRECURSOR_ID = PRECURSOR.ID
+                    INNER JOIN PEPTIDE ON PEPTIDE.ID = PRECURSOR_PEPTIDE_MAPPING.PEPTIDE_ID
+                    WHERE PEPTIDE.MODIFIED_SEQUENCE = :sequence'''),
+               'peptides of a protein': (['PEPTIDE', 'PEPTIDE_PROTEIN_MAPPING'], '''
+                    SELECT PEPTIDE.ID, PEPTIDE.MODIFIED_SEQUENCE
+                    FROM PEPTIDE
+                    INNER JOIN PEPTIDE_PROTEIN_MAPPING ON PEPTIDE_PROTEIN_MAPPING.PEPTIDE_ID = PEPTIDE.ID
+                    WHERE PEPTIDE_PROTEIN_MAPPING.PROTEIN_ID = :protein_id'''),
+               'identified precursors of a run': (['FEATURE', 'SCORE_MS2', 'PRECURSOR'], '''
+                    SELECT DISTINCT FEATURE.PRECURSOR_ID
+                    FROM FEATURE
+                    INNER JOIN SCORE_MS2 ON SCORE_MS2.FEATURE_ID = FEATURE.ID
+                    INNER JOIN PRECURSOR ON PRECURSOR.ID = FEATURE.PRECURSOR_ID
+                    WHERE FEATURE.RUN_ID = :run_id AND SCORE_MS2.QVALUE <= 0.01 AND PRECURSOR.DECOY = 0 AND SCORE_MS2.RANK == 1''')}
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.index_file = self.get_sidecar_path(filename)
+
+    def __str__(self):
+        return f"{'-'*8} {self.__class__.__name__} {'-'*8}\nfilename: {self.filename}\nindex_file: {self.index_file}"
+
+    @classmethod
+    def get_sidecar_path(cls, filename: str) -> str:
+        '''
+        Get the path of the indexed copy of an OSW file
+
+        Args:
+            filename (str): The path of the OSW file
+
+        Returns:
+            str: The path of the sidecar file
+        '''
+        return f"{filename}{cls.SIDECAR_SUFFIX}"
+
+    @classmethod
+    def get_index_file(cls, filename: str) -> Optional[str]:
+        '''
+        Get the indexed copy of an OSW file, if it was built from the current version of the OSW file
+
+        Args:
+            filename (str): The path of the OSW file
+
+        Returns:
+            str: The path of the sidecar file, None if there is no sidecar or it is out of date
+        '''
+        index_file = cls.get_sidecar_path(filename)
+        if not os.path.isfile(index_file):
+            return None
+        try:
+            with closing(connect_sqlite_readonly(index_file, mmap_size=0)) as conn:
+                info = dict(conn.execute("SELECT KEY, VALUE FROM MASSDASH_INDEX"))
+            current = int(info['version']) == cls.INDEX_VERSION and is_file_fingerprint_current(filename, json.loads(info['fingerprint']))
+        except Exception as e:
+            LOGGER.warning(f"Could not read OSW index {index_file} ({e})")
+            return None
+        if not current:
+            LOGGER.info(f"OSW index {index_file} is out of date, run massdash index to rebuild it")
+            return None
+        return index_file
+
+    def build(self) -> str:
+        '''
+        Build the indexed copy of the OSW file: the file is copied page by page with the sqlite backup API and the covering indices of the tables in the file are created in the copy
+
+        Returns:
+            str: The path of the sidecar file
+        '''
+        # write to a temporary file first so that concurrent readers never see a partially built sidecar
+        tmp_path = f"{self.index_file}.{os.getpid()}.tmp"
+        try:
+            # the connections are closed before the temporary file is renamed or removed
+            with closing(sqlite3.connect(tmp_path)) as dst:
+                with code_block_timer(f'Copying {self.filename} to {self.index_file}...', LOGGER.info):
+                    with closing(connect_sqlite_readonly(self.filename)) as src:
+                        src.backup(dst)
+                with code_block_timer(f'Creating the indices of {self.index_file}...', LOGGER.info):
+                    for name, (table, columns) in self._getIndices(dst).items():
+                        # no ANALYZE, statistics of some indices only mislead the query planner (e.g. into scanning small tables in nested loops)
+                        dst.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})")
+                    dst.execute("CREATE TABLE IF NOT EXISTS MASSDASH_INDEX (KEY TEXT PRIMARY KEY, VALUE TEXT)")
+                    dst.executemany("INSERT OR REPLACE INTO MASSDASH_INDEX (KEY, VALUE) VALUES (?, ?)",
+                                    [('version', str(self.INDEX_VERSION)), ('fingerprint', json.dumps(file_fingerprint(self.filename)))])
+                    dst.commit()
+            os.replace(tmp_path, self.index_file)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return self.index_file
+
+    def _getIndices(self, conn: sqlite3.Connection) -> Dict[str, Tuple[str, List[str]]]:
+        # only the indices of the tables and columns in the file, e.g. unscored files have no SCORE tables
+        return {name: (table, columns) for name, (table, columns) in self.INDICES.items()
+                if check_sqlite_table(conn, table) and all(check_sqlite_column_in_table(conn, table, c) for c in columns)}
+
+    def _getQueryParameters(self, conn: sqlite3.Connection) -> Dict[str, object]:
+        # a precursor with features, its peptide and a protein of the peptide
+        parameters = dict(zip(['feature_id', 'precursor_id', 'run_id'], conn.execute("SELECT ID, PRECURSOR_ID, RUN_ID FROM FEATURE LIMIT 1").fetchone() or [None] * 3))
+        parameters['sequence'] = (conn.execute('''SELECT PEPTIDE.MODIFIED_SEQUENCE FROM PEPTIDE
+                                                 INNER JOIN PRECURSOR_PEPTIDE_MAPPING ON PRECURSOR_PEPTIDE_MAPPING.PEPTIDE_ID = PEPTIDE.ID
+                                                 WHERE PRECURSOR_PEPTIDE_MAPPING.PRECURSOR_ID = ?''', (parameters['precursor_id'],)).fetchone() or [None])[0]
+        parameters['protein_id'] = (conn.execute('''SELECT PEPTIDE_PROTEIN_MAPPING.PROTEIN_ID FROM PEPTIDE_PROTEIN_MAPPING
+                                                   INNER JOIN PEPTIDE ON PEPTIDE.ID = PEPTIDE_PROTEIN_MAPPING.PEPTIDE_ID
+                                                   WHERE PEPTIDE.MODIFIED_SEQUENCE = ?''', (parameters['sequence'],)).fetchone() or [None])[0]
+        return parameters
+
+    def report(self, repeats: int=5) -> pd.DataFrame:
+        '''
+        Compare the query plans and the run times of the queries MassDash issues (see QUERIES) on the OSW file and on its indexed copy
+
+        Args:
+            repeats (int): Number of runs of every query, the best time is reported
+
+        Returns:
+            pd.DataFrame: The query, its plan and its best time in seconds on the OSW file (plan_before, time_before) and on the indexed copy (plan_after, time_after)
+        '''
+        out = []
+        with closing(connect_sqlite_readonly(self.filename)) as before, closing(connect_sqlite_readonly(self.index_file)) as after:
+            parameters = self._getQueryParameters(before)
+            for query, (tables, stmt) in self.QUERIES.items():
+                if not all(check_sqlite_table(before, table) for table in tables):
+                    continue
+                row = {'query': query}
+                for label, conn in [('before', before), ('after', after)]:
+                    row[f'plan_{label}'] = '\n'.join(detail for _, _, _, detail in conn.execute(f"EXPLAIN QUERY PLAN {stmt}", parameters))
+                    row[f'time_{label}'] = min(timeit.repeat(lambda: conn.execute(stmt, parameters).fetchall(), number=1, repeat=repeats))
+                out.append(row)
+        return pd.DataFrame(out, columns=['query', 'plan_before', 'time_before', 'plan_after', 'time_after'])
@@ -6,7 +6,7 @@ massdash/loaders/access/ResultsTSVDataAccess
 import pandas as pd
 import numpy as np
 import re
-from typing import Literal, List, Optional, Dict, Union
+from typing import Literal, List, Optional, Dict, Tuple, Union
 from pathlib import Path
 
 # Loaders
@@ -142,23 +142,48 @@ class ResultsTSVDataAccess(GenericResultsAccess):
                 feature_data = feature_data.rename(columns=ResultsTSVDataAccess.columnMapping[self.results_type])
                 LOGGER.debug(f"Found {feature_data.shape[0]} rows from {self.filename} for feature data")
 
-                # Multiply RT by 60 to convert from minutes to seconds
                 out = []
                 for _, row in feature_data.iterrows():
-                    out.append(TransitionGroupFeature(consensusApex=row['consensusApex'] * self.rt_multiplier,
-                                                      leftBoundary=row['leftBoundary'] * self.rt_multiplier,
-                                                      rightBoundary=row['rightBoundary'] * self.rt_multiplier,
-                                                      areaIntensity=row['Intensity'],
-                                                      qvalue=row['Qvalue'],
-                                                      consensusApexIM=row['consensusApexIM'] if self.has_im else None,
-                                                      sequence=row['ModifiedPeptideSequence'],
-                                                      precursor_charge=row['PrecursorCharge'],
-                                                      software=self.results_type))
+                    out.append(self._rowToTransitionGroupFeature(row))
                 return out 
             else: # len(row_indices)-1==0:
                 LOGGER.debug(f"Error: No feature results found for {peptide_tmp} {charge} in {self.filename}")
                 return []
 
+    def getTopTransitionGroupFeaturesOfRun(self, runname: str) -> Dict[Tuple[str, int], TransitionGroupFeature]:
+        '''
+        Loads the top TransitionGroupFeature of every precursor of a run, the rows of the run are read from the results file at once
+        Args:
+            runname (str): The run name
+        Returns:
+            Dict[Tuple[str, int], TransitionGroupFeature]: The top feature by modified sequence and charge, precursors without a feature in the run are missing
+        '''
+        runname_exact = self.getExactRunName(runname)
+        if runname_exact is None:
+            LOGGER.debug(f"Error: No matching runs found for {runname}")
+            return {}
+        # add 1 to each row index to account for the header row
+        rows_to_load = set([0] + [idx + 1 for idx in self.peptideHash.index[self.peptideHash['runName'] == runname_exact].tolist()])
+        if len(rows_to_load) == 1:
+            return {}
+        feature_data = pd.read_csv(self.filename, sep='\t', skiprows=lambda x: x not in rows_to_load)
+        feature_data = feature_data.rename(columns=ResultsTSVDataAccess.columnMapping[self.results_type])
+        # the first feature of a precursor is its top feature, see getTopTransitionGroupFeature
+        feature_data = feature_data.drop_duplicates(['ModifiedPeptideSequence', 'PrecursorCharge'])
+        return {(row['ModifiedPeptideSequence'], int(row['PrecursorCharge'])): self._rowToTransitionGroupFeature(row) for _, row in feature_data.iterrows()}
+
+    def _rowToTransitionGroupFeature(self, row: pd.Series) -> TransitionGroupFeature:
+        # Multiply RT by 60 to convert from minutes to seconds
+        return TransitionGroupFeature(consensusApex=row['consensusApex'] * self.rt_multiplier,
+                                      leftBoundary=row['leftBoundary'] * self.rt_multiplier,
+                                      rightBoundary=row['rightBoundary'] * self.rt_multiplier,
+                                      areaIntensity=row['Intensity'],
+                                      qvalue=row['Qvalue'],
+                                      consensusApexIM=row['consensusApexIM'] if self.has_im else None,
+                                      sequence=row['ModifiedPeptideSequence'],
+                                      precursor_charge=row['PrecursorCharge'],
+                                      software=self.results_type)
+
     def getTransitionGroupFeaturesDf(self, runname: str, pep_id: str, charge: int) -> pd.DataFrame:
         '''
         Loads a TransitionGroupFeature object from the results file to a pandas dataframe. Since there is only one feature this is the same as getTopTransitionGroupFeatureDf()
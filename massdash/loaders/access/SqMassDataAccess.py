@@ -40,59 +40,300 @@ $Authors: Hannes Roest, Justin Sing$
 --------------------------------------------------------------------------
 """
 
-from typing import List
+from typing import Dict, List, Optional
 from collections import OrderedDict
-import pyopenms as po
+from contextlib import closing, contextmanager
 import sqlite3
+import threading
 import pandas as pd
-import base64
-import struct
 import zlib
+import numpy as np
 from pathlib import Path
 
 # Structs
 from ...structs.Chromatogram import Chromatogram
+from ...structs.TransitionGroup import TransitionGroup
+from ...structs.TransitionGroupCollection import TransitionGroupCollection
+from .ChromatogramCache import ChromatogramCache, SHARED_CHROMATOGRAM_CACHE
+from .NumpressDecoder import NumpressDecoder
+from .SqMassWriter import SqMassWriter
 # Utils
-from ...util import check_sqlite_column_in_table, check_sqlite_table
+from ...util import check_sqlite_column_in_table, check_sqlite_table, connect_sqlite_readonly
 
 class SqMassDataAccess:
-
-    def __init__(self, filename):
-        self.conn = sqlite3.connect(filename, check_same_thread=False)
-        self.c = self.conn.cursor()
+    '''
+    Access to the chromatograms of a sqMass file
+
+    The native IDs of the chromatograms are read once per file into in-memory maps (see _loadChromatogramIndex), native IDs and precursor IDs are resolved
+    with these maps and the data is fetched by chromatogram ID, so the CHROMATOGRAM table is not scanned on every request.
+
+    The file is opened read only, a file completed by SqMassWriter is opened immutable as it is never written again. A sqlite connection must not be used by several threads at once, so every query checks out a connection of its own
+    from a pool (see _connection) and the file can be read from several threads concurrently.
+
+    Decoded chromatograms are kept in a ChromatogramCache, which is shared by all files of the process by default, so reading a chromatogram again
+    does not query and decode the file again.
+
+    Attributes:
+        filename (str): The path of the sqMass file
+        runName (str): The name of the run, the file name without extension
+        conn (sqlite3.Connection): The first connection to the file, it is part of the pool
+        cache (ChromatogramCache): The cache of decoded chromatograms, None if chromatograms are not cached
+        immutable (bool): Whether the file is opened immutable (see connect_sqlite_readonly)
+    '''
+    # The maximum number of chromatogram IDs bound in a single statement (the default limit of host parameters of older sqlite versions)
+    MAX_QUERY_IDS = 999
+    # The number of DATA rows fetched and decoded at a time by a streamed query (see _streamData)
+    FETCH_SIZE = 2048
+
+    def __init__(self, filename, cache: Optional[ChromatogramCache]=SHARED_CHROMATOGRAM_CACHE, immutable: Optional[bool]=None):
+        '''
+        Args:
+            filename (str): The path of the sqMass file
+            cache (ChromatogramCache): The cache of decoded chromatograms, None to not cache chromatograms
+            immutable (bool): Open the file immutable, only for files which are not written while they are open. None to open the file immutable only if it was completed by SqMassWriter (see SqMassWriter.finalize)
+        '''
         self.filename = filename
         self.runName = str(Path(filename).stem)
+        self.cache = cache
+        self.immutable = immutable
+        # the chromatograms are cached by file and chromatogram ID, a rewritten file does not hit the chromatograms of its previous version
+        stat = Path(filename).stat() if Path(filename).is_file() else None
+        self._cacheKey = (str(Path(filename).resolve()), stat.st_size if stat else None, stat.st_mtime_ns if stat else None)
+        # idle connections, a connection is used by one thread at a time
+        self._connections = []
+        self.conn = self._connect()
+        self.c = self.conn.cursor()
+        self._connections.append(self.conn)
+        # native ID -> chromatogram ID and precursor ID -> [(chromatogram ID, native ID)], built on first use
+        self._nativeIdMap = None
+        self._precursorChromMap = None
+        self._indexLock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Open a new read only connection to the file, see connect_sqlite_readonly
+        """
+        if self.immutable is None:
+            # files written by OpenSwath or still being written are read with locking, an immutable connection could read stale or inconsistent pages
+            with closing(connect_sqlite_readonly(self.filename, mmap_size=0)) as conn:
+                self.immutable = check_sqlite_table(conn, SqMassWriter.FINALIZED_TABLE)
+        # connections are handed from thread to thread by the pool, but never used by two threads at once
+        return connect_sqlite_readonly(self.filename, immutable=self.immutable, check_same_thread=False)
+
+    @contextmanager
+    def _connection(self):
+        """
+        Check out an idle connection of the pool for the calling thread, a new connection is opened if all connections are in use
+        """
+        try:
+            conn = self._connections.pop()
+        except IndexError:
+            conn = self._connect()
+        try:
+            yield conn
+        finally:
+            self._connections.append(conn)
+
+    def close(self):
+        """
+        Close the idle connections of the pool
+        """
+        while len(self._connections) > 0:
+            self._connections.pop().close()
+
+    def _loadChromatogramIndex(self):
+        """
+        Build the maps of native IDs to chromatogram IDs and of precursor IDs to precursor chromatograms (native IDs '<precursor ID>_Precursor...') with a single scan of the CHROMATOGRAM table
+        """
+        with self._indexLock:
+            if self._nativeIdMap is not None:
+                return
+            nativeIdMap = {}
+            precursorChromMap = {}
+            with self._connection() as conn:
+                for chrom_id, native_id in conn.execute("SELECT ID, NATIVE_ID FROM CHROMATOGRAM ORDER BY ID"):
+                    nativeIdMap.setdefault(native_id, chrom_id)
+                    if '_Precursor' in native_id:
+                        precursorChromMap.setdefault(native_id.split('_Precursor')[0], []).append((chrom_id, native_id))
+            self._precursorChromMap = precursorChromMap
+            self._nativeIdMap = nativeIdMap
+
+    def getChromIDsFromNativeIds(self, native_ids: List[str]) -> List[int]:
+        """
+        Get the chromatogram IDs of native IDs, native IDs not in the file are skipped
+
+        Args:
+            native_ids (List[str]): The native IDs, e.g. transition IDs, SQL quoted strings (e.g. "'1'") are accepted as well
+
+        Returns:
+            List[int]: The chromatogram IDs
+        """
+        return [chrom_id for chrom_id in self._resolveNativeIds(native_ids) if chrom_id is not None]
+
+    def _resolveNativeIds(self, native_ids: List[str]) -> List[Optional[int]]:
+        """
+        Get the chromatogram ID of each native ID, None for native IDs not in the file (see getChromIDsFromNativeIds)
+        """
+        if self._nativeIdMap is None:
+            self._loadChromatogramIndex()
+        chrom_ids = []
+        for native_id in native_ids:
+            native_id = str(native_id)
+            if len(native_id) > 1 and native_id[0] == native_id[-1] == "'":
+                native_id = native_id[1:-1]
+            chrom_ids.append(self._nativeIdMap.get(native_id))
+        return chrom_ids
 
     def getPrecursorChromIDs(self, precursor_id):
         """
         Get the chromatogram IDs for a given precursor ID
         """
-        data = [row for row in self.c.execute(f"""SELECT ID, NATIVE_ID FROM CHROMATOGRAM WHERE NATIVE_ID LIKE '{precursor_id}_Precursor%'""")]
+        if self._precursorChromMap is None:
+            self._loadChromatogramIndex()
+        data = self._precursorChromMap.get(str(precursor_id), [])
         return {"chrom_ids":[d[0] for d in data], "native_ids":[d[1] for d in data]}
 
+    def _fetchData(self, ids: List[int]) -> List[tuple]:
+        """
+        Fetch the rows of the DATA table of chromatogram IDs
+        """
+        ids = [int(myid) for myid in ids]
+        data = []
+        with self._connection() as conn:
+            for i in range(0, len(ids), self.MAX_QUERY_IDS):
+                chunk = ids[i:i + self.MAX_QUERY_IDS]
+                stmt = f"SELECT CHROMATOGRAM_ID, COMPRESSION, DATA_TYPE, DATA FROM DATA WHERE CHROMATOGRAM_ID IN ({','.join('?' * len(chunk))})"
+                data.extend(conn.execute(stmt, chunk))
+        return data
+
+    def _getData(self, ids: List[int], stream: bool=False) -> Dict[int, List[np.ndarray]]:
+        """
+        Get the decoded data arrays of chromatogram IDs, the chromatograms not in the cache are fetched from the file and added to the cache
+
+        Args:
+            ids (List[int]): The chromatogram IDs
+            stream (bool): Fetch the missing chromatograms with a single streamed query (see _streamData) instead of queries of at most MAX_QUERY_IDS IDs
+
+        Returns:
+            Dict[int, List[np.ndarray]]: The retention times and intensities by chromatogram ID in the order of the IDs, chromatogram IDs not in the file are missing
+        """
+        ids = [int(myid) for myid in ids]
+        if self.cache is None:
+            cached, missing = {}, ids
+        else:
+            cached = {myid: self.cache.get((self._cacheKey, myid)) for myid in dict.fromkeys(ids)}
+            missing = [myid for myid, chromatogram in cached.items() if chromatogram is None]
+
+        fetched = {}
+        if stream and len(missing) > 0:
+            fetched = self._streamData(missing)
+        elif len(missing) > 0:
+            fetched = self._returnDataForChromatogram(self._fetchData(missing))
+        if self.cache is not None:
+            for myid, (rt, intensity) in fetched.items():
+                self.cache.put((self._cacheKey, myid), rt, intensity)
+
+        res = OrderedDict()
+        for myid in ids:
+            if cached.get(myid) is not None:
+                res[myid] = list(cached[myid])
+            elif myid in fetched:
+                res[myid] = fetched[myid]
+        return res
+
+    def _streamData(self, ids: List[int]) -> Dict[int, List[np.ndarray]]:
+        """
+        Fetch and decode the data arrays of any number of chromatogram IDs with a single query
+
+        The IDs are inserted into a temporary table which is joined with the DATA table, the rows are fetched and decoded FETCH_SIZE rows at a time.
+
+        Args:
+            ids (List[int]): The chromatogram IDs
+
+        Returns:
+            Dict[int, List[np.ndarray]]: The retention times and intensities by chromatogram ID, chromatogram IDs not in the file are missing
+        """
+        res = {}
+        with self._connection() as conn:
+            # temporary tables are private to the connection and can be written on a read only connection
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS QUERY_CHROMATOGRAM (ID INTEGER PRIMARY KEY)")
+            try:
+                conn.executemany("INSERT OR IGNORE INTO temp.QUERY_CHROMATOGRAM (ID) VALUES (?)", ((int(myid),) for myid in ids))
+                # CROSS JOIN keeps the temporary table as the outer loop, so DATA is searched with its index on CHROMATOGRAM_ID instead of being scanned
+                cursor = conn.execute('''SELECT CHROMATOGRAM_ID, COMPRESSION, DATA_TYPE, DATA
+                                         FROM temp.QUERY_CHROMATOGRAM
+                                         CROSS JOIN DATA ON DATA.CHROMATOGRAM_ID = QUERY_CHROMATOGRAM.ID''')
+                while True:
+                    rows = cursor.fetchmany(self.FETCH_SIZE)
+                    if len(rows) == 0:
+                        break
+                    results = self._decodeDataArrays([compr for chr_id, compr, data_type, d in rows], [d for chr_id, compr, data_type, d in rows])
+                    for (chr_id, compr, data_type, d), result in zip(rows, results):
+                        if data_type == 1:
+                            res.setdefault(chr_id, [None, None])[1] = result
+                        elif data_type == 2:
+                            res.setdefault(chr_id, [None, None])[0] = result
+                        else:
+                            raise Exception("Only expected RT or Intensity data for chromatogram")
+            finally:
+                # the inserted IDs are discarded with the transaction, the empty table is reused by the next query on this connection
+                conn.rollback()
+        return res
+
+    def getTransitionGroups(self, transitions: pd.DataFrame) -> TransitionGroupCollection:
+        """
+        Get the transition groups of many precursors, e.g. of all precursors of a protein or of the whole library
+
+        The chromatograms of all precursors are fetched with a single streamed query (see _streamData) instead of one query per precursor, cached chromatograms are not fetched again.
 
-    def _getChromatogramsHelper(self, ids: List[str], labels: List[str]):
+        Args:
+            transitions (pd.DataFrame): The transitions, one row per transition with the columns PRECURSOR_ID, TRANSITION_ID and ANNOTATION. The optional columns MODIFIED_SEQUENCE and PRECURSOR_CHARGE are used as the sequence and charge of the transition groups
+
+        Returns:
+            TransitionGroupCollection: The transition groups keyed by precursor ID, precursors without chromatograms in the file are missing
+        """
+        if self._nativeIdMap is None:
+            self._loadChromatogramIndex()
+        n = len(transitions)
+        sequences = transitions['MODIFIED_SEQUENCE'] if 'MODIFIED_SEQUENCE' in transitions.columns else [None] * n
+        charges = transitions['PRECURSOR_CHARGE'] if 'PRECURSOR_CHARGE' in transitions.columns else [None] * n
+
+        # precursor ID -> ([(chromatogram ID, native ID)], [(chromatogram ID, annotation)], sequence, charge)
+        groups = {}
+        for precursor_id, transition_id, annotation, sequence, charge in zip(transitions['PRECURSOR_ID'], transitions['TRANSITION_ID'], transitions['ANNOTATION'], sequences, charges):
+            if precursor_id not in groups:
+                groups[precursor_id] = (self._precursorChromMap.get(str(precursor_id), []), [], sequence, charge)
+            chrom_id = self._nativeIdMap.get(str(transition_id))
+            if chrom_id is not None:
+                groups[precursor_id][1].append((chrom_id, annotation))
+
+        data = self._getData(sorted({chrom_id for precursor_chroms, transition_chroms, _, _ in groups.values() for chrom_id, _ in precursor_chroms + transition_chroms}), stream=True)
+
+        out = TransitionGroupCollection()
+        for precursor_id, (precursor_chroms, transition_chroms, sequence, charge) in groups.items():
+            precursor_chroms = [Chromatogram(data[chrom_id][0], data[chrom_id][1], label) for chrom_id, label in precursor_chroms if chrom_id in data]
+            transition_chroms = [Chromatogram(data[chrom_id][0], data[chrom_id][1], label) for chrom_id, label in transition_chroms if chrom_id in data]
+            if len(precursor_chroms) > 0 or len(transition_chroms) > 0:
+                out[precursor_id] = TransitionGroup(precursor_chroms, transition_chroms, sequence, charge)
+        return out
+
+    def _getChromatogramsHelper(self, ids: List[str], labels: List[str]) -> List[tuple]:
         """
         Helper function to get chromatogram data, assumes that ids are not empty
+
+        Returns:
+            List[tuple]: The label and the retention times and intensities of each chromatogram in the order of the IDs, chromatograms not in the file are skipped and a repeated ID is returned once with its first label
         """
-        stmt ="SELECT CHROMATOGRAM_ID, COMPRESSION, DATA_TYPE, DATA FROM DATA WHERE CHROMATOGRAM_ID IN ("
-        for myid in ids:
-            stmt += str(myid) + ","
-        stmt = stmt[:-1]
-        stmt += ")"
-
-        data = [row for row in self.c.execute(stmt)]
-        return self._returnDataForChromatogram(data)
-    
-    def _getChromatogramsHelperFromNativeIds(self, native_ids: List[str]):
-        stmt ="SELECT CHROMATOGRAM_ID, COMPRESSION, DATA_TYPE, DATA FROM DATA INNER JOIN CHROMATOGRAM ON CHROMATOGRAM.ID = CHROMATOGRAM_ID WHERE NATIVE_ID IN ("
-        for myid in native_ids:
-            stmt += str(myid) + ","
-        stmt = stmt[:-1]
-        stmt += ")"
-
-        data = [row for row in self.c.execute(stmt)]
-        return self._returnDataForChromatogram(data)
+        ids = [None if myid is None else int(myid) for myid in ids]
+        data = self._getData([myid for myid in ids if myid is not None])
+        res = OrderedDict()
+        for myid, label in zip(ids, labels):
+            if myid in data and myid not in res:
+                res[myid] = (label, data[myid])
+        return list(res.values())
+
+    def _getChromatogramsHelperFromNativeIds(self, native_ids: List[str], labels: List[str]) -> List[tuple]:
+        return self._getChromatogramsHelper(self._resolveNativeIds(native_ids), labels)
 
     def getDataForChromatogramsDf(self, ids: List[str], labels: List[str]) -> pd.DataFrame:
         '''
@@ -104,7 +345,7 @@ class SqMassDataAccess:
         res = self._getChromatogramsHelper(ids, labels)
 
         c = []
-        for l, val in zip(labels, res.values()):
+        for l, val in res:
             c.append(Chromatogram(val[0], val[1], l).toPandasDf())
 
         if len(c) == 0:
@@ -130,7 +371,7 @@ class SqMassDataAccess:
         ### Convert to chromatograms
         ### match ids with labels
         c = []
-        for l, val in zip(labels, res.values()):
+        for l, val in res:
             c.append(Chromatogram(val[0], val[1], l))
 
         return c
@@ -144,8 +385,7 @@ class SqMassDataAccess:
         - data contains the raw (blob) data for a single data array
         """
 
-        data = [row for row in self.c.execute("SELECT CHROMATOGRAM_ID, COMPRESSION, DATA_TYPE, DATA FROM DATA WHERE CHROMATOGRAM_ID = %s" % myid )]
-        res = list(self._returnDataForChromatogram(data).values())[0]
+        res = list(self._getData([myid]).values())[0]
         return Chromatogram(res[0], res[1], label)
 
     def getDataForChromatogramFromNativeId(self, native_id):
@@ -157,8 +397,7 @@ class SqMassDataAccess:
         - data contains the raw (blob) data for a single data array
         """
 
-        data = [row for row in self.c.execute("SELECT CHROMATOGRAM_ID, COMPRESSION, DATA_TYPE, DATA FROM DATA INNER JOIN CHROMATOGRAM ON CHROMATOGRAM.ID = CHROMATOGRAM_ID WHERE NATIVE_ID = %s" % native_id )]
-        return list(self._returnDataForChromatogram(data).values())[0]
+        return list(self._getData(self.getChromIDsFromNativeIds([native_id])).values())[0]
 
     def getDataForChromatogramsFromNativeIdsDf(self, native_ids: List[str], labels: List[str]) -> pd.DataFrame:
         '''
@@ -167,10 +406,10 @@ class SqMassDataAccess:
         if len(native_ids) == 0:
             return pd.DataFrame(columns=['rt', 'intensity', 'annotation'])
 
-        res = self._getChromatogramsHelperFromNativeIds(native_ids)
+        res = self._getChromatogramsHelperFromNativeIds(native_ids, labels)
 
         c = []
-        for l, val in zip(labels, res.values()):
+        for l, val in res:
             c.append(Chromatogram(val[0], val[1], l).toPandasDf())
 
         if len(c) == 0:
@@ -190,12 +429,12 @@ class SqMassDataAccess:
         if len(native_ids) == 0:
             return [ [ [0], [0] ] ]
         
-        res = self._getChromatogramsHelperFromNativeIds(native_ids)
+        res = self._getChromatogramsHelperFromNativeIds(native_ids, labels)
 
         ### Convert to chromatograms
         ### match ids with labels
         c = []
-        for l, val in zip(labels, res.values()):
+        for l, val in res:
             c.append(Chromatogram(val[0], val[1], l))
 
         return c
@@ -204,37 +443,12 @@ class SqMassDataAccess:
         # prepare result
         chr_ids = set([chr_id for chr_id, compr, data_type, d in data] )
         res = OrderedDict()
-        numpress_config = po.NumpressConfig()
         for i in chr_ids:
             res[i] = [None, None]
 
-
-        for chr_id, compr, data_type, d in data:
-            result = []
-
-            if compr == 1:
-                tmp = zlib.decompress(d)
-                result = struct.unpack("<%sd" % (len(tmp) // 8), tmp)
-
-            if compr == 5:
-                # tmp = [ord(q) for q in zlib.decompress(d)]
-                tmp = bytearray( zlib.decompress(d) )
-                if len(tmp) > 0:
-                    numpress_config.setCompression('linear')
-                    po.MSNumpressCoder().decodeNP(base64.b64encode(tmp), result, False, numpress_config)
-                else:
-                    result = [0]
-            if compr == 6:
-                # tmp = [ord(q) for q in zlib.decompress(d)]
-                tmp = bytearray( zlib.decompress(d) )
-                if len(tmp) > 0:
-                    numpress_config.setCompression('slof')
-                    po.MSNumpressCoder().decodeNP(base64.b64encode(tmp), result, False, numpress_config)
-                else:
-                    result = [0]
-
-            if len(result) == 0:
-                result = [ 0 ]
+        # all arrays of the query are decoded together
+        results = self._decodeDataArrays([compr for chr_id, compr, data_type, d in data], [d for chr_id, compr, data_type, d in data])
+        for (chr_id, compr, data_type, d), result in zip(data, results):
             if data_type == 1:
                 res[chr_id][1] = result
             elif data_type == 2:
@@ -243,7 +457,62 @@ class SqMassDataAccess:
                 raise Exception("Only expected RT or Intensity data for chromatogram")
 
         return res
-    
+
+    @staticmethod
+    def _decodeData(compr: int, d: bytes) -> np.ndarray:
+        """
+        Decode a single data array of the DATA table into a numpy array (see _decodeDataArrays)
+
+        Args:
+            compr (int): The compression of the data array (see getDataForChromatograms)
+            d (bytes): The raw (blob) data
+
+        Returns:
+            np.ndarray: The decoded values, [0] if the array is empty or the compression is not supported
+        """
+        return SqMassDataAccess._decodeDataArrays([compr], [d])[0]
+
+    @staticmethod
+    def _decodeDataArrays(compressions: List[int], blobs: List[bytes]) -> List[np.ndarray]:
+        """
+        Decode data arrays of the DATA table into numpy arrays
+
+        The uncompressed and zlib compressed arrays are little endian doubles, they are read directly from the decompressed buffer with np.frombuffer.
+        The numpress linear and slof arrays are decoded together by the NumpressDecoder. Identical arrays are decoded once and share the returned array, so the returned arrays are read only.
+
+        Args:
+            compressions (List[int]): The compression of each data array (see getDataForChromatograms)
+            blobs (List[bytes]): The raw (blob) data of each data array
+
+        Returns:
+            List[np.ndarray]: The decoded values, [0] if an array is empty or its compression is not supported
+        """
+        # identical arrays (e.g. the retention times of the transitions of a precursor) are decoded once
+        unique = {}
+        indices = [unique.setdefault((compr, bytes(d)), len(unique)) for compr, d in zip(compressions, blobs)]
+
+        results = [None] * len(unique)
+        numpress = {NumpressDecoder.decode_linear: ([], []), NumpressDecoder.decode_slof: ([], [])}
+        for i, (compr, d) in enumerate(unique):
+            if compr == 0:
+                results[i] = np.frombuffer(d, dtype='<f8')
+            elif compr == 1:
+                results[i] = np.frombuffer(zlib.decompress(d), dtype='<f8')
+            elif compr in (2, 3, 5, 6):
+                tmp = zlib.decompress(d) if compr in (5, 6) else d
+                numpress_indices, raw = numpress[NumpressDecoder.decode_linear if compr in (2, 5) else NumpressDecoder.decode_slof]
+                numpress_indices.append(i)
+                raw.append(tmp)
+
+        for decode, (numpress_indices, raw) in numpress.items():
+            if len(raw) > 0:
+                for i, result in zip(numpress_indices, decode(raw)):
+                    result.flags.writeable = False
+                    results[i] = result
+
+        results = [np.zeros(1) if result is None or len(result) == 0 else result for result in results]
+        return [results[i] for i in indices]
+
     def __str__(self):
         return f"SqMassDataAccess(filename={self.filename})"
  
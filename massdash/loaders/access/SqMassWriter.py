@@ -0,0 +1,178 @@
+"""
+massdash/loaders/access/SqMassWriter
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+
+import os
+import sqlite3
+import zlib
+from typing import Optional, Set
+
+import numpy as np
+
+# Structs
+from ...structs.Chromatogram import Chromatogram
+
+class SqMassWriter:
+    '''
+    Incremental writer of chromatograms to a sqMass file, the sqlite based chromatogram format of OpenMS read by SqMassDataAccess.
+    The tables are created with the schema written by OpenMS (SqMassFile), the RT and intensity arrays are stored zlib compressed (compression 1).
+
+    Chromatograms are written in transactions (see commit), so the file can be resumed after an interruption: the IDs of the precursors committed so far are recorded in the MASSDASH_EXTRACTION table (see get_extracted_precursors).
+    While being written the file has a '.partial' suffix, finalize removes the progress table, creates the indices of the sqMass schema, marks the file as complete (FINALIZED_TABLE) and renames the file to its final name.
+
+    Attributes:
+        filename (str): The path of the final sqMass file
+        partial_filename (str): The path of the file while it is being written
+        conn (sqlite3.Connection): The connection to the partial file
+    '''
+    # Schema of the sqMass format as written by OpenMS
+    SCHEMA = ['CREATE TABLE IF NOT EXISTS RUN(ID INT PRIMARY KEY NOT NULL,FILENAME TEXT NOT NULL, NATIVE_ID TEXT NOT NULL)',
+              'CREATE TABLE IF NOT EXISTS RUN_EXTRA(RUN_ID INT,DATA BLOB NOT NULL)',
+              'CREATE TABLE IF NOT EXISTS SPECTRUM(ID INT PRIMARY KEY NOT NULL,RUN_ID INT,MSLEVEL INT NULL,RETENTION_TIME REAL NULL,SCAN_POLARITY INT NULL,NATIVE_ID TEXT NOT NULL)',
+              'CREATE TABLE IF NOT EXISTS CHROMATOGRAM(ID INT PRIMARY KEY NOT NULL,RUN_ID INT,NATIVE_ID TEXT NOT NULL)',
+              'CREATE TABLE IF NOT EXISTS DATA(SPECTRUM_ID INT,CHROMATOGRAM_ID INT,COMPRESSION INT,DATA_TYPE INT,DATA BLOB NOT NULL)',
+              'CREATE TABLE IF NOT EXISTS PRODUCT(SPECTRUM_ID INT,CHROMATOGRAM_ID INT,CHARGE INT NULL,ISOLATION_TARGET REAL NULL,ISOLATION_LOWER REAL NULL,ISOLATION_UPPER REAL NULL)',
+              'CREATE TABLE IF NOT EXISTS PRECURSOR(SPECTRUM_ID INT,CHROMATOGRAM_ID INT,CHARGE INT NULL,PEPTIDE_SEQUENCE TEXT NULL,DRIFT_TIME REAL NULL,ACTIVATION_METHOD INT NULL,ACTIVATION_ENERGY REAL NULL,ISOLATION_TARGET REAL NULL,ISOLATION_LOWER REAL NULL,ISOLATION_UPPER REAL NULL)']
+    INDICES = ['CREATE INDEX IF NOT EXISTS data_chr_idx ON DATA(CHROMATOGRAM_ID)',
+               'CREATE INDEX IF NOT EXISTS data_sp_idx ON DATA(SPECTRUM_ID)',
+               'CREATE INDEX IF NOT EXISTS spec_rt_idx ON SPECTRUM(RETENTION_TIME)',
+               'CREATE INDEX IF NOT EXISTS spec_mslevel_idx ON SPECTRUM(MSLEVEL)',
+               'CREATE INDEX IF NOT EXISTS spec_run_idx ON SPECTRUM(RUN_ID)',
+               'CREATE INDEX IF NOT EXISTS run_extra_idx ON RUN_EXTRA(RUN_ID)',
+               'CREATE INDEX IF NOT EXISTS chrom_run_idx ON CHROMATOGRAM(RUN_ID)']
+
+    # Created by finalize, marks a complete file which is not written again (see SqMassDataAccess, which opens such files immutable)
+    FINALIZED_TABLE = 'MASSDASH_FINALIZED'
+
+    # DATA.COMPRESSION and DATA.DATA_TYPE codes, see SqMassDataAccess.getDataForChromatograms
+    COMPRESSION_ZLIB = 1
+    DATA_TYPE_INTENSITY = 1
+    DATA_TYPE_RT = 2
+
+    def __init__(self, filename: str, run_native_id: str = '', fingerprint: Optional[str] = None):
+        '''
+        Open the partial file of a sqMass file, an existing partial file is resumed if it was written with the same fingerprint and started over otherwise
+
+        Args:
+            filename (str): The path of the final sqMass file
+            run_native_id (str): The native ID of the run, e.g. the name of the mzML file
+            fingerprint (str): Identifies the input of the extraction (e.g. the mzML file and the extraction parameters), a partial file written from a different input is not resumed
+        '''
+        self.filename = filename
+        self.partial_filename = f"{filename}.partial"
+        self.conn = self._open(fingerprint)
+        if self.conn.execute("SELECT COUNT(*) FROM RUN").fetchone()[0] == 0:
+            self.conn.execute("INSERT INTO RUN (ID, FILENAME, NATIVE_ID) VALUES (0, ?, ?)", (run_native_id, run_native_id))
+            self.conn.commit()
+        self._next_chrom_id = self.conn.execute("SELECT COALESCE(MAX(ID) + 1, 0) FROM CHROMATOGRAM").fetchone()[0]
+
+    def _open(self, fingerprint: Optional[str]) -> sqlite3.Connection:
+        if os.path.isfile(self.partial_filename):
+            conn = sqlite3.connect(self.partial_filename)
+            try:
+                stored = conn.execute("SELECT VALUE FROM MASSDASH_EXTRACTION_INFO WHERE KEY = 'fingerprint'").fetchone()
+            except sqlite3.DatabaseError:
+                stored = None
+            if stored is not None and stored[0] == (fingerprint or ''):
+                return conn
+            conn.close()
+            os.remove(self.partial_filename)
+
+        conn = sqlite3.connect(self.partial_filename)
+        for stmt in self.SCHEMA:
+            conn.execute(stmt)
+        conn.execute("CREATE TABLE MASSDASH_EXTRACTION(PRECURSOR_ID TEXT PRIMARY KEY NOT NULL)")
+        conn.execute("CREATE TABLE MASSDASH_EXTRACTION_INFO(KEY TEXT PRIMARY KEY NOT NULL, VALUE TEXT NOT NULL)")
+        conn.execute("INSERT INTO MASSDASH_EXTRACTION_INFO (KEY, VALUE) VALUES ('fingerprint', ?)", (fingerprint or '',))
+        conn.commit()
+        return conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_extracted_precursors(self) -> Set[str]:
+        '''
+        Get the precursors committed to the file so far
+
+        Returns:
+            Set[str]: The precursor IDs
+        '''
+        return {row[0] for row in self.conn.execute("SELECT PRECURSOR_ID FROM MASSDASH_EXTRACTION")}
+
+    def add_chromatogram(self,
+                         native_id: str,
+                         chromatogram: Chromatogram,
+                         precursor_mz: Optional[float] = None,
+                         product_mz: Optional[float] = None,
+                         sequence: Optional[str] = None,
+                         charge: Optional[int] = None):
+        '''
+        Add a chromatogram, it is written to the file with the next commit
+
+        Args:
+            native_id (str): The native ID of the chromatogram, e.g. the transition ID or '<precursor ID>_Precursor_i0' for precursor chromatograms (see SqMassDataAccess.getPrecursorChromIDs)
+            chromatogram (Chromatogram): The chromatogram
+            precursor_mz (float): The m/z of the precursor
+            product_mz (float): The m/z of the product, None for precursor chromatograms
+            sequence (str): The peptide sequence of the precursor
+            charge (int): The charge of the precursor
+        '''
+        chrom_id = self._next_chrom_id
+        self._next_chrom_id += 1
+        self.conn.execute("INSERT INTO CHROMATOGRAM (ID, RUN_ID, NATIVE_ID) VALUES (?, 0, ?)", (chrom_id, str(native_id)))
+        self.conn.executemany("INSERT INTO DATA (CHROMATOGRAM_ID, COMPRESSION, DATA_TYPE, DATA) VALUES (?, ?, ?, ?)",
+                              [(chrom_id, self.COMPRESSION_ZLIB, self.DATA_TYPE_RT, self._encode(chromatogram.data)),
+                               (chrom_id, self.COMPRESSION_ZLIB, self.DATA_TYPE_INTENSITY, self._encode(chromatogram.intensity))])
+        self.conn.execute("INSERT INTO PRECURSOR (CHROMATOGRAM_ID, CHARGE, PEPTIDE_SEQUENCE, DRIFT_TIME, ACTIVATION_METHOD, ACTIVATION_ENERGY, ISOLATION_TARGET, ISOLATION_LOWER, ISOLATION_UPPER) VALUES (?, ?, ?, -1, -1, 0, ?, 0, 0)",
+                          (chrom_id, None if charge is None else int(charge), sequence, None if precursor_mz is None else float(precursor_mz)))
+        # OpenMS expects a product row for every chromatogram
+        self.conn.execute("INSERT INTO PRODUCT (CHROMATOGRAM_ID, CHARGE, ISOLATION_TARGET, ISOLATION_LOWER, ISOLATION_UPPER) VALUES (?, 0, ?, 0, 0)",
+                          (chrom_id, 0.0 if product_mz is None else float(product_mz)))
+
+    def mark_extracted(self, precursor_id: str):
+        '''
+        Record a precursor as extracted, it is written to the file with the next commit so a resumed extraction skips it
+        '''
+        self.conn.execute("INSERT OR IGNORE INTO MASSDASH_EXTRACTION (PRECURSOR_ID) VALUES (?)", (str(precursor_id),))
+
+    def commit(self):
+        '''
+        Write the chromatograms and precursors added since the last commit to the file
+        '''
+        self.conn.commit()
+
+    def finalize(self) -> str:
+        '''
+        Complete the file, the progress tables are removed, the indices are created, the file is marked as complete and renamed to its final name
+
+        Returns:
+            str: The path of the sqMass file
+        '''
+        self.conn.execute("DROP TABLE IF EXISTS MASSDASH_EXTRACTION")
+        self.conn.execute("DROP TABLE IF EXISTS MASSDASH_EXTRACTION_INFO")
+        for stmt in self.INDICES:
+            self.conn.execute(stmt)
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS {self.FINALIZED_TABLE}(KEY TEXT PRIMARY KEY NOT NULL, VALUE TEXT NOT NULL)")
+        self.conn.execute(f"INSERT OR REPLACE INTO {self.FINALIZED_TABLE} (KEY, VALUE) VALUES ('writer', 'massdash')")
+        self.conn.commit()
+        self.conn.close()
+        os.replace(self.partial_filename, self.filename)
+        return self.filename
+
+    def close(self):
+        '''
+        Close the file without completing it, uncommitted chromatograms are discarded
+        '''
+        try:
+            self.conn.close()
+        except sqlite3.ProgrammingError:
+            pass
+
+    @staticmethod
+    def _encode(values: np.ndarray) -> bytes:
+        # little endian doubles, zlib compressed
+        return zlib.compress(np.ascontiguousarray(values, dtype='<f8').tobytes())
@@ -5,11 +5,10 @@ massdash/loaders/access/TransitionPQPDataAccess
 
 from typing import List
 import os
-import sqlite3
 import pandas as pd
 
 # Utils
-from ...util import check_sqlite_column_in_table, check_sqlite_table
+from ...util import check_sqlite_column_in_table, check_sqlite_table, connect_sqlite_readonly
 
 class TransitionPQPDataAccess:
     '''
@@ -40,7 +39,7 @@ class TransitionPQPDataAccess:
         _, file_extension = os.path.splitext(filename)
         if file_extension.lower() not in ['.pqp', '.osw']:
             raise ValueError("Unsupported file format. TransitionPQPLoader requires an sqlite-based .pqp file or .osw file.")
-        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.conn = connect_sqlite_readonly(filename, check_same_thread=False)
         self.c = self.conn.cursor()
     
     def close(self):
@@ -56,10 +55,14 @@ class TransitionPQPDataAccess:
         else:
             raise ValueError(f"The PQP file does not have the required columns.\n {TransitionPQPDataAccess.REQUIRED_PQP_COLUMNS}.\nSupplied PQP is missing columns: {set(TransitionPQPDataAccess.REQUIRED_PQP_COLUMNS) - set(_self.data.columns)}")
         
-    def getTransitionList(self):
+    def getTransitionList(self, include_ids: bool=False):
         """
         Retrieves transition information 
+
+        Args:
+            include_ids: (bool) Also retrieve the PrecursorId and TransitionId columns, the IDs of the precursors and transitions in the PQP file (e.g. the native IDs of the chromatograms extracted by OpenSWATH)
         """
+        ids_query = "PRECURSOR.ID AS PrecursorId, TRANSITION.ID AS TransitionId," if include_ids else ""
         # Older PQP files (<v2.4) do not have the ANNOTATION column in the TRANSITION table
         if check_sqlite_column_in_table(self.conn, "PRECURSOR", "LIBRARY_DRIFT_TIME"):
             prec_lib_drift_time_query = "PRECURSOR.LIBRARY_DRIFT_TIME AS PrecursorIonMobility,"
@@ -87,6 +90,7 @@ class TransitionPQPDataAccess:
         
         if generate_annotation: 
             stmt = f"""SELECT 
+            {ids_query}
             {gene_select_stmt}
             PROTEIN.PROTEIN_ACCESSION AS ProteinId,
             PEPTIDE.UNMODIFIED_SEQUENCE AS PeptideSequence,
@@ -111,6 +115,7 @@ class TransitionPQPDataAccess:
             INNER JOIN (SELECT * FROM TRANSITION WHERE DETECTING = 1) AS TRANSITION ON TRANSITION.ID = TRANSITION_PRECURSOR_MAPPING.TRANSITION_ID"""  
         else: 
             stmt = f"""SELECT 
+                    {ids_query}
                     {gene_select_stmt}
                     PROTEIN.PROTEIN_ACCESSION AS ProteinId,
                     PEPTIDE.UNMODIFIED_SEQUENCE AS PeptideSequence,
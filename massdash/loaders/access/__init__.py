@@ -6,17 +6,29 @@ The :mod:`massdash.loaders.access` subpackage contains the low level access to D
 """
 
 from .GenericResultsAccess import GenericResultsAccess
+from .ChromatogramCache import ChromatogramCache
+from .ColumnarSpectrumStore import ColumnarSpectrumStore
+from .FeatureMapCache import FeatureMapCache
 from .MzMLDataAccess import MzMLDataAccess
+from .NumpressDecoder import NumpressDecoder
 from .OSWDataAccess import OSWDataAccess
+from .OSWIndexer import OSWIndexer
 from .ResultsTSVDataAccess import ResultsTSVDataAccess
 from .SqMassDataAccess import SqMassDataAccess
+from .SqMassWriter import SqMassWriter
 from .TransitionPQPDataAccess import TransitionPQPDataAccess
 from .TransitionTSVDataAccess import TransitionTSVDataAccess
 
 __all__ = [ "GenericResultsAccess",
+            "ChromatogramCache",
+            "ColumnarSpectrumStore",
+            "FeatureMapCache",
             "MzMLDataAccess",
+            "NumpressDecoder",
             "OSWDataAccess",
+            "OSWIndexer",
             "ResultsTSVDataAccess",
             "SqMassDataAccess",
+            "SqMassWriter",
             "TransitionPQPDataAccess",
             "TransitionTSVDataAccess"]
\ No newline at end of file
@@ -78,4 +78,78 @@ def gui(verbose, perf, perf_output, server_port, cloud):
     if verbose:
         click.echo(f"Running: streamlit run {filename} {streamlit_args} -- {add_args}")
     sys.argv = ["streamlit", "run", filename, *streamlit_args, "--", *add_args]
-    sys.exit(stcli.main())
\ No newline at end of file
+    sys.exit(stcli.main())
+
+# Conversion of mzML files to the columnar spectrum store
+@cli.command()
+@click.option('--mzml', '-m', multiple=True, required=True, type=click.Path(exists=True, dir_okay=False), help="mzML file(s) to convert, can be given multiple times.")
+@click.option('--verbose', '-v', is_flag=True, help="Enables verbose mode.")
+def convert(mzml, verbose):
+    """
+    Convert mzML files to the columnar spectrum store read by the 'columnar' read mode.
+
+    The store is written next to every mzML file, up to date stores are not rebuilt.
+    """
+    from .loaders.access import MzMLDataAccess
+
+    for mzml_file in mzml:
+        data_access = MzMLDataAccess(mzml_file, readOptions='columnar', verbose=verbose)
+        if data_access.columnar_store is None:
+            raise click.ClickException(f"Could not convert {mzml_file}")
+        click.echo(f"{mzml_file} -> {data_access.columnar_store.path}")
+
+# Headless extraction of XICs to sqMass files
+@cli.command()
+@click.option('--mzml', '-m', multiple=True, required=True, type=click.Path(exists=True, dir_okay=False), help="mzML file(s) to extract, can be given multiple times.")
+@click.option('--library', '-l', required=True, type=click.Path(exists=True, dir_okay=False), help="Spectral library (.pqp, .osw or .tsv) of the precursors to extract.")
+@click.option('--results', '-r', default=None, type=click.Path(exists=True, dir_okay=False), help="Results file (.osw or .tsv), precursors with a feature are extracted around its apex. Without results all precursors are extracted across the whole run.")
+@click.option('--output_dir', '-o', default='.', type=click.Path(file_okay=False), help="Directory the sqMass files are written to.")
+@click.option('--threads', '-t', default=os.cpu_count() or 1, type=int, help="Number of processes, with fewer runs than processes the spectra of every run are split across the processes.")
+@click.option('--rt_window', default=50, type=float, help="RT window in seconds around the apex of a feature.")
+@click.option('--mz_tol', default=20, type=float, help="m/z tolerance of the product ions in ppm.")
+@click.option('--ms1_mz_tol', default=20, type=float, help="m/z tolerance of the precursor in ppm.")
+@click.option('--im_window', default=0.06, type=float, help="Ion mobility window around the ion mobility of a precursor.")
+@click.option('--batch_size', default=1000, type=int, help="Number of precursors extracted at once, progress is saved after every batch.")
+@click.option('--read_options', default='ondisk', type=click.Choice(['ondisk', 'cached', 'columnar', 'hot']), help="How the mzML files are read.")
+@click.option('--verbose', '-v', is_flag=True, help="Enables verbose mode.")
+def extract(mzml, library, results, output_dir, threads, rt_window, mz_tol, ms1_mz_tol, im_window, batch_size, read_options, verbose):
+    """
+    Extract the XICs of all precursors of a spectral library into a sqMass file per run.
+
+    Runs with an existing sqMass file in the output directory are skipped, an interrupted extraction is resumed from the last saved batch.
+    """
+    from .loaders import SqMassExtractor
+    from .structs import TargetedDIAConfig
+
+    config = TargetedDIAConfig()
+    config.rt_window = rt_window
+    config.mz_tol = mz_tol
+    config.ms1_mz_tol = ms1_mz_tol
+    config.im_window = im_window
+
+    extractor = SqMassExtractor(library, results, config, readOptions=read_options, batchSize=batch_size, verbose=verbose)
+    for mzml_file, sqmass_file in zip(mzml, extractor.extract(list(mzml), output_dir, threads=threads)):
+        click.echo(f"{mzml_file} -> {sqmass_file}")
+
+# Covering indices for OSW files
+@cli.command()
+@click.option('--osw', '-i', multiple=True, required=True, type=click.Path(exists=True, dir_okay=False), help="OSW file(s) to index, can be given multiple times.")
+@click.option('--repeats', default=5, type=int, help="Number of runs of every query, the best time is reported.")
+def index(osw, repeats):
+    """
+    Build covering indices for the queries MassDash issues against OSW files.
+
+    The indices are built in an indexed copy next to every OSW file, the OSW file itself is not changed. The copy is read instead of the OSW file until the OSW file changes.
+    The copy is a full copy of the OSW file plus the indices, it needs at least as much disk space as the OSW file.
+    The query plans and the times of the queries are reported before and after indexing.
+    """
+    from .loaders.access import OSWIndexer
+
+    for osw_file in osw:
+        indexer = OSWIndexer(osw_file)
+        click.echo(f"Copying {osw_file} to {indexer.index_file}, the copy needs at least {os.path.getsize(osw_file) / 1024**2:.1f} MB of disk space")
+        click.echo(f"{osw_file} -> {indexer.build()}")
+        for _, row in indexer.report(repeats=repeats).iterrows():
+            click.echo(f"\n{row['query']}: {row['time_before'] * 1000:.3f} ms -> {row['time_after'] * 1000:.3f} ms")
+            click.echo("  before:\n" + "\n".join(f"    {line}" for line in row['plan_before'].splitlines()))
+            click.echo("  after:\n" + "\n".join(f"    {line}" for line in row['plan_after'].splitlines()))
@@ -23,6 +23,7 @@ from ..structs.TransitionGroupFeature import TransitionGroupFeature
 from ..structs.FeatureMap import FeatureMap
 # Loaders
 from ..loaders.MzMLDataLoader import MzMLDataLoader
+from ..loaders.access.FeatureMapCache import FeatureMapCache
 # Util
 from ..util import LOGGER, conditional_decorator, check_streamlit, MeasureBlock
 
@@ -75,7 +76,7 @@ class RawTargetedExtractionAnalysisServer:
         return _self.transition_list
     
     @conditional_decorator(lambda func: st.cache_resource(show_spinner="Loading data...")(func), check_streamlit())
-    def initiate_mzML_interface(_self, mzml_files, resultsFile, dataFile, verbose) -> MzMLDataLoader:
+    def initiate_mzML_interface(_self, mzml_files, resultsFile, dataFile, verbose, threads=1, metaDataSidecar=False) -> MzMLDataLoader:
         """
         Initiate an mzMLLoader Object.
 
@@ -84,11 +85,15 @@ class RawTargetedExtractionAnalysisServer:
             resultsFile (str): Path to the results file.
             dataFile (str): Path to the data file.
             verbose (bool): Whether or not to print verbose output.
+            threads (int): Number of processes used to extract the mzML files in parallel.
+            metaDataSidecar (bool): Whether to cache the spectrum meta data index in a sidecar file next to each mzML file.
         
         """
         st.write(mzml_files)
         st.write(dataFile)
-        _self.mzml_loader = MzMLDataLoader(rsltsFile=resultsFile, dataFiles=mzml_files, libraryFile=dataFile, verbose=verbose, mode='gui')
+        # cache the extracted feature maps on disk so that revisiting a precursor or restarting the server does not extract them again,
+        # the spectrum meta data index is only written next to the mzML files if the user enabled it
+        _self.mzml_loader = MzMLDataLoader(rsltsFile=resultsFile, dataFiles=mzml_files, libraryFile=dataFile, verbose=verbose, mode='gui', threads=threads, metaDataSidecar=metaDataSidecar, featureMapCache=FeatureMapCache())
         return _self.mzml_loader
 
     @conditional_decorator(lambda func: st.cache_resource(show_spinner="Loading into transition group...")(func), check_streamlit())
@@ -141,7 +146,9 @@ class RawTargetedExtractionAnalysisServer:
                 self.mzml_loader = self.initiate_mzML_interface(self.massdash_gui.file_input_settings.raw_file_path_list, 
                                             self.massdash_gui.file_input_settings.feature_file_path, 
                                             self.massdash_gui.file_input_settings.transition_list_file_path, 
-                                            self.massdash_gui.verbose)
+                                            self.massdash_gui.verbose,
+                                            self.massdash_gui.file_input_settings.threads,
+                                            self.massdash_gui.file_input_settings.meta_data_sidecar)
             st_log_writer.write(f"Initiating mzML files complete! Elapsed time: {timedelta(seconds=perf_metrics.execution_time)}")
                             
             # Get and append q-values to the transition list
@@ -15,8 +15,9 @@ class Data1D(ABC):
     '''
 
     def __init__(self, data: np.array, intensity: np.array, label: str='None') -> None:
-        self.intensity = np.array(intensity)
-        self.data = np.array(data)
+        # numpy arrays are wrapped without a copy
+        self.intensity = np.asarray(intensity)
+        self.data = np.asarray(data)
         self.label = label
 
     def __str__(self):
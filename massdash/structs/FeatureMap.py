@@ -39,7 +39,7 @@ class FeatureMap:
         self.sequence = sequence
         self.precursor_charge = precursor_charge
         if not self.has_im and not self.feature_df.empty:
-            self.feature_df.drop(columns=['im'], inplace=True)
+            self.feature_df.drop(columns=['im'], inplace=True, errors='ignore')
         self.config = config
         
         LOGGER.name = 'FeatureMap'
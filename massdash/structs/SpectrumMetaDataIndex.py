@@ -0,0 +1,252 @@
+"""
+massdash/structs/SpectrumMetaDataIndex
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+
+from typing import List, Tuple, Optional
+import numpy as np
+import pyopenms as po
+
+class SpectrumMetaDataIndex:
+    '''
+    Columnar index of the spectrum meta data of a single run. The index is built once when the run is opened so that spectrum selection (by ms level, retention time or isolation window) is done on numpy arrays instead of looping over the spectrum meta data.
+
+    Attributes:
+        spectrum_index (np.ndarray): The spectrum indices in the run, i.e. the position of every spectrum in the run
+        rt (np.ndarray): The retention time of every spectrum
+        ms_level (np.ndarray): The ms level of every spectrum
+        isolation_lower (np.ndarray): The lower bound of the isolation window of every spectrum, NaN if the spectrum has no precursor
+        isolation_upper (np.ndarray): The upper bound of the isolation window of every spectrum, NaN if the spectrum has no precursor
+        has_im (bool): Whether the spectra of the run carry ion mobility data
+        isolation_windows (np.ndarray): The distinct isolation windows (lower, upper) of the MS2 spectra, sorted by their lower bound. Overlapping and variable width windows are supported.
+    '''
+    # Version of the file format written by save, increase when the saved columns change
+    FILE_VERSION = 1
+
+    def __init__(self,
+                 spectrum_index: np.ndarray,
+                 rt: np.ndarray,
+                 ms_level: np.ndarray,
+                 isolation_lower: np.ndarray,
+                 isolation_upper: np.ndarray,
+                 has_im: bool = False):
+        self.spectrum_index = np.asarray(spectrum_index, dtype=np.int64)
+        self.rt = np.asarray(rt, dtype=np.float64)
+        self.ms_level = np.asarray(ms_level, dtype=np.int64)
+        self.isolation_lower = np.asarray(isolation_lower, dtype=np.float64)
+        self.isolation_upper = np.asarray(isolation_upper, dtype=np.float64)
+        self.has_im = bool(has_im)
+
+        # RT sorted view of the spectra for searchsorted based RT window selection, spectra are usually but not necessarily stored sorted by RT
+        self._rt_order = np.argsort(self.rt, kind='stable')
+        self._sorted_rt = self.rt[self._rt_order]
+
+        # MS1 spectra sorted by RT
+        ms1_spectra = np.flatnonzero(self.ms_level == 1)
+        self._ms1_spectra = ms1_spectra[np.argsort(self.rt[ms1_spectra], kind='stable')]
+        self._ms1_rt = self.rt[self._ms1_spectra]
+
+        # Interval index of the isolation windows, the MS2 spectra of every window are stored RT sorted and concatenated (window i owns _window_spectra[_window_offsets[i]:_window_offsets[i+1]])
+        ms2_spectra = np.flatnonzero((self.ms_level == 2) & ~np.isnan(self.isolation_lower) & ~np.isnan(self.isolation_upper))
+        self.isolation_windows, window_of_spectrum = np.unique(np.column_stack([self.isolation_lower[ms2_spectra], self.isolation_upper[ms2_spectra]]).reshape(-1, 2), axis=0, return_inverse=True)
+        window_of_spectrum = window_of_spectrum.reshape(-1)
+        order = np.lexsort((self.rt[ms2_spectra], window_of_spectrum))
+        self._window_spectra = ms2_spectra[order]
+        self._window_rt = self.rt[self._window_spectra]
+        self._window_offsets = np.concatenate([[0], np.cumsum(np.bincount(window_of_spectrum, minlength=self.isolation_windows.shape[0]))]).astype(np.int64)
+        self._max_window_width = np.max(self.isolation_windows[:, 1] - self.isolation_windows[:, 0]) if self.isolation_windows.shape[0] > 0 else 0.0
+
+    @classmethod
+    def from_experiment(cls, meta_data: po.MSExperiment, has_im: bool = False) -> 'SpectrumMetaDataIndex':
+        '''
+        Build the index from the spectrum meta data of an experiment
+
+        Args:
+            meta_data (po.MSExperiment): The meta data of the run, e.g. from OnDiscMSExperiment.getMetaData()
+            has_im (bool): Whether the spectra of the run carry ion mobility data
+
+        Returns:
+            SpectrumMetaDataIndex: The index of the spectrum meta data
+        '''
+        spectra = meta_data.getSpectra()
+        n_spectra = len(spectra)
+        rt = np.empty(n_spectra, dtype=np.float64)
+        ms_level = np.empty(n_spectra, dtype=np.int64)
+        isolation_lower = np.full(n_spectra, np.nan, dtype=np.float64)
+        isolation_upper = np.full(n_spectra, np.nan, dtype=np.float64)
+        for i, spec in enumerate(spectra):
+            rt[i] = spec.getRT()
+            ms_level[i] = spec.getMSLevel()
+            precursors = spec.getPrecursors()
+            if len(precursors) > 0:
+                isolation_lower[i] = precursors[0].getMZ() - precursors[0].getIsolationWindowLowerOffset()
+                isolation_upper[i] = precursors[0].getMZ() + precursors[0].getIsolationWindowUpperOffset()
+        return cls(np.arange(n_spectra), rt, ms_level, isolation_lower, isolation_upper, has_im)
+
+    def save(self, path: str, fingerprint: Optional[dict] = None):
+        '''
+        Save the index to a binary .npz file. The isolation window index is rebuilt from the saved columns when loading.
+
+        Args:
+            path (str): The path of the file to write to
+            fingerprint (dict): The fingerprint of the run the index was built from (see util.file_fingerprint), saved together with the index so that stale indices can be detected
+        '''
+        fingerprint = {} if fingerprint is None else fingerprint
+        with open(path, 'wb') as f:
+            np.savez(f,
+                     version=self.FILE_VERSION,
+                     spectrum_index=self.spectrum_index,
+                     rt=self.rt,
+                     ms_level=self.ms_level,
+                     isolation_lower=self.isolation_lower,
+                     isolation_upper=self.isolation_upper,
+                     has_im=self.has_im,
+                     **{f'fingerprint_{key}': value for key, value in fingerprint.items()})
+
+    @classmethod
+    def load(cls, path: str) -> Tuple['SpectrumMetaDataIndex', dict]:
+        '''
+        Load an index saved with save
+
+        Args:
+            path (str): The path of the file to read from
+
+        Returns:
+            Tuple[SpectrumMetaDataIndex, dict]: The index and the fingerprint of the run it was built from
+        '''
+        with np.load(path, allow_pickle=False) as data:
+            if int(data['version']) != cls.FILE_VERSION:
+                raise ValueError(f"Unsupported spectrum meta data index file version {int(data['version'])} (expected {cls.FILE_VERSION})")
+            fingerprint = {key[len('fingerprint_'):]: data[key].item() for key in data.files if key.startswith('fingerprint_')}
+            index = cls(data['spectrum_index'], data['rt'], data['ms_level'], data['isolation_lower'], data['isolation_upper'], bool(data['has_im']))
+        return index, fingerprint
+
+    def __len__(self) -> int:
+        return self.spectrum_index.shape[0]
+
+    def __str__(self):
+        return f"{'-'*8} {self.__class__.__name__} {'-'*8}\nnumber of spectra: {len(self)}\nMS1 spectra: {self.count_ms_level(1)}\nMS2 spectra: {self.count_ms_level(2)}\nhas_im: {self.has_im}"
+
+    def count_ms_level(self, mslevel: int) -> int:
+        '''
+        Count the number of spectra of a given ms level
+
+        Args:
+            mslevel (int): The ms level to count
+
+        Returns:
+            int: The number of spectra with this ms level
+        '''
+        return int(np.count_nonzero(self.ms_level == mslevel))
+
+    def get_ms_level_indices(self, mslevel: List[int] = [1, 2]) -> np.ndarray:
+        '''
+        Get the spectrum indices for a specific mslevel(s)
+
+        Args:
+            mslevel (List[int]): list of mslevel(s) to extract indices for
+
+        Returns:
+            np.ndarray: The spectrum indices with the requested mslevel(s)
+        '''
+        return self.spectrum_index[np.isin(self.ms_level, mslevel)]
+
+    def get_rt_window_slice(self, rt_start: float, rt_end: float) -> Tuple[int, int]:
+        '''
+        Get the positions in the RT sorted order of the spectra that fall in a RT window (bounds are inclusive)
+
+        Args:
+            rt_start (float): The lower bound of the RT window
+            rt_end (float): The upper bound of the RT window
+
+        Returns:
+            Tuple[int, int]: start and end position in the RT sorted order
+        '''
+        return np.searchsorted(self._sorted_rt, rt_start, side='left'), np.searchsorted(self._sorted_rt, rt_end, side='right')
+
+    def get_rt_window_indices(self, rt_start: float, rt_end: float, mslevel: List[int] = [1, 2]) -> np.ndarray:
+        '''
+        Get the spectrum indices of all spectra with the requested mslevel(s) in a RT window (bounds are inclusive)
+
+        Args:
+            rt_start (float): The lower bound of the RT window
+            rt_end (float): The upper bound of the RT window
+            mslevel (List[int]): list of mslevel(s) to extract indices for
+
+        Returns:
+            np.ndarray: The sorted spectrum indices in the RT window
+        '''
+        start, end = self.get_rt_window_slice(rt_start, rt_end)
+        spectrum_indices = np.sort(self._rt_order[start:end])
+        return spectrum_indices[np.isin(self.ms_level[spectrum_indices], mslevel)]
+
+    def get_isolation_window_mask(self, spectrum_indices: np.ndarray, precursor_mz: float) -> np.ndarray:
+        '''
+        Check for a set of spectra whether their isolation window contains a precursor m/z (bounds are exclusive)
+
+        Args:
+            spectrum_indices (np.ndarray): The spectrum indices to check
+            precursor_mz (float): The precursor m/z
+
+        Returns:
+            np.ndarray: boolean mask, True for spectra whose isolation window contains the precursor m/z
+        '''
+        return (self.isolation_lower[spectrum_indices] < precursor_mz) & (self.isolation_upper[spectrum_indices] > precursor_mz)
+
+    def get_isolation_window_indices(self, precursor_mz: float) -> np.ndarray:
+        '''
+        Get the isolation windows that contain a precursor m/z (bounds are exclusive)
+
+        Args:
+            precursor_mz (float): The precursor m/z
+
+        Returns:
+            np.ndarray: The indices (into isolation_windows) of the windows containing the precursor m/z
+        '''
+        # only windows with a lower bound in (precursor_mz - widest window, precursor_mz) can contain the precursor
+        start = np.searchsorted(self.isolation_windows[:, 0], precursor_mz - self._max_window_width, side='left')
+        end = np.searchsorted(self.isolation_windows[:, 0], precursor_mz, side='left')
+        candidates = np.arange(start, end)
+        return candidates[self.isolation_windows[candidates, 1] > precursor_mz]
+
+    def get_window_spectrum_indices(self, window_idx: int, rt_start: float = -np.inf, rt_end: float = np.inf) -> np.ndarray:
+        '''
+        Get the RT sorted spectrum indices of an isolation window, optionally restricted to a RT window (bounds are inclusive)
+
+        Args:
+            window_idx (int): The index of the isolation window (into isolation_windows)
+            rt_start (float): The lower bound of the RT window
+            rt_end (float): The upper bound of the RT window
+
+        Returns:
+            np.ndarray: The spectrum indices of the isolation window
+        '''
+        offset_start, offset_end = self._window_offsets[window_idx], self._window_offsets[window_idx + 1]
+        window_rt = self._window_rt[offset_start:offset_end]
+        start = offset_start + np.searchsorted(window_rt, rt_start, side='left')
+        end = offset_start + np.searchsorted(window_rt, rt_end, side='right')
+        return self._window_spectra[start:end]
+
+    def get_target_spectrum_indices(self, precursor_mz: float, rt_start: float, rt_end: float, mslevel: List[int] = [1, 2]) -> np.ndarray:
+        '''
+        Get the spectrum indices that have to be searched for a precursor, i.e. the MS1 spectra in the RT window and the MS2 spectra in the RT window whose isolation window contains the precursor m/z.
+        This is a lookup in the isolation window interval index and does not scan the spectrum meta data.
+
+        Args:
+            precursor_mz (float): The precursor m/z
+            rt_start (float): The lower bound of the RT window (inclusive)
+            rt_end (float): The upper bound of the RT window (inclusive)
+            mslevel (List[int]): list of mslevel(s) to extract indices for
+
+        Returns:
+            np.ndarray: The sorted spectrum indices
+        '''
+        spectrum_indices = []
+        if 1 in mslevel:
+            spectrum_indices.append(self._ms1_spectra[np.searchsorted(self._ms1_rt, rt_start, side='left'):np.searchsorted(self._ms1_rt, rt_end, side='right')])
+        if 2 in mslevel:
+            for window_idx in self.get_isolation_window_indices(precursor_mz):
+                spectrum_indices.append(self.get_window_spectrum_indices(window_idx, rt_start, rt_end))
+        if len(spectrum_indices) == 0:
+            return np.array([], dtype=np.int64)
+        return np.sort(np.concatenate(spectrum_indices))
@@ -4,6 +4,9 @@ massdash/structs/TargetedDIAConfig
 """
 
 from typing import Tuple, List
+import json
+import hashlib
+import numpy as np
 
 class TargetedDIAConfig:
     """
@@ -107,6 +110,23 @@ class TargetedDIAConfig:
             if hasattr(self, key):
                 setattr(self, key, value)
 
+    def get_hash(self) -> str:
+        """
+        Get a stable hash of the extraction parameters, equal configurations have equal hashes across processes and sessions (unlike hash()), e.g. to key caches of extracted data.
+
+        Return:
+          (str) the hex digest of the extraction parameters
+        """
+        to_float = lambda value: None if value is None else float(value)
+        params = {'ms1_mz_tol': to_float(self.ms1_mz_tol),
+                  'mz_tol': to_float(self.mz_tol),
+                  'rt_window': to_float(self.rt_window),
+                  'im_window': to_float(self.im_window),
+                  'mslevel': sorted(int(mslevel) for mslevel in self.mslevel),
+                  'im_start': to_float(self.im_start),
+                  'im_end': to_float(self.im_end)}
+        return hashlib.blake2b(json.dumps(params, sort_keys=True).encode(), digest_size=16).hexdigest()
+
     def get_upper_lower_tol(self, target_mz: float) -> Tuple[float, float]:
         """
         Get the upper bound and lower bound mz around a target mz given a mz tolerance in ppm
@@ -123,6 +143,35 @@ class TargetedDIAConfig:
         target_precursor_mz_lower = target_mz - mz_uncertainty
         return target_precursor_mz_lower, target_precursor_mz_upper
 
+    def get_upper_lower_tol_array(self, target_mz: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Array version of get_upper_lower_tol, get the upper and lower bound mz around several target mz given a mz tolerance in ppm
+
+        Args:
+          target_mz: (np.ndarray) The target mz values to generate upper and lower bound mz coordinates for
+
+        Return: 
+          (tuple) a tuple of arrays of the lower and upper bounds for the target mz values
+        """
+        target_mz = np.asarray(target_mz, dtype=float)
+        mz_uncertainty = target_mz * self.mz_tol / 2.0 * 1.0e-6
+        return target_mz - mz_uncertainty, target_mz + mz_uncertainty
+
+    def get_product_mz_tol_bounds(self, product_mz: List[float]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get the product mz tolerance bounds in a form that can be searched with np.searchsorted, i.e. the lower bounds sorted ascending and the running maximum of the upper bounds in the same order.
+        This only has to be computed once per precursor and is used by is_mz_in_product_mz_tol_window_array.
+
+        Args:
+          product_mz: (list) The product mz values of the precursor
+
+        Return:
+          (tuple) a tuple of the sorted lower bounds and the running maximum of the corresponding upper bounds
+        """
+        lower, upper = self.get_upper_lower_tol_array(product_mz)
+        order = np.argsort(lower, kind='stable')
+        return lower[order], np.maximum.accumulate(upper[order])
+
     def get_rt_upper_lower(self, rt_apex: float) -> Tuple[float, float]:
         """
         Get the upper bound and lower bound of a target RT point for a given RT window, i.e. a window of 50 would be 25 points to either side of the target RT.
@@ -161,3 +210,22 @@ class TargetedDIAConfig:
         Return: (bool) Return a logical value 
         """
         return any([check_mz >= bounds[0] and check_mz <= bounds[1] for bounds in target_product_upper_lower_list])
+
+    @staticmethod
+    def is_mz_in_product_mz_tol_window_array(check_mz: np.ndarray, product_mz_tol_bounds: Tuple[np.ndarray, np.ndarray]) -> np.ndarray:
+        """
+        Array version of is_mz_in_product_mz_tol_window, check for every mz if it is within any of the product mz tolerance windows (bounds are inclusive)
+
+        Args: 
+          check_mz: (np.ndarray) The mz values to check
+          product_mz_tol_bounds: (tuple) The sorted lower bounds and running maximum of the upper bounds as returned by get_product_mz_tol_bounds
+
+        Return: (np.ndarray) a boolean array, True for every mz that is within a product mz tolerance window
+        """
+        sorted_lower, cummax_upper = product_mz_tol_bounds
+        check_mz = np.asarray(check_mz)
+        if sorted_lower.shape[0] == 0:
+            return np.zeros(check_mz.shape, dtype=bool)
+        # index of the last window with a lower bound <= mz, all windows up to this one could contain the mz
+        window_idx = np.searchsorted(sorted_lower, check_mz, side='right') - 1
+        return (window_idx >= 0) & (check_mz <= cummax_upper[np.maximum(window_idx, 0)])
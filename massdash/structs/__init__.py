@@ -13,6 +13,7 @@ from .GenericFeature import GenericFeature
 from .GenericStructCollection import GenericStructCollection
 from .Mobilogram import Mobilogram
 from .Spectrum import Spectrum
+from .SpectrumMetaDataIndex import SpectrumMetaDataIndex
 from .TargetedDIAConfig import TargetedDIAConfig
 from .TopTransitionGroupFeatureCollection import TopTransitionGroupFeatureCollection
 from .TransitionFeature import TransitionFeature
@@ -37,4 +38,5 @@ __all__ = [
             "TransitionGroupCollection",
             "TransitionGroupFeature", 
             "TransitionGroupFeatureCollection",
-            "Spectrum"]
+            "Spectrum",
+            "SpectrumMetaDataIndex"]
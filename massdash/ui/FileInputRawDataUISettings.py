@@ -21,6 +21,7 @@ class FileInputRawDataUISettings(BaseUISettings):
         feature_file_path (streamlit.text_input): A text input field for the search results output file path.
         raw_file_path_list (list): List of full file paths to *.mzML files in the directory or the file itself.
         threads (int): Number of threads to use for processing the files.
+        meta_data_sidecar (bool): Whether to cache the spectrum meta data of the mzML files in a sidecar file next to each mzML file.
     
     Methods:
         create_ui: Creates the user interface for the FileInputXICDataUISettings.
@@ -36,6 +37,7 @@ class FileInputRawDataUISettings(BaseUISettings):
         self.feature_file_type = None
         self.raw_file_path_list = None
         self.threads = None
+        self.meta_data_sidecar = False
 
     def create_ui(self, transition_list_file_path: str=None, raw_file_path: str=None, feature_file_path: str=None, feature_file_type: str="OpenSWATH"):
         """
@@ -51,6 +53,8 @@ class FileInputRawDataUISettings(BaseUISettings):
 
         st.sidebar.subheader("Input Raw file")
         self.raw_file_path_input = st.sidebar.text_input("Enter file path", raw_file_path, key='raw_data_file_path', help="Path to the raw file (*.mzML)")
+        # off by default, the sidecar files are written next to the mzML files of the user
+        self.meta_data_sidecar = st.sidebar.checkbox("Cache spectrum meta data", value=False, key='raw_data_meta_data_sidecar', help="Write the spectrum meta data of each mzML file to a sidecar file (*.npz) next to it, so that reopening the file is faster")
 
         st.sidebar.subheader("Input Feature file")
         self.feature_file_path = st.sidebar.text_input("Enter file path", feature_file_path, key='raw_data_feature_file_path', help="Path to the feature file (*.osw / *.tsv)")
@@ -6,6 +6,8 @@ massdash/util
 import os
 import sys
 import importlib
+import hashlib
+import sqlite3
 from typing import Optional, List
 from pathlib import Path
 from collections import Counter
@@ -37,7 +39,7 @@ try:
 except ImportError:
     st = None
 
-from .constants import USER_PLATFORM_SYSTEM
+from .constants import USER_PLATFORM_SYSTEM, SQLITE_MMAP_SIZE, SQLITE_CACHE_SIZE
 
 
 #######################################
@@ -219,6 +221,37 @@ def check_streamlit():
     else:
         return False
 
+def connect_sqlite_readonly(filename: str, immutable: bool=False, mmap_size: int=SQLITE_MMAP_SIZE, cache_size: int=SQLITE_CACHE_SIZE, check_same_thread: bool=False) -> sqlite3.Connection:
+    """
+    Open a read only connection to a SQLite database, MassDash never writes to the OSW, PQP and sqMass files it reads.
+
+    The file is read through memory mapping, so its pages are shared with other processes reading the same file through the OS page cache. Temporary tables and indices are kept in memory.
+    An immutable database is not locked and not checked for changes by other connections, which removes the locking overhead of every query, it must not be written while it is open.
+
+    Args:
+        filename (str): Path to the SQLite database.
+        immutable (bool, optional): Open the database as immutable, ignored if a rollback journal or write ahead log exists next to the database (the database is being written or was not closed cleanly). Defaults to False.
+        mmap_size (int, optional): Maximum number of bytes of the database accessed through memory mapping, 0 disables memory mapping. Defaults to SQLITE_MMAP_SIZE.
+        cache_size (int, optional): Size of the page cache of the connection in KiB. Defaults to SQLITE_CACHE_SIZE.
+        check_same_thread (bool, optional): Only allow the connection to be used by the thread that opened it. Defaults to False.
+
+    Returns:
+        sqlite3.Connection: The connection to the database.
+
+    Raises:
+        FileNotFoundError: If the database does not exist, a read only connection cannot create it.
+    """
+    path = Path(filename).resolve()
+    if not path.is_file():
+        raise FileNotFoundError(f"SQLite database {filename} does not exist")
+    immutable = immutable and not any(os.path.exists(f"{path}{suffix}") for suffix in ('-journal', '-wal'))
+    conn = sqlite3.connect(f"{path.as_uri()}?mode=ro{'&immutable=1' if immutable else ''}", uri=True, check_same_thread=check_same_thread)
+    conn.execute(f"PRAGMA mmap_size = {int(mmap_size)}")
+    # a negative cache size is a size in KiB instead of a number of pages
+    conn.execute(f"PRAGMA cache_size = {-int(cache_size)}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
+
 def check_sqlite_table(con, table):
     """
     Check if a table exists in a SQLite database.
@@ -328,6 +361,44 @@ def file_basename_without_extension(file_path):
     
     return base_name
 
+def file_fingerprint(file_path: str, sample_size: int=1 << 20) -> dict:
+    """
+    Fingerprint of a file, used to check whether data derived from the file (e.g. an index or a cache) is still valid.
+
+    The content hash only covers the first and last `sample_size` bytes of the file and its size, so fingerprinting stays cheap for multi-GB files. For indexed mzML files the tail contains the offset index and the file checksum.
+
+    Args:
+        file_path (str): Path to the file.
+        sample_size (int, optional): Number of bytes hashed at the start and the end of the file. Defaults to 1 MB.
+
+    Returns:
+        dict: The size (bytes), modification time (ns) and content hash of the file.
+    """
+    stat = os.stat(file_path)
+    content_hash = hashlib.blake2b(str(stat.st_size).encode(), digest_size=16)
+    with open(file_path, 'rb') as f:
+        content_hash.update(f.read(sample_size))
+        if stat.st_size > sample_size:
+            f.seek(max(sample_size, stat.st_size - sample_size))
+            content_hash.update(f.read(sample_size))
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'hash': content_hash.hexdigest()}
+
+def is_file_fingerprint_current(file_path: str, fingerprint: dict) -> bool:
+    """
+    Check whether a fingerprint (see file_fingerprint) still matches a file. The size has to match and either the modification time or the content hash, so copying or touching an unchanged file does not invalidate the fingerprint.
+
+    Args:
+        file_path (str): Path to the file.
+        fingerprint (dict): The fingerprint of the file when the derived data was built.
+
+    Returns:
+        bool: True if the file is unchanged.
+    """
+    stat = os.stat(file_path)
+    if fingerprint.get('size') != stat.st_size:
+        return False
+    return fingerprint.get('mtime') == stat.st_mtime_ns or fingerprint.get('hash') == file_fingerprint(file_path)['hash']
+
 def infer_unique_filenames(filenames: List, sep: str='_'):
     """
     Infer unique filenames by removing substrings that occur in all filenames.
@@ -0,0 +1,48 @@
+"""
+test/benchmarks/benchmark_reduce_spectra
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Benchmark the targeted extraction of a single mzML run (MzMLDataAccess.reduce_spectra) for increasing RT windows and number of processes.
+
+Usage:
+    python test/benchmarks/benchmark_reduce_spectra.py --threads 1 --threads 4
+"""
+
+import os
+import timeit
+from pathlib import Path
+
+import click
+
+from massdash.loaders import MzMLDataLoader
+from massdash.structs import TargetedDIAConfig
+from massdash.util import find_git_directory
+
+TEST_PATH = find_git_directory(Path(__file__).resolve()).parent / 'test'
+
+@click.command()
+@click.option('--mzml', default=str(TEST_PATH / 'test_data' / 'example_dia' / 'raw' / 'test_raw_1.mzML'), type=click.Path(exists=True), help="mzML file to extract from.")
+@click.option('--rslts', default=str(TEST_PATH / 'test_data' / 'example_dia' / 'openswath' / 'osw' / 'test.osw'), type=click.Path(exists=True), help="Results file (.osw) containing the peptide.")
+@click.option('--peptide', default='DYASIDAAPEER', type=str, help="Modified peptide sequence to extract.")
+@click.option('--charge', default=2, type=int, help="Precursor charge of the peptide.")
+@click.option('--rt_window', '-r', multiple=True, default=[50, 500, 5000], type=float, help="RT window(s) to extract.")
+@click.option('--threads', '-t', multiple=True, default=[1, os.cpu_count()], type=int, help="Number(s) of processes to benchmark.")
+@click.option('--repeats', default=5, type=int, help="Number of repeats per measurement, the best time is reported.")
+def benchmark(mzml, rslts, peptide, charge, rt_window, threads, repeats):
+    loader = MzMLDataLoader(rsltsFile=rslts, dataFiles=[mzml], libraryFile=None, verbose=False, mode='module')
+    run_name = loader.dataAccess[0].runName
+
+    click.echo(f"{'rt_window':>10} {'threads':>8} {'peaks':>10} {'best (s)':>10}")
+    for rt in rt_window:
+        config = TargetedDIAConfig()
+        config.rt_window = rt
+        config.im_window = None
+        for n in threads:
+            loader.threads = n
+            # first call starts the worker processes
+            feature_map = loader.loadFeatureMaps(peptide, charge, config, runNames=run_name)[run_name]
+            best = min(timeit.repeat(lambda: loader.loadFeatureMaps(peptide, charge, config, runNames=run_name), number=1, repeat=repeats))
+            click.echo(f"{rt:>10} {n:>8} {feature_map.feature_df.shape[0]:>10} {best:>10.3f}")
+
+if __name__ == '__main__':
+    benchmark()
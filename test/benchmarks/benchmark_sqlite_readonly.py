@@ -0,0 +1,58 @@
+"""
+test/benchmarks/benchmark_sqlite_readonly
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Benchmark repeated queries against an OSW and a sqMass file opened with a default read write connection and with the read only connections of MassDash (see util.connect_sqlite_readonly).
+The effect of memory mapping grows with the size of the files, pass multi-GB files with --osw and --sqmass.
+
+Usage:
+    python test/benchmarks/benchmark_sqlite_readonly.py --osw results.osw --sqmass run.sqMass
+"""
+
+import sqlite3
+import timeit
+from pathlib import Path
+
+import click
+import numpy as np
+
+from massdash.util import connect_sqlite_readonly, find_git_directory
+
+TEST_PATH = find_git_directory(Path(__file__).resolve()).parent / 'test'
+
+CONNECTIONS = {'default': lambda f: sqlite3.connect(f, check_same_thread=False),
+               'read only': lambda f: connect_sqlite_readonly(f),
+               'immutable': lambda f: connect_sqlite_readonly(f, immutable=True)}
+
+def osw_queries(conn, rng, n):
+    precursor_ids = [row[0] for row in conn.execute("SELECT ID FROM PRECURSOR")]
+    for precursor_id in rng.choice(precursor_ids, n):
+        conn.execute('''SELECT FEATURE.ID, EXP_RT, LEFT_WIDTH, RIGHT_WIDTH, SCORE_MS2.SCORE, SCORE_MS2.QVALUE
+                        FROM FEATURE
+                        LEFT JOIN SCORE_MS2 ON SCORE_MS2.FEATURE_ID = FEATURE.ID
+                        WHERE FEATURE.PRECURSOR_ID = ?''', (int(precursor_id),)).fetchall()
+        conn.execute('''SELECT TRANSITION_ID FROM TRANSITION_PRECURSOR_MAPPING WHERE PRECURSOR_ID = ?''', (int(precursor_id),)).fetchall()
+
+def sqmass_queries(conn, rng, n):
+    chrom_ids = [row[0] for row in conn.execute("SELECT ID FROM CHROMATOGRAM")]
+    for chrom_id in rng.choice(chrom_ids, n):
+        conn.execute("SELECT COMPRESSION, DATA_TYPE, DATA FROM DATA WHERE CHROMATOGRAM_ID = ?", (int(chrom_id),)).fetchall()
+
+@click.command()
+@click.option('--osw', default=str(TEST_PATH / 'test_data' / 'example_dia' / 'openswath' / 'osw' / 'test.osw'), type=click.Path(exists=True), help="OSW file to query.")
+@click.option('--sqmass', default=str(TEST_PATH / 'test_data' / 'xics' / 'test_chrom_1.sqMass'), type=click.Path(exists=True), help="sqMass file to query.")
+@click.option('--queries', default=1000, type=int, help="Number of random precursors or chromatograms queried per measurement.")
+@click.option('--repeats', default=5, type=int, help="Number of repeats per measurement, the best time is reported.")
+def benchmark(osw, sqmass, queries, repeats):
+    click.echo(f"{'file':>8} {'connection':>12} {'best (s)':>10}")
+    for name, filename, run_queries in [('osw', osw, osw_queries), ('sqMass', sqmass, sqmass_queries)]:
+        for connection, connect in CONNECTIONS.items():
+            conn = connect(filename)
+            # the same random queries for every connection, the first run warms the caches
+            run_queries(conn, np.random.default_rng(0), queries)
+            best = min(timeit.repeat(lambda: run_queries(conn, np.random.default_rng(0), queries), number=1, repeat=repeats))
+            conn.close()
+            click.echo(f"{name:>8} {connection:>12} {best:>10.3f}")
+
+if __name__ == '__main__':
+    benchmark()
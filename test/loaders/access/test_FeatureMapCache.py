@@ -0,0 +1,97 @@
+"""
+test/loaders/access/test_FeatureMapCache
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+
+import os
+import pytest
+import numpy as np
+import pandas as pd
+
+from massdash.loaders.access.FeatureMapCache import FeatureMapCache
+from massdash.structs import FeatureMap, TargetedDIAConfig, TransitionGroupFeature
+
+@pytest.fixture
+def feature():
+    return TransitionGroupFeature(leftBoundary=10.0, rightBoundary=20.0, consensusApex=15.0, consensusApexIM=1.0, precursor_mz=500.0, precursor_charge=2,
+                                  product_mz=[300.0, 400.0], product_annotations=['y3^1', 'y4^1'], sequence='PEPTIDE')
+
+@pytest.fixture
+def feature_map():
+    feature_df = pd.DataFrame({'native_id': np.array(['', ''], dtype=object), 'ms_level': np.array([1, 2]), 'precursor_mz': [500.0, 500.0],
+                               'mz': [500.001, 300.002], 'rt': [15.0, 15.1], 'im': np.array([1.0, 1.01], dtype=np.float32),
+                               'int': np.array([10.0, 20.0], dtype=np.float32), 'Annotation': np.array(['prec', 'y3^1'], dtype=object), 'product_mz': [500.0, 300.0]})
+    return FeatureMap(feature_df, 'PEPTIDE', 2)
+
+@pytest.fixture
+def feature_map_cache(tmp_path):
+    return FeatureMapCache(str(tmp_path))
+
+def test_get_key(feature):
+    config = TargetedDIAConfig()
+    key = FeatureMapCache.get_key('run', feature, config)
+    assert key == FeatureMapCache.get_key('run', feature, TargetedDIAConfig())
+    assert key != FeatureMapCache.get_key('other_run', feature, config)
+
+    config.rt_window = 10
+    assert key != FeatureMapCache.get_key('run', feature, config)
+
+    feature.consensusApex = 16.0
+    assert key != FeatureMapCache.get_key('run', feature, TargetedDIAConfig())
+
+def test_put_get(feature_map_cache, feature_map):
+    config = TargetedDIAConfig()
+    assert feature_map_cache.get('key', config) is None
+
+    feature_map_cache.put('key', feature_map)
+    cached = feature_map_cache.get('key', config)
+    pd.testing.assert_frame_equal(cached.feature_df, feature_map.feature_df)
+    assert cached.sequence == feature_map.sequence
+    assert cached.precursor_charge == feature_map.precursor_charge
+    assert cached.has_im
+    assert cached.config is config
+
+def test_put_get_empty(feature_map_cache):
+    feature_map = FeatureMap(pd.DataFrame(columns=['rt', 'int', 'Annotation']), 'PEPTIDE', 2)
+    feature_map_cache.put('key', feature_map)
+    cached = feature_map_cache.get('key')
+    assert cached.empty()
+    assert list(cached.feature_df.columns) == ['rt', 'int', 'Annotation']
+
+def test_evict(feature_map_cache, feature_map):
+    feature_map_cache.put('key_0', feature_map)
+    entry_size = feature_map_cache.get_size()
+    feature_map_cache.max_size = 2 * entry_size
+    feature_map_cache.put('key_1', feature_map)
+    # mark key_0 as the least recently used entry
+    os.utime(os.path.join(feature_map_cache.cache_dir, 'key_0.npz'), ns=(0, 0))
+    feature_map_cache.put('key_2', feature_map)
+
+    assert feature_map_cache.get_size() <= feature_map_cache.max_size
+    assert feature_map_cache.get('key_0') is None
+    assert feature_map_cache.get('key_1') is not None
+    assert feature_map_cache.get('key_2') is not None
+
+    feature_map_cache.clear()
+    assert feature_map_cache.get_size() == 0
+
+def test_evict_only_when_full(feature_map_cache, feature_map, monkeypatch):
+    evictions = []
+    evict = FeatureMapCache.evict
+    monkeypatch.setattr(FeatureMapCache, 'evict', lambda self: evictions.append(self) or evict(self))
+
+    # the cache directory is not scanned while the cache fits into its maximum size
+    for i in range(3):
+        feature_map_cache.put(f'key_{i}', feature_map)
+    assert evictions == []
+
+    feature_map_cache.max_size = 2 * feature_map_cache.get_size() // 3
+    feature_map_cache.put('key_3', feature_map)
+    assert len(evictions) == 1
+    assert feature_map_cache.get_size() <= feature_map_cache.max_size
+
+def test_corrupt_entry(feature_map_cache):
+    with open(os.path.join(feature_map_cache.cache_dir, 'key.npz'), 'wb') as f:
+        f.write(b'not a feature map')
+    assert feature_map_cache.get('key') is None
+    assert not os.path.exists(os.path.join(feature_map_cache.cache_dir, 'key.npz'))
@@ -7,17 +7,16 @@ import pandas as pd
 import numpy as np
 from pathlib import Path
 import os
+import copy
 import pyopenms as po
 import sys
 
 import pytest
-from massdash.loaders.access.MzMLDataAccess import MzMLDataAccess
+from massdash.loaders.access.MzMLDataAccess import MzMLDataAccess, _get_worker_data_access, _WORKER_DATA_ACCESS
 from massdash.structs import TargetedDIAConfig, TransitionGroupFeature
 from massdash.testing import PandasSnapshotExtension, NumpySnapshotExtension
 from massdash.util import find_git_directory
 
-## Note: Cached is not tested
-
 TEST_PATH = find_git_directory(Path(__file__).resolve()).parent / 'test'
 
 @pytest.fixture
@@ -35,6 +34,24 @@ def mzml_data_access():
         mzml_data_access = MzMLDataAccess(os.path.join(TEST_PATH, 'test_data', 'mzml', 'ionMobilityTest.mzML'), readOptions='ondisk')
         return mzml_data_access
 
+@pytest.fixture
+def feature():
+    return TransitionGroupFeature(leftBoundary=6233,
+                                  rightBoundary=6247,
+                                  consensusApex=6240.41,
+                                  consensusApexIM=0.98,
+                                  sequence='AFVDFLSDEIK',
+                                  precursor_charge=2,
+                                  precursor_mz=642.3295,
+                                  product_mz=[504.2664, 591.2984, 704.3825, 851.4509, 966.4779, 1065.5463],
+                                  product_annotations=['y4^1', 'y5^1', 'y6^1', 'y7^1', 'y8^1', 'y9^1'])
+
+def feature_at_apex(feature, rt):
+    # the feature moved to another apex, with a peak width of 14 seconds
+    moved = copy.copy(feature)
+    moved.consensusApex, moved.leftBoundary, moved.rightBoundary = rt, rt - 7, rt + 7
+    return moved
+
 @pytest.fixture
 def snapshot_pandas(snapshot):
     return snapshot.use_extension(PandasSnapshotExtension)
@@ -51,6 +68,52 @@ def peptide_product_annotation_list():
 def reference_mz_values():
     return np.array([100.0, 150.0, 200.0, 250.0, 300.0])
 
+@pytest.fixture
+def synthetic_im_mzml(tmp_path):
+    # a small diaPASEF like run with ion mobility, one MS1 spectrum followed by two MS2 spectra per cycle
+    exp = po.MSExperiment()
+    rng = np.random.default_rng(0)
+    for i in range(30):
+        spec = po.MSSpectrum()
+        spec.setRT(10.0 + i)
+        spec.setMSLevel(1 if i % 3 == 0 else 2)
+        if i % 3 != 0:
+            prec = po.Precursor()
+            prec.setMZ(412.5 if i % 3 == 1 else 437.5)
+            prec.setIsolationWindowLowerOffset(12.5)
+            prec.setIsolationWindowUpperOffset(12.5)
+            spec.setPrecursors([prec])
+        mz = np.sort(rng.uniform(100, 1000, 50))
+        spec.set_peaks((mz, rng.uniform(0, 100, 50)))
+        fda = po.FloatDataArray()
+        fda.set_data(rng.uniform(0.8, 1.2, 50).astype(np.float32))
+        fda.setName("Ion Mobility")
+        spec.setFloatDataArrays([fda])
+        exp.addSpectrum(spec)
+    mzml_file = str(tmp_path / 'synthetic.mzML')
+    po.MzMLFile().store(mzml_file, exp)
+    return mzml_file
+
+@pytest.fixture
+def synthetic_im_feature():
+    return TransitionGroupFeature(consensusApex=25.0, leftBoundary=20.0, rightBoundary=30.0, consensusApexIM=1.0, precursor_mz=410.0, precursor_charge=2,
+                                  product_mz=[300.0, 500.0, 700.0], product_annotations=['y3^1', 'y4^1', 'y5^1'], sequence='PEPTIDE')
+
+@pytest.fixture
+def synthetic_im_config():
+    config = TargetedDIAConfig()
+    config.rt_window = 20
+    config.mz_tol = 50000
+    config.im_window = 0.2
+    return config
+
+def append_spectrum(mzml_file):
+    # modify the file by appending a copy of its first spectrum
+    exp = po.MSExperiment()
+    po.MzMLFile().load(mzml_file, exp)
+    exp.addSpectrum(exp.getSpectrum(0))
+    po.MzMLFile().store(mzml_file, exp)
+
 def test_load_data(mzml_data_access):
     mzml_data_access.load_data()
     assert mzml_data_access.exp is not None
@@ -71,19 +134,7 @@ def test_load_spectrum(mzml_data_access, spec_indice, snapshot_numpy):
     assert snapshot_numpy == np.column_stack([mz, intens, im[0].get_data()]) # note IM not tested here
 
 @pytest.mark.parametrize("spec_indice", [0])
-def test_filter_single_spectrum(mzml_data_access, spec_indice, snapshot_numpy):
-    product_mzs = [504.2664, 591.2984, 704.3825, 851.4509, 966.4779, 1065.5463]
-    annotations = ['y4^1', 'y5^1', 'y6^1', 'y7^1', 'y8^1', 'y9^1'] 
-    feature = TransitionGroupFeature(leftBoundary=6233, 
-                                     rightBoundary=6247, 
-                                     consensusApex=6240.41, 
-                                     consensusApexIM=0.98, 
-                                     sequence='AFVDFLSDEIK', 
-                                     precursor_charge=2, 
-                                     precursor_mz=642.3295,
-                                     product_mz=product_mzs,
-                                     product_annotations=annotations)
-
+def test_filter_single_spectrum(mzml_data_access, feature, spec_indice, snapshot_numpy):
     config = TargetedDIAConfig()
     filtered_spectrum = mzml_data_access.filter_single_spectrum(spec_indice, feature, config)
     fda = filtered_spectrum.getFloatDataArrays()[0]
@@ -92,30 +143,218 @@ def test_filter_single_spectrum(mzml_data_access, spec_indice, snapshot_numpy):
     peaks = np.array([mz, intens, im]).flatten() # need to flatten or get shape mismatch
     assert snapshot_numpy == peaks
 
-def test_reduce_spectra(mzml_data_access, snapshot_pandas): # also tests msExperimentToFeatureMap()
-    product_mzs = [504.2664, 591.2984, 704.3825, 851.4509, 966.4779, 1065.5463]
-    annotations = ['y4^1', 'y5^1', 'y6^1', 'y7^1', 'y8^1', 'y9^1'] 
-    feature = TransitionGroupFeature(leftBoundary=6233, 
-                                     rightBoundary=6247, 
-                                     consensusApex=6240.41, 
-                                     consensusApexIM=0.98, 
-                                     sequence='AFVDFLSDEIK', 
-                                     precursor_charge=2, 
-                                     precursor_mz=642.3295,
-                                     product_mz=product_mzs,
-                                     product_annotations=annotations)
+def test_reduce_spectra(mzml_data_access, feature, snapshot_pandas):
     config = TargetedDIAConfig()
     config.rt_window = 2
     feature_map = mzml_data_access.reduce_spectra(feature, config)
     assert snapshot_pandas == feature_map.feature_df
 
+def test_reduce_spectra_multiple_features(mzml_data_access, feature):
+    features = [feature_at_apex(feature, rt) for rt in [6239.41, 6240.41, 6241.41]]
+    config = TargetedDIAConfig()
+    config.rt_window = 2
+
+    # a single sweep over the spectra has to give the same result as extracting every feature separately
+    feature_maps = mzml_data_access.reduce_spectra(features, config)
+    assert len(feature_maps) == len(features)
+    for feature, feature_map in zip(features, feature_maps):
+        pd.testing.assert_frame_equal(feature_map.feature_df, mzml_data_access.reduce_spectra(feature, config).feature_df)
+
+def test_iter_reduce_spectra(mzml_data_access, feature):
+    features = [feature_at_apex(feature, rt) for rt in [6239.41, 6240.41, 6241.41]]
+    config = TargetedDIAConfig()
+    config.rt_window = 2
+
+    # features are given as a generator and extracted in batches
+    results = list(mzml_data_access.iter_reduce_spectra((f for f in features), config, batch_size=2))
+    assert [feature for feature, _ in results] == features
+    for feature, feature_map in results:
+        pd.testing.assert_frame_equal(feature_map.feature_df, mzml_data_access.reduce_spectra(feature, config).feature_df)
+
+def test_reduce_spectra_threads(mzml_data_access, feature):
+    config = TargetedDIAConfig()
+    config.rt_window = 5000
+
+    # filtering blocks of spectra in parallel has to give the same result as a single sweep
+    pd.testing.assert_frame_equal(mzml_data_access.reduce_spectra(feature, config, threads=2).feature_df, mzml_data_access.reduce_spectra(feature, config).feature_df)
+
+def test_extract_chromatograms(mzml_data_access, feature):
+    config = TargetedDIAConfig()
+    config.rt_window = 2
+
+    # the chromatograms accumulated from the spectra have to be the same as the chromatograms of the FeatureMap
+    transition_group = mzml_data_access.extract_chromatograms(feature, config)
+    expected = mzml_data_access.reduce_spectra(feature, config).to_chromatograms()
+    assert transition_group.sequence == expected.sequence
+    assert transition_group.precursor_charge == expected.precursor_charge
+    for chroms, expected_chroms in [(transition_group.precursorData, expected.precursorData), (transition_group.transitionData, expected.transitionData)]:
+        assert [chrom.label for chrom in chroms] == [chrom.label for chrom in expected_chroms]
+        for chrom, expected_chrom in zip(chroms, expected_chroms):
+            np.testing.assert_array_equal(chrom.data, expected_chrom.data)
+            np.testing.assert_allclose(chrom.intensity, expected_chrom.intensity, rtol=1e-5)
+
+    # no spectra in the RT window
+    feature.consensusApex = 1e6
+    transition_group = mzml_data_access.extract_chromatograms(feature, config)
+    assert transition_group.precursorData[0].label == 'No precursor chromatograms found'
+    assert transition_group.transitionData[0].label == 'No transition chromatograms found'
+
+    # a list of features is extracted in a single sweep, every feature gets the same chromatograms as if it was extracted alone
+    other_feature = copy.copy(feature)
+    feature.consensusApex = 6240.41
+    transition_groups = mzml_data_access.extract_chromatograms([feature, other_feature, feature], config)
+    assert len(transition_groups) == 3
+    assert transition_groups[1].transitionData[0].label == 'No transition chromatograms found'
+    for transition_group in [transition_groups[0], transition_groups[2]]:
+        for chrom, expected_chrom in zip(transition_group.transitionData, expected.transitionData):
+            assert chrom.label == expected_chrom.label
+            np.testing.assert_allclose(chrom.intensity, expected_chrom.intensity, rtol=1e-5)
+
+def test_meta_data_sidecar(tmp_path):
+    exp = po.MSExperiment()
+    for i, ms_level in enumerate([1, 2, 2]):
+        spec = po.MSSpectrum()
+        spec.setRT(10.0 + i)
+        spec.setMSLevel(ms_level)
+        if ms_level == 2:
+            prec = po.Precursor()
+            prec.setMZ(400.0 + 25 * i)
+            prec.setIsolationWindowLowerOffset(12.5)
+            prec.setIsolationWindowUpperOffset(12.5)
+            spec.setPrecursors([prec])
+        spec.set_peaks(([100.0, 200.0], [1.0, 2.0]))
+        exp.addSpectrum(spec)
+    mzml_file = str(tmp_path / 'sidecar.mzML')
+    po.MzMLFile().store(mzml_file, exp)
+
+    data_access = MzMLDataAccess(mzml_file, readOptions='ondisk', meta_data_sidecar=True)
+    assert os.path.isfile(data_access.get_meta_data_sidecar_path())
+
+    # reopening the file reads the index from the sidecar
+    sidecar_index = data_access.load_meta_data_sidecar()
+    assert sidecar_index is not None
+    sidecar_access = MzMLDataAccess(mzml_file, readOptions='ondisk', meta_data_sidecar=True)
+    assert sidecar_access.has_im == data_access.has_im
+    np.testing.assert_array_equal(sidecar_access.meta_data_index.rt, data_access.meta_data_index.rt)
+    np.testing.assert_array_equal(sidecar_access.meta_data_index.ms_level, data_access.meta_data_index.ms_level)
+    np.testing.assert_array_equal(sidecar_access.meta_data_index.isolation_windows, data_access.meta_data_index.isolation_windows)
+    np.testing.assert_array_equal(sidecar_access.load_spectrum(1)[0], data_access.load_spectrum(1)[0])
+
+    # a modified file invalidates the sidecar
+    exp.addSpectrum(exp.getSpectrum(0))
+    po.MzMLFile().store(mzml_file, exp)
+    assert data_access.load_meta_data_sidecar() is None
+    assert len(MzMLDataAccess(mzml_file, readOptions='ondisk', meta_data_sidecar=True).meta_data_index) == 4
+
+@pytest.mark.parametrize("readOptions", ['columnar', 'cached', 'hot'])
+def test_readOptions_equivalence(synthetic_im_mzml, synthetic_im_feature, synthetic_im_config, readOptions, tmp_path):
+    ondisk_access = MzMLDataAccess(synthetic_im_mzml, readOptions='ondisk')
+    data_access = MzMLDataAccess(synthetic_im_mzml, readOptions=readOptions, cache_dir=str(tmp_path / 'cache'))
+    assert data_access.readOptions == readOptions
+    assert data_access.has_im
+    # the peaks of every spectrum are the same as on disk
+    for spec_indice in range(len(ondisk_access.meta_data_index)):
+        for ondisk_array, array in zip(ondisk_access._load_spectrum_arrays(spec_indice), data_access._load_spectrum_arrays(spec_indice)):
+            np.testing.assert_array_equal(ondisk_array, array)
+
+    feature_df = data_access.reduce_spectra(synthetic_im_feature, synthetic_im_config).feature_df
+    assert feature_df.shape[0] > 0
+    pd.testing.assert_frame_equal(feature_df, ondisk_access.reduce_spectra(synthetic_im_feature, synthetic_im_config).feature_df)
+    for chrom, ondisk_chrom in zip(data_access.extract_chromatograms(synthetic_im_feature, synthetic_im_config).transitionData, ondisk_access.extract_chromatograms(synthetic_im_feature, synthetic_im_config).transitionData):
+        np.testing.assert_array_equal(chrom.intensity, ondisk_chrom.intensity)
+
+def test_columnar_store(synthetic_im_mzml, synthetic_im_feature, synthetic_im_config):
+    ondisk_access = MzMLDataAccess(synthetic_im_mzml, readOptions='ondisk')
+    columnar_access = MzMLDataAccess(synthetic_im_mzml, readOptions='columnar')
+    assert os.path.isdir(columnar_access.get_columnar_store_path())
+
+    # ion mobility window bounds on peaks, only the ion mobility slice of a spectrum is read
+    im_array = ondisk_access._load_spectrum_arrays(1)[2]
+    synthetic_im_config.im_start, synthetic_im_config.im_end = float(np.sort(im_array)[10]), float(np.sort(im_array)[20])
+    assert columnar_access._load_spectrum_arrays(1, columnar_access._get_feature_im_window(synthetic_im_feature, synthetic_im_config))[0].shape[0] < im_array.shape[0]
+    pd.testing.assert_frame_equal(columnar_access.reduce_spectra(synthetic_im_feature, synthetic_im_config).feature_df, ondisk_access.reduce_spectra(synthetic_im_feature, synthetic_im_config).feature_df)
+
+    # reopening the file memory maps the existing store
+    assert columnar_access.load_columnar_store() is not None
+    np.testing.assert_array_equal(MzMLDataAccess(synthetic_im_mzml, readOptions='columnar').meta_data_index.rt, ondisk_access.meta_data_index.rt)
+
+    # a modified file invalidates the store
+    append_spectrum(synthetic_im_mzml)
+    assert columnar_access.load_columnar_store() is None
+    assert len(MzMLDataAccess(synthetic_im_mzml, readOptions='columnar').columnar_store) == 31
+
+def test_cached(synthetic_im_mzml, synthetic_im_feature, synthetic_im_config, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    ondisk_access = MzMLDataAccess(synthetic_im_mzml, readOptions='ondisk')
+    cached_access = MzMLDataAccess(synthetic_im_mzml, readOptions='cached', cache_dir=cache_dir)
+    assert os.path.isfile(cached_access.get_cached_mzml_path())
+    assert os.path.isfile(f"{cached_access.get_cached_mzml_path()}.cached")
+
+    # reopening the file loads the existing cached file together with its spectrum meta data index
+    cached_mzml, meta_data_index = cached_access.load_cached_mzml()
+    assert cached_mzml is not None
+    np.testing.assert_array_equal(meta_data_index.rt, ondisk_access.meta_data_index.rt)
+
+    # a cached mzML file can also be opened directly
+    direct_access = MzMLDataAccess(cached_access.get_cached_mzml_path(), readOptions='cached')
+    assert direct_access.has_im
+    pd.testing.assert_frame_equal(direct_access.reduce_spectra(synthetic_im_feature, synthetic_im_config).feature_df, ondisk_access.reduce_spectra(synthetic_im_feature, synthetic_im_config).feature_df)
+
+    # a modified file invalidates the cached file
+    append_spectrum(synthetic_im_mzml)
+    assert cached_access.load_cached_mzml() == (None, None)
+    assert MzMLDataAccess(synthetic_im_mzml, readOptions='cached', cache_dir=cache_dir).exp.getNrSpectra() == 31
+
+def test_hot(synthetic_im_mzml):
+    hot_access = MzMLDataAccess(synthetic_im_mzml, readOptions='hot')
+    # the peaks are held in memory, nothing is written next to the mzML file
+    assert hot_access.columnar_store.path is None
+    assert not os.path.isdir(hot_access.get_columnar_store_path())
+
+    # a run exceeding the memory budget is read on disk
+    assert MzMLDataAccess(synthetic_im_mzml, readOptions='hot', hot_memory_budget=1000).readOptions == 'ondisk'
+
+def test_get_worker_data_access(tmp_path):
+    exp = po.MSExperiment()
+    for i in range(3):
+        spec = po.MSSpectrum()
+        spec.setRT(10.0 + i)
+        spec.setMSLevel(1)
+        spec.set_peaks(([100.0, 200.0], [1.0, 2.0]))
+        exp.addSpectrum(spec)
+    mzml_file = str(tmp_path / 'worker.mzML')
+    po.MzMLFile().store(mzml_file, exp)
+
+    data_access = _get_worker_data_access(mzml_file, 'ondisk')
+    assert _get_worker_data_access(mzml_file, 'ondisk') is data_access
+    # the worker builds the spectrum meta data index itself
+    np.testing.assert_array_equal(data_access.meta_data_index.rt, MzMLDataAccess(mzml_file, readOptions='ondisk').meta_data_index.rt)
+
+    # a rewritten file is opened again and the stale data access is dropped
+    exp.addSpectrum(exp.getSpectrum(0))
+    po.MzMLFile().store(mzml_file, exp)
+    rewritten_access = _get_worker_data_access(mzml_file, 'ondisk')
+    assert rewritten_access is not data_access
+    assert len(rewritten_access.meta_data_index) == 4
+    assert data_access not in _WORKER_DATA_ACCESS.values()
+
 @pytest.mark.parametrize("mz,expected_annot", [(150.01, 'b5^2'), (249.99, 'y5^2')])
 def test_find_closest_reference_mz(reference_mz_values, peptide_product_annotation_list, mz, expected_annot):
-    closest_mz_annot = MzMLDataAccess._find_closest_reference_mz(mz, reference_mz_values, peptide_product_annotation_list)
-    assert expected_annot == closest_mz_annot
+    closest_mz_annot = MzMLDataAccess._find_closest_reference_annotations(np.array([mz]), reference_mz_values, peptide_product_annotation_list)
+    assert [expected_annot] == list(closest_mz_annot)
+
+def test_find_closest_reference_annotations(reference_mz_values, peptide_product_annotation_list):
+    # includes values below/above all references and ties between two references
+    mz = np.array([50.0, 150.01, 249.99, 125.0, 175.0, 300.0, 1000.0])
+    closest_mz_annot = MzMLDataAccess._find_closest_reference_annotations(mz, reference_mz_values, peptide_product_annotation_list)
+    expected_annot = [peptide_product_annotation_list[np.argmin(np.abs(reference_mz_values - m))] for m in mz]
+    np.testing.assert_array_equal(closest_mz_annot, expected_annot)
 
 @pytest.mark.parametrize("level,mz,expected_annot", [(1, 100, 'prec'), (2, 200.01, 'y4^1'), (2, 299.89, 'y6^2')])
-def test_apply_mz_mapping(reference_mz_values, peptide_product_annotation_list, level, mz, expected_annot):
-    row = pd.Series(dict(mz=mz, ms_level=level))
-    result = MzMLDataAccess._apply_mz_mapping(row, reference_mz_values, peptide_product_annotation_list)
-    assert expected_annot == result
\ No newline at end of file
+def test_annotateFeatureDf(reference_mz_values, peptide_product_annotation_list, level, mz, expected_annot):
+    feature = TransitionGroupFeature(consensusApex=25.0, leftBoundary=20.0, rightBoundary=30.0, precursor_mz=410.0, precursor_charge=2,
+                                     product_mz=list(reference_mz_values), product_annotations=list(peptide_product_annotation_list), sequence='PEPTIDE')
+    result = MzMLDataAccess._annotateFeatureDf(pd.DataFrame(dict(mz=[mz], ms_level=[level])), feature)
+    assert expected_annot == result['Annotation'].iloc[0]
+    with pytest.raises(ValueError):
+        MzMLDataAccess._annotateFeatureDf(pd.DataFrame(dict(mz=[mz], ms_level=[3])), feature)
@@ -0,0 +1,52 @@
+"""
+test/loaders/access/test_NumpressDecoder
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+
+import base64
+import pytest
+import numpy as np
+import pyopenms as po
+
+from massdash.loaders.access.NumpressDecoder import NumpressDecoder
+
+def encode(values, compression):
+    config = po.NumpressConfig()
+    config.setCompression(compression)
+    config.estimate_fixed_point = True
+    result = po.String()
+    po.MSNumpressCoder().encodeNP(list(map(float, values)), result, False, config)
+    return base64.b64decode(str(result))
+
+def decode(raw, compression):
+    config = po.NumpressConfig()
+    config.setCompression(compression)
+    result = []
+    po.MSNumpressCoder().decodeNP(base64.b64encode(raw), result, False, config)
+    return np.array(result)
+
+def arrays(n_arrays):
+    rng = np.random.default_rng(0)
+    values = [[1.0], [1.0, 2.0], [1.0, 2.0, 3.0], [5.0, 1.0, 100.0, 3.0, 7.5]]
+    while len(values) < n_arrays:
+        n = int(rng.integers(3, 300))
+        values.append([np.sort(rng.uniform(0, 6000, n)), rng.uniform(0, 1e6, n), rng.exponential(1e3, n) * (rng.random(n) < 0.5)][len(values) % 3])
+    return values
+
+# fewer arrays than NumpressDecoder.FRONTIER_MIN_REGIONS are decoded by pointer doubling
+@pytest.mark.parametrize("n_arrays", [1, 10, 100])
+def test_decode_linear(n_arrays):
+    raw = [encode(values, 'linear') for values in arrays(n_arrays)]
+    for decoded, r in zip(NumpressDecoder.decode_linear(raw), raw):
+        np.testing.assert_array_equal(decoded, decode(r, 'linear'))
+
+@pytest.mark.parametrize("n_arrays", [1, 100])
+def test_decode_slof(n_arrays):
+    raw = [encode(values, 'slof') for values in arrays(n_arrays)]
+    for decoded, r in zip(NumpressDecoder.decode_slof(raw), raw):
+        np.testing.assert_allclose(decoded, decode(r, 'slof'), rtol=1e-12)
+
+def test_decode_empty():
+    assert NumpressDecoder.decode_linear([]) == []
+    assert NumpressDecoder.decode_slof([]) == []
+    assert [d.shape[0] for d in NumpressDecoder.decode_linear([b'', encode([1.0, 2.0, 3.0], 'linear')])] == [0, 3]
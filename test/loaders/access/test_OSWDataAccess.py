@@ -66,6 +66,20 @@ def test_getTransitionIDAnnotationFromSequence(osw_data_access, snapshot_pandas,
     transition_group_feature = osw_data_access.getTransitionIDAnnotationFromSequence(fullpeptidename, charge)
     assert snapshot_pandas == transition_group_feature 
 
+def test_getTransitionIDAnnotationFromPrecursorIds(osw_data_access2):
+    transitions = osw_data_access2.getTransitionIDAnnotationFromPrecursorIds([11881, 3348, 11881, -1])
+    # the requested precursors are looked up in the file, the peptide hash table is not read
+    assert 'peptideHash' not in vars(osw_data_access2)
+    assert list(transitions.columns) == ['PRECURSOR_ID', 'TRANSITION_ID', 'ANNOTATION', 'MODIFIED_SEQUENCE', 'PRECURSOR_CHARGE']
+    assert sorted(set(transitions['PRECURSOR_ID'])) == [3348, 11881]
+    reference = osw_data_access2.getTransitionIDAnnotationFromSequence('AGAANIVPNSTGAAK', 3)
+    precursor = transitions[transitions['PRECURSOR_ID'] == 11881]
+    assert list(precursor['TRANSITION_ID']) == sorted(reference['TRANSITION_ID'])
+    assert set(precursor['MODIFIED_SEQUENCE']) == {'AGAANIVPNSTGAAK'} and set(precursor['PRECURSOR_CHARGE']) == {3}
+    all_transitions = osw_data_access2.getTransitionIDAnnotationFromPrecursorIds()
+    assert all_transitions[all_transitions['PRECURSOR_ID'].isin([3348, 11881])].reset_index(drop=True).equals(transitions)
+    assert len(osw_data_access2.getTransitionIDAnnotationFromPrecursorIds([])) == 0
+
 @pytest.mark.parametrize("fullpeptidename,charge", [("AFVDFLSDEIK", 2), ("INVALID", 0)])
 def test_getPrecursorIDFromPeptideAndCharge(osw_data_access, snapshot, fullpeptidename, charge):
     precursor_id = osw_data_access.getPrecursorIDFromPeptideAndCharge(fullpeptidename, charge)
@@ -82,6 +96,12 @@ def test_getTransitionGroupFeaturesDf(osw_data_access, snapshot_pandas, run, ful
     transition_group_feature = osw_data_access.getTransitionGroupFeaturesDf(run, fullpeptidename, charge)
     assert snapshot_pandas == transition_group_feature
 
+def test_getTopTransitionGroupFeaturesOfRun(osw_data_access2):
+    features = osw_data_access2.getTopTransitionGroupFeaturesOfRun('test_raw_1')
+    assert ('AGAANIVPNSTGAAK', 3) in features
+    for (fullpeptidename, charge), feature in features.items():
+        assert vars(feature) == vars(osw_data_access2.getTopTransitionGroupFeature('test_raw_1', fullpeptidename, charge))
+
 def test_getRunNames(osw_data_access, snapshot):
     runnames = osw_data_access.getRunNames()
     assert snapshot == runnames 
@@ -121,6 +141,15 @@ def test_getExperimentSummary(osw_data_access, snapshot_pandas):
     experiment_summary = osw_data_access.getExperimentSummary()
     assert snapshot_pandas == experiment_summary
 
+def test_lazy_hashtables(osw_data_access2):
+    # the hash tables are read on first use only
+    hashtables = ['peptideHash', 'runHashTable', 'validScores', 'featureScoreHash']
+    assert not any(h in vars(osw_data_access2) for h in hashtables)
+    assert sorted(osw_data_access2.getRunNames()) == ['test_raw_1', 'test_raw_2']
+    assert 'runHashTable' in vars(osw_data_access2) and 'featureScoreHash' not in vars(osw_data_access2)
+    featureScoreHash = osw_data_access2.featureScoreHash
+    assert osw_data_access2.featureScoreHash is featureScoreHash
+
 def test_initializeValidScores(osw_data_access2, snapshot):
     # Open test.osw file because has full .osw output unlike ion mobility
     osw_data_access2._initializeValidScores()
@@ -0,0 +1,71 @@
+"""
+test/loaders/access/test_OSWIndexer
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+
+import os
+import shutil
+import sqlite3
+import pytest
+from pathlib import Path
+
+from massdash.loaders.access import OSWDataAccess, OSWIndexer
+from massdash.util import find_git_directory
+
+TEST_PATH = find_git_directory(Path(__file__).resolve()).parent / 'test'
+
+@pytest.fixture
+def osw_file(tmp_path):
+    osw_file = str(tmp_path / 'test.osw')
+    shutil.copy(TEST_PATH / 'test_data' / 'example_dia' / 'openswath' / 'osw' / 'test.osw', osw_file)
+    return osw_file
+
+def test_build(osw_file):
+    with open(osw_file, 'rb') as f:
+        original = f.read()
+    assert OSWIndexer.get_index_file(osw_file) is None
+
+    indexer = OSWIndexer(osw_file)
+    assert indexer.build() == OSWIndexer.get_index_file(osw_file) == f"{osw_file}.massdash-index.osw"
+    # the OSW file is not changed
+    with open(osw_file, 'rb') as f:
+        assert f.read() == original
+    conn = sqlite3.connect(indexer.index_file)
+    indices = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+    conn.close()
+    assert 'idx_massdash_feature_precursor_run' in indices
+    # there is no SCORE_IPF table in the file
+    assert 'idx_massdash_score_ipf_feature' not in indices
+
+def test_build_error(osw_file, monkeypatch):
+    # an index of a missing table fails the build, the partially built copy is removed
+    monkeypatch.setattr(OSWIndexer, '_getIndices', lambda self, conn: {'idx_massdash_missing': ('MISSING', ['ID'])})
+    with pytest.raises(sqlite3.OperationalError):
+        OSWIndexer(osw_file).build()
+    assert OSWIndexer.get_index_file(osw_file) is None
+    assert os.listdir(os.path.dirname(osw_file)) == ['test.osw']
+
+def test_report(osw_file):
+    indexer = OSWIndexer(osw_file)
+    indexer.build()
+    report = indexer.report(repeats=1)
+    assert list(report['query']) == list(OSWIndexer.QUERIES.keys())
+    assert (report[['time_before', 'time_after']] > 0).all().all()
+    plan = report.set_index('query').loc['features of a precursor', 'plan_after']
+    assert 'USING COVERING INDEX idx_massdash_feature_precursor_run' in plan
+
+def test_OSWDataAccess(osw_file):
+    reference = OSWDataAccess(osw_file)
+    assert reference.indexFile is None
+    OSWIndexer(osw_file).build()
+    osw_data_access = OSWDataAccess(osw_file)
+    assert osw_data_access.indexFile == OSWIndexer(osw_file).index_file
+    assert osw_data_access.getTransitionGroupFeaturesDf('test_raw_1', 'AGAANIVPNSTGAAK', 3).equals(reference.getTransitionGroupFeaturesDf('test_raw_1', 'AGAANIVPNSTGAAK', 3))
+
+    # the index is not used once the OSW file changes
+    conn = sqlite3.connect(osw_file)
+    conn.execute("CREATE TABLE TEST (ID INTEGER)")
+    conn.commit()
+    conn.close()
+    assert OSWIndexer.get_index_file(osw_file) is None
+    assert OSWDataAccess(osw_file).indexFile is None
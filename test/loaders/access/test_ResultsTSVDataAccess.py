@@ -68,6 +68,14 @@ def test_getTopTransitionGroupFeature(access, runname, peptide, charge, snapshot
     feature = access.getTopTransitionGroupFeature(runname, peptide, charge)
     assert snapshot == AmberDataSerializer.object_as_named_tuple(feature)
 
+@pytest.mark.parametrize("access", ['diann'], indirect=['access'])
+def test_getTopTransitionGroupFeaturesOfRun(access, runname):
+    features = access.getTopTransitionGroupFeaturesOfRun(runname)
+    assert ('DYASIDAAPEER', 2) in features
+    for (peptide, charge), feature in features.items():
+        assert str(vars(feature)) == str(vars(access.getTopTransitionGroupFeature(runname, peptide, charge)))
+    assert access.getTopTransitionGroupFeaturesOfRun('missing') == {}
+
 @pytest.mark.parametrize("access,runname,peptide,charge", [('diann', 'test_raw_1', 'DYASIDAAPEER', 2),], indirect=['access'])
 def test_getTransitionGroupFeatures(access, runname, peptide, charge, snapshot):
     features = access.getTransitionGroupFeatures(runname, peptide, charge)
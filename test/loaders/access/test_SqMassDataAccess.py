@@ -6,8 +6,13 @@ test/loaders/access/test_SqMassDataAccess
 import pytest
 from pathlib import Path
 import pandas as pd
+import numpy as np
+import zlib
+import sqlite3
 
+from massdash.loaders.access.ChromatogramCache import ChromatogramCache
 from massdash.loaders.access.SqMassDataAccess import SqMassDataAccess
+from massdash.structs import Chromatogram
 from massdash.testing import PandasSnapshotExtension
 from massdash.util import find_git_directory
 
@@ -16,7 +21,8 @@ TEST_PATH = find_git_directory(Path(__file__).resolve()).parent / 'test'
 @pytest.fixture
 def mass_data_access():
     db_path = f"{str(TEST_PATH)}/test_data/xics/test_chrom_1.sqMass"
-    mass_data_access = SqMassDataAccess(db_path)
+    # a cache of its own, so that the chromatograms read by other tests are not cached
+    mass_data_access = SqMassDataAccess(db_path, cache=ChromatogramCache())
     yield mass_data_access
     mass_data_access.conn.close()
 
@@ -30,6 +36,69 @@ def test_getPrecursorChromIDs(mass_data_access, snapshot):
     chrom_ids = mass_data_access.getPrecursorChromIDs(precursor_id)
     assert snapshot == chrom_ids
 
+def test_getChromIDsFromNativeIds(mass_data_access):
+    assert mass_data_access._nativeIdMap is None
+    chrom_ids = mass_data_access.getChromIDsFromNativeIds([180, '181', "'182'", 'missing'])
+    assert chrom_ids == [row[0] for row in mass_data_access.conn.execute("SELECT ID FROM CHROMATOGRAM WHERE NATIVE_ID IN ('180', '181', '182') ORDER BY NATIVE_ID")]
+    # the native IDs are read once per file
+    assert mass_data_access._nativeIdMap is not None
+    assert mass_data_access.getPrecursorChromIDs('30')['native_ids'] == ['30_Precursor_i0']
+    assert mass_data_access.getPrecursorChromIDs('missing') == {'chrom_ids': [], 'native_ids': []}
+
+def test_getTransitionGroups(mass_data_access):
+    transitions = pd.DataFrame({'PRECURSOR_ID': [30, 30, 31, -1],
+                                'TRANSITION_ID': [180, 181, 'missing', 'missing'],
+                                'ANNOTATION': ['y4^1', 'y5^1', 'b3^1', 'b4^1']})
+    transitionGroups = mass_data_access.getTransitionGroups(transitions)
+    # precursors without chromatograms are skipped
+    assert 30 in transitionGroups.keys() and -1 not in transitionGroups.keys()
+    prec_chrom_ids = mass_data_access.getPrecursorChromIDs(30)
+    reference = mass_data_access.getDataForChromatograms(prec_chrom_ids['chrom_ids'], prec_chrom_ids['native_ids'])
+    reference += [mass_data_access.getDataForChromatogram(myid, label) for myid, label in zip(mass_data_access.getChromIDsFromNativeIds([180, 181]), ['y4^1', 'y5^1'])]
+    transitionGroup = transitionGroups[30]
+    assert [chrom.label for chrom in transitionGroup.precursorData + transitionGroup.transitionData] == [chrom.label for chrom in reference]
+    for chrom, referenceChrom in zip(transitionGroup.precursorData + transitionGroup.transitionData, reference):
+        np.testing.assert_array_equal(chrom.data, referenceChrom.data)
+        np.testing.assert_array_equal(chrom.intensity, referenceChrom.intensity)
+    # the temporary table of the query is left empty
+    assert mass_data_access.conn.execute("SELECT COUNT(*) FROM temp.QUERY_CHROMATOGRAM").fetchone() == (0,)
+
+def test_cache(mass_data_access):
+    cache = mass_data_access.cache
+    data = mass_data_access.getDataForChromatograms([41353, 41354], ["y4^1", "y3^1"])
+    assert (cache.hits, cache.misses, len(cache)) == (0, 2, 2)
+    assert cache.size == sum(d.data.nbytes + d.intensity.nbytes for d in data)
+
+    # the cached chromatograms are not read from the file again
+    mass_data_access.close()
+    cached = mass_data_access.getDataForChromatograms([41353, 41354], ["y4^1", "y3^1"])
+    assert (cache.hits, cache.misses) == (2, 2)
+    for chrom, cachedChrom in zip(data, cached):
+        np.testing.assert_array_equal(chrom.intensity, cachedChrom.intensity)
+        assert not cachedChrom.intensity.flags.writeable
+
+    # the least recently used chromatogram is evicted
+    cache.max_size = cache.size
+    mass_data_access.getDataForChromatogram(41354, "y3^1")
+    cache.put('other', np.zeros(1), np.zeros(1))
+    assert cache.get((mass_data_access._cacheKey, 41353)) is None
+    assert cache.get((mass_data_access._cacheKey, 41354)) is not None
+    assert cache.size <= cache.max_size
+
+def test_readonly(mass_data_access):
+    assert mass_data_access.conn.execute("PRAGMA temp_store").fetchone() == (2,)
+    assert mass_data_access.conn.execute("PRAGMA cache_size").fetchone()[0] < 0
+    # the file is never written
+    with pytest.raises(sqlite3.OperationalError):
+        mass_data_access.conn.execute("CREATE TABLE TEST (ID INTEGER)")
+    # a file written by OpenSwath may be written while it is open, it is not opened immutable
+    assert not mass_data_access.immutable
+
+def test_missing_file(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        SqMassDataAccess(str(tmp_path / 'missing.sqMass'))
+    assert not (tmp_path / 'missing.sqMass').exists()
+
 def test_getDataForChromatograms(mass_data_access, snapshot_pandas):
     ids = [41353, 41354, 41387]
     annots = ["y4^1", "y3^1", "y6^1"]
@@ -59,6 +128,16 @@ def test_getDataForChromatogramsFromNativeIds(mass_data_access, snapshot_pandas)
     data_out = pd.concat([d.toPandasDf() for d in data])
     assert snapshot_pandas == data_out
 
+def test_getDataForChromatogramsLabels(mass_data_access):
+    # the labels are matched in the order of the requested IDs, missing IDs are skipped with their labels
+    native_ids = [185, 'missing', 180, 183, 183]
+    data = mass_data_access.getDataForChromatogramsFromNativeIds(native_ids, ['a', 'b', 'c', 'd', 'e'])
+    assert [chrom.label for chrom in data] == ['a', 'c', 'd']
+    for chrom, native_id in zip(data, [185, 180, 183]):
+        assert np.array_equal(chrom.intensity, mass_data_access.getDataForChromatogramFromNativeId(native_id)[1])
+    chrom_ids = mass_data_access.getChromIDsFromNativeIds([185, 180])
+    assert [chrom.label for chrom in mass_data_access.getDataForChromatograms(chrom_ids, ['a', 'b'])] == ['a', 'b']
+
 @pytest.mark.parametrize("ids,labels", [([41353, 41354, 41387], ["y4^1", "y3^1", "y6^1"]), ([0], ["y4^1"]), ([], ["y4^1"])])
 def test_getDataForChromatogramsDf(mass_data_access, snapshot_pandas, ids, labels):
     # Assuming you have some data to test this method
@@ -69,4 +148,14 @@ def test_getDataForChromatogramsFromNativeIdsDf(mass_data_access, snapshot_panda
     ids = [180, 181, 182, 183, 183, 185]
     labels = ["y4^1", "y3^1", "y6^1", "y7^1", "y7^1", "y8^1"]
     data = mass_data_access.getDataForChromatogramsFromNativeIdsDf(ids, labels)
-    assert snapshot_pandas == data
\ No newline at end of file
+    assert snapshot_pandas == data
+
+def test_decodeData():
+    values = np.array([1.0, 2.5, 3.0])
+    for compr, blob in [(0, values.astype('<f8').tobytes()), (1, zlib.compress(values.astype('<f8').tobytes()))]:
+        decoded = SqMassDataAccess._decodeData(compr, blob)
+        assert isinstance(decoded, np.ndarray)
+        np.testing.assert_array_equal(decoded, values)
+        # chromatograms wrap the decoded arrays without a copy
+        assert np.shares_memory(Chromatogram(decoded, decoded).intensity, decoded)
+    assert SqMassDataAccess._decodeData(1, zlib.compress(b'')).tolist() == [0]
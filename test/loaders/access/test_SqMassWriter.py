@@ -0,0 +1,78 @@
+"""
+test/loaders/access/test_SqMassWriter
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+
+import os
+import sqlite3
+import pytest
+import numpy as np
+
+from massdash.loaders.access.SqMassWriter import SqMassWriter
+from massdash.loaders.access.SqMassDataAccess import SqMassDataAccess
+from massdash.structs import Chromatogram
+
+@pytest.fixture
+def chromatogram():
+    return Chromatogram(np.array([10.0, 11.5, 13.0]), np.array([0.0, 5.5, 2.0]), 'y3^1')
+
+@pytest.fixture
+def filename(tmp_path):
+    return str(tmp_path / 'run.sqMass')
+
+def test_write_and_read(filename, chromatogram):
+    with SqMassWriter(filename, 'run.mzML') as writer:
+        writer.add_chromatogram('1', chromatogram, 500.0, 300.0, 'PEPTIDE', 2)
+        writer.add_chromatogram('10_Precursor_i0', chromatogram, 500.0, None, 'PEPTIDE', 2)
+        writer.mark_extracted('10')
+        writer.commit()
+        assert os.path.isfile(writer.partial_filename)
+        assert not os.path.isfile(filename)
+        assert writer.finalize() == filename
+
+    assert os.path.isfile(filename)
+    assert not os.path.isfile(f"{filename}.partial")
+    with sqlite3.connect(filename) as conn:
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    assert 'MASSDASH_EXTRACTION' not in tables
+
+    data_access = SqMassDataAccess(filename)
+    # a completed file is not written again, it is opened immutable
+    assert data_access.immutable
+    assert data_access.getPrecursorChromIDs('10')['chrom_ids'] == [1]
+    rt, intensity = data_access.getDataForChromatogramFromNativeId("'1'")
+    np.testing.assert_array_equal(rt, chromatogram.data)
+    np.testing.assert_array_equal(intensity, chromatogram.intensity)
+
+def test_resume(filename, chromatogram):
+    writer = SqMassWriter(filename, 'run.mzML', fingerprint='a')
+    writer.add_chromatogram('1', chromatogram, 500.0, 300.0, 'PEPTIDE', 2)
+    writer.mark_extracted('10')
+    writer.commit()
+    # uncommitted chromatograms are discarded
+    writer.add_chromatogram('2', chromatogram, 600.0, 300.0, 'PEPTIDEK', 2)
+    writer.mark_extracted('20')
+    # a file being written is not opened immutable
+    assert not SqMassDataAccess(writer.partial_filename).immutable
+    writer.close()
+
+    with SqMassWriter(filename, 'run.mzML', fingerprint='a') as writer:
+        assert writer.get_extracted_precursors() == {'10'}
+        writer.add_chromatogram('2', chromatogram, 600.0, 300.0, 'PEPTIDEK', 2)
+        writer.mark_extracted('20')
+        writer.commit()
+        writer.finalize()
+
+    with sqlite3.connect(filename) as conn:
+        assert list(conn.execute("SELECT ID, NATIVE_ID FROM CHROMATOGRAM ORDER BY ID")) == [(0, '1'), (1, '2')]
+        assert conn.execute("SELECT COUNT(*) FROM RUN").fetchone()[0] == 1
+
+def test_restart_on_changed_fingerprint(filename, chromatogram):
+    with SqMassWriter(filename, 'run.mzML', fingerprint='a') as writer:
+        writer.add_chromatogram('1', chromatogram, 500.0, 300.0, 'PEPTIDE', 2)
+        writer.mark_extracted('10')
+        writer.commit()
+
+    with SqMassWriter(filename, 'run.mzML', fingerprint='b') as writer:
+        assert writer.get_extracted_precursors() == set()
+        assert writer.conn.execute("SELECT COUNT(*) FROM CHROMATOGRAM").fetchone()[0] == 0
@@ -5,6 +5,7 @@ test/loaders/test_MzMLDataLoader
 
 from pathlib import Path
 import pytest
+import numpy as np
 import pandas as pd
 import pyopenms as po
 
@@ -56,6 +57,13 @@ def mzml_data_loader(request, mzml_files):
 
     return MzMLDataLoader(rsltsFile=rsltsFile, dataFiles=mzml_files, libraryFile=libFile, verbose=False, mode='module')
 
+@pytest.fixture
+def osw_loader(mzml_files):
+    # factory of loaders extracting the test runs with the features of the OpenSWATH results
+    def make_loader(**kwargs):
+        return MzMLDataLoader(rsltsFile=f'{TEST_PATH}/test_data/example_dia/openswath/osw/test.osw', dataFiles=mzml_files, libraryFile=None, verbose=False, mode='module', **kwargs)
+    return make_loader
+
 def test_init_error():
     # if library file is not provided, an error should be raised when only DIA-NN report files are supplied
     with pytest.raises(ValueError):
@@ -81,4 +89,74 @@ def test_loadFeatureMaps(mzml_data_loader, config, pep, charge, runNames, snapsh
     feature_maps = mzml_data_loader.loadFeatureMaps(pep, charge, config, runNames=runNames)
     
     # note: only checking data not metadata like peptide sequence, charge and filename
-    assert snapshot_pandas == pd.concat([ f.feature_df for f in feature_maps.values()])
\ No newline at end of file
+    assert snapshot_pandas == pd.concat([ f.feature_df for f in feature_maps.values()])
+
+@pytest.mark.parametrize('pep,charge', [('DYASIDAAPEER', 2)])
+def test_loadFeatureMaps_threads(osw_loader, config, pep, charge):
+    sequential = osw_loader(threads=1).loadFeatureMaps(pep, charge, config)
+    parallel = osw_loader(threads=2).loadFeatureMaps(pep, charge, config)
+
+    assert list(sequential.keys()) == list(parallel.keys())
+    for run in sequential.keys():
+        pd.testing.assert_frame_equal(sequential[run].feature_df, parallel[run].feature_df)
+
+@pytest.mark.parametrize('pep,charge', [('DYASIDAAPEER', 2)])
+def test_loadFeatureMaps_cache(mzml_files, osw_loader, config, pep, charge, tmp_path):
+    uncached = osw_loader().loadFeatureMaps(pep, charge, config)
+    cached_loader = osw_loader(featureMapCache=str(tmp_path))
+
+    # the first call fills the cache, the second call reads from it
+    for _ in range(2):
+        cached = cached_loader.loadFeatureMaps(pep, charge, config)
+        assert list(uncached.keys()) == list(cached.keys())
+        for run in uncached.keys():
+            pd.testing.assert_frame_equal(uncached[run].feature_df, cached[run].feature_df)
+    assert len(list(tmp_path.glob('*.npz'))) == len(mzml_files)
+
+@pytest.mark.parametrize('threads', [1, 2])
+def test_readOptions_per_run(osw_loader, config, threads, tmp_path):
+    ondisk = osw_loader().loadFeatureMaps('DYASIDAAPEER', 2, config)
+    loader = osw_loader(threads=threads, readOptions={'test_raw_1': 'cached'}, cachedMzMLDir=str(tmp_path))
+    assert [d.readOptions for d in loader.dataAccess] == ['cached', 'ondisk']
+    assert len(list(tmp_path.glob('test_raw_1-*.mzML.cached'))) == 1
+
+    mixed = loader.loadFeatureMaps('DYASIDAAPEER', 2, config)
+    assert list(ondisk.keys()) == list(mixed.keys())
+    for run in ondisk.keys():
+        pd.testing.assert_frame_equal(ondisk[run].feature_df, mixed[run].feature_df)
+
+@pytest.mark.parametrize('threads', [1, 2])
+def test_iterFeatureMaps(mzml_files, osw_loader, config, threads):
+    loader = osw_loader(threads=threads)
+    precursors = [('DYASIDAAPEER', 2), ('AGAANIVPNSTGAAK', 3), ('INVALID', 0)]
+
+    # the precursors are extracted in batches, every run and precursor is yielded once
+    results = list(loader.iterFeatureMaps((p for p in precursors), config, batch_size=2))
+    assert sorted((pep, charge, run) for run, pep, charge, _ in results) == sorted((pep, charge, run) for pep, charge in precursors for run in loader.runNames)
+    # the precursors of a batch are yielded before the precursors of the next batch
+    assert {(pep, charge) for _, pep, charge, _ in results[-len(mzml_files):]} == {precursors[-1]}
+    for pep, charge in precursors:
+        feature_maps = loader.loadFeatureMaps(pep, charge, config)
+        streamed = {run: feature_map for run, p, c, feature_map in results if (p, c) == (pep, charge)}
+        assert set(streamed.keys()) == set(feature_maps.keys())
+        for run in feature_maps.keys():
+            pd.testing.assert_frame_equal(streamed[run].feature_df, feature_maps[run].feature_df)
+
+    transition_groups = list(loader.iterTransitionGroups(precursors[:1], config))
+    assert len(transition_groups) == len(mzml_files)
+
+@pytest.mark.parametrize('threads', [1, 2])
+def test_loadTransitionGroups_chromatogramsOnly(mzml_files, osw_loader, config, threads):
+    loader = osw_loader(threads=threads)
+
+    groups = loader.loadTransitionGroups('DYASIDAAPEER', 2, config, chromatogramsOnly=True)
+    expected = loader.loadTransitionGroups('DYASIDAAPEER', 2, config)
+    assert list(groups.keys()) == list(expected.keys())
+    for run in expected.keys():
+        assert [chrom.label for chrom in groups[run].transitionData] == [chrom.label for chrom in expected[run].transitionData]
+        for chrom, expected_chrom in zip(groups[run].transitionData, expected[run].transitionData):
+            np.testing.assert_array_equal(chrom.data, expected_chrom.data)
+            np.testing.assert_allclose(chrom.intensity, expected_chrom.intensity, rtol=1e-5)
+
+    transition_groups = list(loader.iterTransitionGroups([('DYASIDAAPEER', 2), ('INVALID', 0)], config, chromatogramsOnly=True))
+    assert len(transition_groups) == 2 * len(mzml_files)
@@ -0,0 +1,110 @@
+"""
+test/loaders/test_SqMassExtractor
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+
+import os
+from pathlib import Path
+import pytest
+import pyopenms as po
+
+from massdash.loaders import SqMassExtractor, SqMassLoader
+from massdash.loaders.access import OSWDataAccess, SqMassWriter
+from massdash.structs import TargetedDIAConfig
+from massdash.util import find_git_directory
+
+TEST_PATH = find_git_directory(Path(__file__).resolve()).parent / 'test'
+
+@pytest.fixture(scope='session')
+def mzml_files():
+    # resave the experiment using pyopenms so do not have indexing problems with the os.
+    files = [Path('test_raw_1.mzML'), Path('test_raw_2.mzML')]
+    filePaths = [ str(TEST_PATH / 'test_data' / 'example_dia' / 'raw' / f) for f in files ]
+    for f in filePaths:
+        exp = po.MSExperiment()
+        po.MzMLFile().load(f, exp)
+        po.MzMLFile().store(f, exp)
+    return filePaths
+
+@pytest.fixture
+def osw_file():
+    return str(TEST_PATH / 'test_data' / 'example_dia' / 'openswath' / 'osw' / 'test.osw')
+
+@pytest.fixture
+def config():
+    c = TargetedDIAConfig()
+    c.im_window = None
+    c.rt_window = 5
+    return c
+
+@pytest.mark.parametrize('libraryFile', ['example_dia/openswath/lib/test.pqp', 'example_dia/openswath/osw/test.osw', 'library/ionMobilityTestLibrary.tsv'])
+def test_loadLibrary(libraryFile):
+    library = SqMassExtractor.loadLibrary(str(TEST_PATH / 'test_data' / libraryFile))
+    assert library['TransitionId'].is_unique
+    assert library.groupby('PrecursorId')['PrecursorMz'].nunique().eq(1).all()
+
+@pytest.mark.parametrize('threads', [1, 2])
+def test_extract(mzml_files, osw_file, config, tmp_path, threads):
+    extractor = SqMassExtractor(osw_file, osw_file, config)
+    sqMassFiles = extractor.extract(mzml_files, str(tmp_path), threads=threads)
+    assert sqMassFiles == [str(tmp_path / 'test_raw_1.sqMass'), str(tmp_path / 'test_raw_2.sqMass')]
+    assert all(os.path.isfile(f) for f in sqMassFiles)
+
+    # the sqMass files can be browsed like the files written by OpenSWATH
+    loader = SqMassLoader(dataFiles=sqMassFiles, rsltsFile=osw_file)
+    transitionGroups = loader.loadTransitionGroups('AGAANIVPNSTGAAK', 3)
+    assert len(transitionGroups['test_raw_1'].transitionData) > 0
+
+def test_extract_resume(mzml_files, osw_file, config, tmp_path, monkeypatch):
+    extractor = SqMassExtractor(osw_file, osw_file, config, batchSize=1)
+    outFile = SqMassExtractor.getOutputFile(mzml_files[0], str(tmp_path))
+
+    # interrupt the extraction after the first precursor
+    mark_extracted = SqMassWriter.mark_extracted
+    def interrupted_mark_extracted(writer, precursor_id):
+        if len(writer.get_extracted_precursors()) > 0:
+            raise KeyboardInterrupt
+        return mark_extracted(writer, precursor_id)
+    monkeypatch.setattr(SqMassWriter, 'mark_extracted', interrupted_mark_extracted)
+    with pytest.raises(KeyboardInterrupt):
+        extractor.extractRun(mzml_files[0], outFile)
+    assert not os.path.isfile(outFile)
+    assert os.path.isfile(f"{outFile}.partial")
+
+    monkeypatch.setattr(SqMassWriter, 'mark_extracted', mark_extracted)
+    extractor.extractRun(mzml_files[0], outFile)
+    extractor.extractRun(mzml_files[0], str(tmp_path / 'reference.sqMass'))
+
+    exp, reference = po.MSExperiment(), po.MSExperiment()
+    po.SqMassFile().load(outFile, exp)
+    po.SqMassFile().load(str(tmp_path / 'reference.sqMass'), reference)
+    assert [c.getNativeID() for c in exp.getChromatograms()] == [c.getNativeID() for c in reference.getChromatograms()]
+    assert [c.get_peaks()[1].tolist() for c in exp.getChromatograms()] == [c.get_peaks()[1].tolist() for c in reference.getChromatograms()]
+
+def test_extract_threads(mzml_files, osw_file, config, tmp_path):
+    # a single run with more threads than runs is split into blocks of spectra extracted in parallel
+    extractor = SqMassExtractor(osw_file, osw_file, config)
+    sequential = extractor.extract(mzml_files[0], str(tmp_path / 'sequential'), threads=1)[0]
+    parallel = extractor.extract(mzml_files[0], str(tmp_path / 'parallel'), threads=4)[0]
+
+    exp, reference = po.MSExperiment(), po.MSExperiment()
+    po.SqMassFile().load(parallel, exp)
+    po.SqMassFile().load(sequential, reference)
+    assert exp.getNrChromatograms() > 0
+    assert [c.getNativeID() for c in exp.getChromatograms()] == [c.getNativeID() for c in reference.getChromatograms()]
+    assert [c.get_peaks()[1].tolist() for c in exp.getChromatograms()] == [c.get_peaks()[1].tolist() for c in reference.getChromatograms()]
+
+def test_results_access_closed(mzml_files, osw_file, config, tmp_path, monkeypatch):
+    closed = []
+    close = OSWDataAccess.close
+    def recording_close(results_access):
+        closed.append(results_access)
+        close(results_access)
+    monkeypatch.setattr(OSWDataAccess, 'close', recording_close)
+
+    extractor = SqMassExtractor(osw_file, osw_file, config)
+    # a run missing from the results file
+    assert extractor._getResultsAccess('INVALID') is None
+    assert len(closed) == 1
+    extractor.extractRun(mzml_files[0], str(tmp_path / 'test_raw_1.sqMass'))
+    assert len(closed) == 2
@@ -4,10 +4,13 @@ test/loaders/test_SqMassLoader
 """
 
 import pytest
+import numpy as np
 from pathlib import Path
 from syrupy.extensions.amber import AmberDataSerializer
 
 from massdash.loaders import SqMassLoader
+from massdash.loaders.access import ChromatogramCache, SqMassWriter
+from massdash.structs import Chromatogram
 from massdash.util import find_git_directory
 from massdash.testing import PandasSnapshotExtension
 
@@ -58,4 +61,59 @@ def test_loadTransitionGroupsDf(loader, fullpeptidename, charge, snapshot_pandas
 def test_loadTransitionGroupFeaturesDf(loader, fullpeptidename, charge, snapshot_pandas):
     # Test loading a chromatogram for a valid peptide ID and charge
     transitionGroup = loader.loadTransitionGroupFeaturesDf(fullpeptidename, charge)
-    assert snapshot_pandas == transitionGroup
\ No newline at end of file
+    assert snapshot_pandas == transitionGroup
+
+@pytest.fixture
+def dataFiles(tmp_path):
+    # sqMass files with the chromatograms of a precursor of the osw file
+    rng = np.random.default_rng(0)
+    dataFiles = [str(tmp_path / f'run_{i}.sqMass') for i in range(4)]
+    for f in dataFiles:
+        with SqMassWriter(f, f) as writer:
+            for native_id in ['11881_Precursor_i0', '10151', '10152', '10153', '10154', '10155', '10156']:
+                writer.add_chromatogram(native_id, Chromatogram(np.arange(10.0), rng.uniform(0, 100, 10)))
+            writer.commit()
+            writer.finalize()
+    return dataFiles
+
+@pytest.mark.parametrize('threads', [1, 3])
+def test_loadTransitionGroups_threads(dataFiles, threads):
+    osw_file = str(TEST_PATH / 'openswath' / 'osw' / "test.osw")
+
+    loader = SqMassLoader(dataFiles=dataFiles, rsltsFile=osw_file, threads=threads)
+    reference = SqMassLoader(dataFiles=dataFiles, rsltsFile=osw_file)
+    transitionGroups = loader.loadTransitionGroups('AGAANIVPNSTGAAK', 3)
+    referenceGroups = reference.loadTransitionGroups('AGAANIVPNSTGAAK', 3)
+    # the runs are returned in order
+    assert list(transitionGroups.keys()) == [f'run_{i}' for i in range(4)]
+    for runName in referenceGroups.keys():
+        assert len(transitionGroups[runName].transitionData) == 6
+        for chrom, referenceChrom in zip(transitionGroups[runName].transitionData + transitionGroups[runName].precursorData,
+                                         referenceGroups[runName].transitionData + referenceGroups[runName].precursorData):
+            np.testing.assert_array_equal(chrom.intensity, referenceChrom.intensity)
+    assert loader.loadTransitionGroupsDf('AGAANIVPNSTGAAK', 3).equals(reference.loadTransitionGroupsDf('AGAANIVPNSTGAAK', 3))
+
+@pytest.mark.parametrize('precursor_ids', [[11881], None])
+def test_loadTransitionGroupsFromPrecursorIds(dataFiles, precursor_ids):
+    osw_file = str(TEST_PATH / 'openswath' / 'osw' / "test.osw")
+    loader = SqMassLoader(dataFiles=dataFiles, rsltsFile=osw_file)
+    transitionGroups = loader.loadTransitionGroupsFromPrecursorIds(precursor_ids, runNames=['run_1', 'run_3'])
+    referenceGroups = loader.loadTransitionGroups('AGAANIVPNSTGAAK', 3, runNames=['run_1', 'run_3'])
+    assert list(transitionGroups.keys()) == ['run_1', 'run_3']
+    for runName, referenceGroup in referenceGroups.items():
+        # only the precursor with chromatograms in the files is returned
+        assert list(transitionGroups[runName].keys()) == [11881]
+        transitionGroup = transitionGroups[runName][11881]
+        assert (transitionGroup.sequence, transitionGroup.precursor_charge) == ('AGAANIVPNSTGAAK', 3)
+        assert transitionGroup.toPandasDf().equals(referenceGroup.toPandasDf())
+
+def test_chromatogramCache(dataFiles):
+    osw_file = str(TEST_PATH / 'openswath' / 'osw' / "test.osw")
+    cache = ChromatogramCache()
+    transitionGroups = SqMassLoader(dataFiles=dataFiles, rsltsFile=osw_file, chromatogramCache=cache).loadTransitionGroups('AGAANIVPNSTGAAK', 3)
+    assert (cache.hits, cache.misses) == (0, 28)
+    # the cache is shared by the loaders of the same files
+    cachedGroups = SqMassLoader(dataFiles=dataFiles, rsltsFile=osw_file, chromatogramCache=cache).loadTransitionGroups('AGAANIVPNSTGAAK', 3)
+    assert (cache.hits, cache.misses) == (28, 28)
+    for runName, transitionGroup in transitionGroups.items():
+        assert transitionGroup.toPandasDf().equals(cachedGroups[runName].toPandasDf())
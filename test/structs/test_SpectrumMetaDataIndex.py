@@ -0,0 +1,104 @@
+"""
+test/structs/test_SpectrumMetaDataIndex
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+
+import os
+import tempfile
+import unittest
+import numpy as np
+import pyopenms as po
+from massdash.structs import SpectrumMetaDataIndex
+
+class TestSpectrumMetaDataIndex(unittest.TestCase):
+
+    def setUp(self):
+        # One MS1 spectrum followed by two MS2 spectra per cycle
+        self.meta_data = po.MSExperiment()
+        for i, (rt, ms_level, window) in enumerate([(10, 1, None), (11, 2, (400, 425)), (12, 2, (425, 450)),
+                                                    (20, 1, None), (21, 2, (400, 425)), (22, 2, (425, 450))]):
+            spec = po.MSSpectrum()
+            spec.setRT(rt)
+            spec.setMSLevel(ms_level)
+            if window is not None:
+                prec = po.Precursor()
+                prec.setMZ((window[0] + window[1]) / 2)
+                prec.setIsolationWindowLowerOffset((window[1] - window[0]) / 2)
+                prec.setIsolationWindowUpperOffset((window[1] - window[0]) / 2)
+                spec.setPrecursors([prec])
+            self.meta_data.addSpectrum(spec)
+        self.index = SpectrumMetaDataIndex.from_experiment(self.meta_data)
+
+    def test_from_experiment(self):
+        self.assertEqual(len(self.index), 6)
+        np.testing.assert_array_equal(self.index.rt, [10, 11, 12, 20, 21, 22])
+        np.testing.assert_array_equal(self.index.ms_level, [1, 2, 2, 1, 2, 2])
+        np.testing.assert_array_equal(self.index.isolation_lower, [np.nan, 400, 425, np.nan, 400, 425])
+        np.testing.assert_array_equal(self.index.isolation_upper, [np.nan, 425, 450, np.nan, 425, 450])
+        self.assertFalse(self.index.has_im)
+
+    def test_count_ms_level(self):
+        self.assertEqual(self.index.count_ms_level(1), 2)
+        self.assertEqual(self.index.count_ms_level(2), 4)
+
+    def test_get_ms_level_indices(self):
+        np.testing.assert_array_equal(self.index.get_ms_level_indices([1]), [0, 3])
+        np.testing.assert_array_equal(self.index.get_ms_level_indices([2]), [1, 2, 4, 5])
+        np.testing.assert_array_equal(self.index.get_ms_level_indices([1, 2]), np.arange(6))
+
+    def test_get_rt_window_indices(self):
+        # bounds are inclusive
+        np.testing.assert_array_equal(self.index.get_rt_window_indices(11, 21), [1, 2, 3, 4])
+        np.testing.assert_array_equal(self.index.get_rt_window_indices(11, 21, [2]), [1, 2, 4])
+        self.assertEqual(self.index.get_rt_window_indices(30, 40).shape[0], 0)
+
+        # spectra which are not sorted by RT
+        index = SpectrumMetaDataIndex(np.arange(4), [5, 1, 3, 2], [1, 1, 1, 1], [np.nan] * 4, [np.nan] * 4)
+        np.testing.assert_array_equal(index.get_rt_window_indices(1.5, 3), [2, 3])
+
+    def test_get_isolation_window_mask(self):
+        np.testing.assert_array_equal(self.index.get_isolation_window_mask(np.arange(6), 410), [False, True, False, False, True, False])
+        # bounds are exclusive
+        np.testing.assert_array_equal(self.index.get_isolation_window_mask(np.arange(6), 425), [False] * 6)
+
+    def test_isolation_windows(self):
+        np.testing.assert_array_equal(self.index.isolation_windows, [[400, 425], [425, 450]])
+        np.testing.assert_array_equal(self.index.get_isolation_window_indices(410), [0])
+        np.testing.assert_array_equal(self.index.get_isolation_window_indices(430), [1])
+        self.assertEqual(self.index.get_isolation_window_indices(425).shape[0], 0)
+        self.assertEqual(self.index.get_isolation_window_indices(1000).shape[0], 0)
+        np.testing.assert_array_equal(self.index.get_window_spectrum_indices(1), [2, 5])
+        np.testing.assert_array_equal(self.index.get_window_spectrum_indices(1, 0, 15), [2])
+
+    def test_get_target_spectrum_indices(self):
+        # overlapping and variable width isolation windows, spectra not sorted by RT
+        rng = np.random.default_rng(42)
+        windows = np.array([[400, 450], [440, 460], [455, 600], [300, 1000], [500, 510]])
+        n_spectra = 200
+        ms_level = rng.choice([1, 2], n_spectra)
+        window = rng.integers(0, windows.shape[0], n_spectra)
+        lower = np.where(ms_level == 2, windows[window, 0], np.nan)
+        upper = np.where(ms_level == 2, windows[window, 1], np.nan)
+        rt = rng.uniform(0, 100, n_spectra)
+        index = SpectrumMetaDataIndex(np.arange(n_spectra), rt, ms_level, lower, upper)
+
+        for precursor_mz in [350, 445, 455, 505, 2000]:
+            for mslevel in [[1], [2], [1, 2]]:
+                rt_spectra = index.get_rt_window_indices(20, 40, mslevel)
+                expected = rt_spectra[(index.ms_level[rt_spectra] == 1) | index.get_isolation_window_mask(rt_spectra, precursor_mz)]
+                np.testing.assert_array_equal(index.get_target_spectrum_indices(precursor_mz, 20, 40, mslevel), expected)
+
+    def test_save_load(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'index.npz')
+            self.index.save(path, {'size': 10, 'mtime': 20, 'hash': 'abc'})
+            index, fingerprint = SpectrumMetaDataIndex.load(path)
+        self.assertEqual(fingerprint, {'size': 10, 'mtime': 20, 'hash': 'abc'})
+        self.assertEqual(index.has_im, self.index.has_im)
+        for attr in ['spectrum_index', 'rt', 'ms_level', 'isolation_lower', 'isolation_upper', 'isolation_windows']:
+            np.testing.assert_array_equal(getattr(index, attr), getattr(self.index, attr))
+        np.testing.assert_array_equal(index.get_target_spectrum_indices(410, 0, 30), self.index.get_target_spectrum_indices(410, 0, 30))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,6 +4,7 @@ test/structs/test_TargetedDIAConfig
 """
 
 import unittest
+import numpy as np
 from massdash.structs.TargetedDIAConfig import TargetedDIAConfig
 
 class TestTargetedDIAConfig(unittest.TestCase):
@@ -82,6 +83,47 @@ class TestTargetedDIAConfig(unittest.TestCase):
         self.assertTrue(config.is_mz_in_product_mz_tol_window(105, [(100,105 )])) # upper boundary is inclusive 
         self.assertFalse(config.is_mz_in_product_mz_tol_window(95, [(100, 105)])) 
 
+    def test_get_upper_lower_tol_array(self):
+        config = TargetedDIAConfig()
+        config.mz_tol = 50
+        mzs = np.array([100, 500.25, 1000.5])
+        lower_tol, upper_tol = config.get_upper_lower_tol_array(mzs)
+        for mz, lower, upper in zip(mzs, lower_tol, upper_tol):
+            self.assertEqual((lower, upper), config.get_upper_lower_tol(mz))
+
+    def test_is_mz_in_product_mz_tol_window_array(self):
+        config = TargetedDIAConfig()
+        # overlapping and unsorted windows
+        bounds = [(300, 310), (100, 105), (104, 106), (200, 201)]
+        sorted_bounds = (np.array([100., 104., 200., 300.]), np.array([105., 106., 201., 310.]))
+        check_mz = np.array([95, 100, 104.5, 105, 105.5, 106, 106.5, 199, 200.5, 310, 311])
+        expected = [config.is_mz_in_product_mz_tol_window(mz, bounds) for mz in check_mz]
+        np.testing.assert_array_equal(config.is_mz_in_product_mz_tol_window_array(check_mz, sorted_bounds), expected)
+
+        # bounds as computed from product mz
+        product_mz = [504.2664, 591.2984, 704.3825]
+        product_mz_tol_bounds = config.get_product_mz_tol_bounds(product_mz)
+        check_mz = np.array([504.2664, 504.2764, 591.2984, 700, 704.3825])
+        expected = [config.is_mz_in_product_mz_tol_window(mz, [config.get_upper_lower_tol(p) for p in product_mz]) for mz in check_mz]
+        np.testing.assert_array_equal(config.is_mz_in_product_mz_tol_window_array(check_mz, product_mz_tol_bounds), expected)
+
+        # no product mz
+        self.assertFalse(config.is_mz_in_product_mz_tol_window_array(check_mz, config.get_product_mz_tol_bounds([])).any())
+
+    def test_get_hash(self):
+        config = TargetedDIAConfig()
+        other = TargetedDIAConfig()
+        self.assertEqual(config.get_hash(), other.get_hash())
+
+        # numerically equal parameters have equal hashes
+        other.update({'rt_window': 50.0, 'mz_tol': np.int64(20), 'mslevel': [2, 1]})
+        self.assertEqual(config.get_hash(), other.get_hash())
+
+        for key, value in [('ms1_mz_tol', 10), ('mz_tol', 10), ('rt_window', 10), ('im_window', None), ('mslevel', [2]), ('im_start', 0.8)]:
+            other = TargetedDIAConfig()
+            other.update({key: value})
+            self.assertNotEqual(config.get_hash(), other.get_hash())
+
 
 if __name__ == '__main__':
     unittest.main()